@@ -3,4 +3,19 @@ import os
 def pkg_path(*args):
     return os.path.join(PKG_ROOT, *args)
 
+def load_libc():
+    # ctypes.util imports subprocess, which the command-line tool
+    # shouldn't pay for unless it's actually needed.
+    import ctypes
+    import ctypes.util
+    return ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                       use_errno=True)
+
+def check_libc_result(result):
+    if result < 0:
+        import ctypes
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return result
+
 PKG_ROOT = os.path.dirname(os.path.abspath(__file__))
@@ -0,0 +1,295 @@
+"""
+Benchmarks badgepad against a synthetic project and reports the results
+as JSON, e.g.:
+
+    python -m badgepad.bench --assertions 10000 -o results.json
+"""
+
+import os
+import sys
+import time
+import json
+import base64
+import shutil
+import platform
+import resource
+import tempfile
+import sqlite3
+import argparse
+import subprocess
+import multiprocessing
+
+import yaml
+
+from . import pkg_path
+from .project import Project, find_yaml_loader
+from .build import build_website, PhaseTimer
+from .export import iter_assertion_records, export_ndjson, export_sqlite
+from .server import get_dir_state, rebuild
+
+PNG = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9Q'
+    'DwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+
+EVIDENCE = '''|
+  Recipient %(recipient)s did *great things* to earn %(badge)s:
+
+  * wrote [some code](http://example.org/%(recipient)s)
+  * reviewed it
+  * shipped it
+'''
+
+def write(content, *path):
+    f = open(os.path.join(*path), 'wb')
+    f.write(content)
+    f.close()
+
+def generate_project(root_dir, recipients=100, badges=10, assertions=1000):
+    """
+    Creates a project in root_dir with the given number of recipients,
+    badge classes (each with an image) and assertions (each with markdown
+    evidence). Assertions are spread across recipients first, so there
+    can be at most recipients * badges of them.
+    """
+
+    config = yaml.load(open(pkg_path('samples', 'config.yml')).read(),
+                       find_yaml_loader())
+    config['recipients'] = dict(
+        ('r%d' % i, 'Recipient %d <r%d@example.org>' % (i, i))
+        for i in range(recipients)
+    )
+    for dirname in ('badges', 'assertions', 'static'):
+        os.makedirs(os.path.join(root_dir, dirname))
+    write(yaml.dump(config), root_dir, 'config.yml')
+    write('body { color: black; }', root_dir, 'static', 'style.css')
+    for i in range(badges):
+        write('name: Badge %d\ndescription: Badge number %d.\n---\n'
+              '# Criteria\n\nDo *thing* number %d.\n' % (i, i, i),
+              root_dir, 'badges', 'b%d.yml' % i)
+        write(PNG, root_dir, 'badges', 'b%d.png' % i)
+    for i in range(min(assertions, recipients * badges)):
+        context = dict(recipient='r%d' % (i % recipients),
+                       badge='b%d' % (i / recipients))
+        write('issuedOn: %d\n--- %s' % (1370000000 + i, EVIDENCE % context),
+              root_dir, 'assertions', '%(recipient)s.%(badge)s.yml' % context)
+
+# Runs a badgepad command and prints, as JSON on its last line of output,
+# how long it took and how long each module it imported took to import,
+# including the modules that one imported in turn, like the cumulative
+# column of python -X importtime.
+IMPORT_PROBE = r"""
+import sys, time, json, __builtin__
+from cStringIO import StringIO
+
+real_import = __builtin__.__import__
+imports = {}
+
+def timed_import(name, *args, **kwargs):
+    before = set(sys.modules)
+    start = time.time()
+    try:
+        return real_import(name, *args, **kwargs)
+    finally:
+        elapsed = time.time() - start
+        for module in set(sys.modules) - before:
+            if (sys.modules[module] is not None and module not in imports
+                and (module == name or module.endswith('.' + name) or
+                     name.startswith(module + '.'))):
+                imports[module] = elapsed
+
+__builtin__.__import__ = timed_import
+start = time.time()
+sys.stdout = StringIO()
+try:
+    import badgepad.cmdline
+    badgepad.cmdline.main(sys.argv[1:])
+except SystemExit:
+    pass
+elapsed = time.time() - start
+sys.stdout = sys.__stdout__
+print json.dumps({'seconds': elapsed, 'imports': imports})
+"""
+
+STARTUP_COMMANDS = [
+    ('init', ['init']),
+    ('newbadge', ['newbadge', 'startup']),
+    ('issue', ['issue', 'r0', 'b0']),
+    ('issue-bulk', ['issue-bulk', 'b0']),
+    ('hash-identities', ['hash-identities']),
+    ('compile-templates', ['compile-templates']),
+    ('build', ['build', '--no-cache'])
+]
+
+def profile_command(root_dir, argv):
+    """
+    Runs a badgepad command on the project in root_dir in a new Python
+    process and returns how long it took, in seconds, and how long it
+    took to import each top-level module that it imported.
+    """
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(pkg_path())] +
+        filter(None, [os.environ.get('PYTHONPATH')])
+    )
+    process = subprocess.Popen(
+        [sys.executable, '-c', IMPORT_PROBE, '--root-dir', root_dir] + argv,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env
+    )
+    output = process.communicate('')[0]
+    report = json.loads(output.splitlines()[-1])
+    report['imports'] = dict((module, seconds) for module, seconds
+                             in report['imports'].items()
+                             if '.' not in module)
+    return report
+
+def run_startup_benchmarks(tmpdir):
+    """
+    Times each command on a tiny project, so that what's measured is
+    mostly how long the command takes to start up.
+    """
+
+    root_dir = os.path.join(tmpdir, 'tiny')
+    generate_project(root_dir, recipients=1, badges=1, assertions=0)
+    results = {}
+    for name, argv in STARTUP_COMMANDS:
+        if name == 'init':
+            empty_dir = os.path.join(tmpdir, 'empty')
+            os.mkdir(empty_dir)
+            results[name] = profile_command(empty_dir, argv)
+        else:
+            results[name] = profile_command(root_dir, argv)
+    return results
+
+def timed(func, *args, **kwargs):
+    start = time.time()
+    func(*args, **kwargs)
+    return time.time() - start
+
+def report_peak_rss_growth(queue, func, args):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    func(*args)
+    queue.put(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before)
+
+def peak_rss_growth(func, *args):
+    """
+    Calls func in a forked process and returns how much it raised that
+    process's peak resident set size, in kilobytes.
+    """
+
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=report_peak_rss_growth,
+                                      args=(queue, func, args))
+    process.start()
+    growth = queue.get()
+    process.join()
+    return growth
+
+def full_build(root_dir, dest_dir):
+    build_website(Project(root_dir), dest_dir)
+
+def load_everything(root_dir):
+    project = Project(root_dir)
+    list(project.badges)
+    list(project.assertions)
+
+def export_both(root_dir, ndjson_filename, sqlite_filename):
+    f = open(ndjson_filename, 'wb')
+    export_ndjson(iter_assertion_records(Project(root_dir)), f)
+    f.close()
+    export_sqlite(iter_assertion_records(Project(root_dir)),
+                  sqlite_filename)
+
+def query_export(sqlite_filename, recipient, badge):
+    db = sqlite3.connect(sqlite_filename)
+    db.execute('SELECT json FROM assertions WHERE recipient = ?',
+               (recipient,)).fetchall()
+    db.execute('SELECT json FROM assertions WHERE badge = ?',
+               (badge,)).fetchall()
+    db.close()
+
+def run_benchmarks(root_dir, dest_dir, jobs=1):
+    """
+    Times the main operations badgepad performs on the project in
+    root_dir, building into dest_dir, and returns a dict of results in
+    seconds.
+    """
+
+    results = {}
+    results['load_project'] = timed(load_everything, root_dir)
+    timer = PhaseTimer()
+    results['build'] = timed(build_website, Project(root_dir), dest_dir,
+                             jobs=jobs, timer=timer)
+    results['build_phases'] = dict((phase['name'], phase['wall'])
+                                   for phase in timer.phases)
+    build_website(Project(root_dir), dest_dir, incremental=True)
+    results['incremental_build_unchanged'] = timed(
+        build_website, Project(root_dir), dest_dir, incremental=True
+    )
+    results['get_dir_state'] = timed(get_dir_state, root_dir)
+    results['build_peak_rss_growth_kb'] = peak_rss_growth(full_build,
+                                                          root_dir, dest_dir)
+
+    project = rebuild(None, root_dir, dest_dir, None)
+    assertion = sorted(os.listdir(os.path.join(root_dir, 'assertions')))[0]
+    filename = os.path.join(root_dir, 'assertions', assertion)
+    future = time.time() + 10
+    os.utime(filename, (future, future))
+    results['serve_rebuild_one_assertion'] = timed(
+        rebuild, project, root_dir, dest_dir, set([filename])
+    )
+
+    sqlite_filename = dest_dir + '-assertions.sqlite'
+    results['export'] = timed(export_both, root_dir,
+                              dest_dir + '-assertions.ndjson',
+                              sqlite_filename)
+    recipient, badge = assertion.split('.')[:2]
+    results['export_query'] = timed(query_export, sqlite_filename,
+                                    recipient, badge)
+    return results
+
+def main(argv=None, stdout=sys.stdout):
+    parser = argparse.ArgumentParser(prog='python -m badgepad.bench',
+                                     description='Benchmark badgepad.')
+    parser.add_argument('--recipients', type=int, default=100)
+    parser.add_argument('--badges', type=int, default=10)
+    parser.add_argument('--assertions', type=int, default=1000)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes to build with')
+    parser.add_argument('-o', '--output',
+                        help='file to write JSON results to (default is '
+                             'standard output)')
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        root_dir = os.path.join(tmpdir, 'project')
+        generate_project(root_dir, recipients=args.recipients,
+                         badges=args.badges, assertions=args.assertions)
+        results = run_benchmarks(root_dir, os.path.join(tmpdir, 'dist'),
+                                 jobs=args.jobs)
+        results['startup'] = run_startup_benchmarks(tmpdir)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    report = json.dumps({
+        'timestamp': int(time.time()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'yaml_loader': find_yaml_loader().__name__,
+        'size': {
+            'recipients': args.recipients,
+            'badges': args.badges,
+            'assertions': min(args.assertions, args.recipients * args.badges),
+            'jobs': args.jobs
+        },
+        'results': results
+    }, sort_keys=True, indent=True)
+    if args.output:
+        write(report, args.output)
+    else:
+        stdout.write(report + '\n')
+
+if __name__ == '__main__':
+    main()
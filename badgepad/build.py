@@ -1,52 +1,716 @@
 import os
 import shutil
 import json
+import hashlib
+import time
+import collections
+import tempfile
+import multiprocessing
+from contextlib import contextmanager
 
 import jinja2
 
-from . import pkg_path
+from . import pkg_path, load_libc, check_libc_result, stats
+from .project import Project
+from .cache import ParseCache
+from .writers import make_dirs, is_archive, open_archive, DirectoryWriter, \
+                     OutputCollector, remove_file, VARIANT_SUFFIXES
+from .stats import count
 
-def write_data(data, *filename):
-    abspath = os.path.join(*filename)
+def fingerprint(inputs, stats=None):
+    """
+    Returns a hash of the names, modification times and sizes of the
+    given input files. If a stats dict is passed in, it's used to
+    remember the stats of files across calls.
+    """
+
+    if stats is None:
+        stats = {}
+    parts = []
+    for filename in inputs:
+        if filename not in stats:
+            try:
+                stat = os.stat(filename)
+                stats[filename] = '%r:%d' % (stat.st_mtime, stat.st_size)
+            except OSError:
+                stats[filename] = 'missing'
+        parts.append('%s:%s' % (filename, stats[filename]))
+    return hashlib.sha1('\n'.join(parts)).hexdigest()
+
+class Manifest(object):
+    """
+    Records the inputs each output file was built from, so that an
+    incremental build can skip outputs whose inputs haven't changed and
+    remove outputs whose sources have disappeared.
+
+    If record is false, nothing is recorded and every output is
+    considered stale, which keeps full builds from holding on to
+    anything per output.
+    """
+
+    FILENAME = '.badgepad-manifest.json'
+    VERSION = 1
+
+    def __init__(self, dest_dir, base_url, load=True, record=True,
+                 compact=False, precompress=False):
+        self.dest_dir = os.path.abspath(dest_dir)
+        self.base_url = base_url
+        self.record = record
+        self.compact = compact
+        self.precompress = precompress
+        self.filename = os.path.join(self.dest_dir, self.FILENAME)
+        self.previous = {}
+        self.outputs = {}
+        self.rebuilt = 0
+        self.__stats = {}
+        if load and os.path.exists(self.filename):
+            data = json.load(open(self.filename))
+            if (data.get('version') == self.VERSION and
+                data.get('base_url') == base_url and
+                data.get('compact', False) == compact and
+                data.get('precompress', False) == precompress):
+                self.previous = data['outputs']
+
+    def is_fresh(self, path, inputs):
+        """
+        Records the given inputs for the output at path (a tuple of path
+        components relative to the destination directory) and returns
+        whether the output already exists and was built from the very
+        same inputs.
+        """
+
+        if not self.record:
+            self.rebuilt += 1
+            return False
+        output = '/'.join(path)
+        self.outputs[output] = fingerprint(inputs, self.__stats)
+        fresh = (self.previous.get(output) == self.outputs[output] and
+                 os.path.exists(os.path.join(self.dest_dir, *path)))
+        if not fresh:
+            self.rebuilt += 1
+        return fresh
+
+    @property
+    def removed(self):
+        return sorted(set(self.previous) - set(self.outputs))
+
+    def remove_stale_outputs(self):
+        for output in self.removed:
+            remove_output(self.dest_dir, output.split('/'))
+
+    def save(self):
+        f = open(self.filename, 'w')
+        json.dump({
+            'version': self.VERSION,
+            'base_url': self.base_url,
+            'compact': self.compact,
+            'precompress': self.precompress,
+            'outputs': self.outputs
+        }, f, sort_keys=True, indent=True)
+        f.close()
+
+def remove_output(dest_dir, path):
+    """
+    Removes the output at path (a sequence of path components relative
+    to dest_dir) if it exists, along with any precompressed siblings and
+    any directories it leaves empty. If the output is a directory, e.g.
+    for a deleted static directory, it's removed with everything in it.
+    """
+
+    dest_dir = os.path.abspath(dest_dir)
+    abspath = os.path.join(dest_dir, *path)
+    if os.path.isdir(abspath):
+        shutil.rmtree(abspath)
+    for suffix in ('',) + VARIANT_SUFFIXES:
+        remove_file(abspath + suffix)
     dirname = os.path.dirname(abspath)
-    if not os.path.exists(dirname):
-        os.makedirs(dirname)
-    f = open(abspath, 'w')
-    if abspath.endswith('.json'):
-        json.dump(data, f, sort_keys=True, indent=True)
-    else:
-        if isinstance(data, unicode):
-            data = data.encode('utf-8')
-        f.write(data)
-    f.close()
+    while (dirname != dest_dir and os.path.isdir(dirname) and
+           not os.listdir(dirname)):
+        os.rmdir(dirname)
+        dirname = os.path.dirname(dirname)
+
+class BytecodeCache(jinja2.FileSystemBytecodeCache):
+    """
+    A bytecode cache that's safe to share between worker processes,
+    since it writes each file to a temporary name and then renames it
+    into place.
+    """
+
+    def dump_bytecode(self, bucket):
+        filename = self._get_cache_filename(bucket)
+        tmpname = '%s.%d.tmp' % (filename, os.getpid())
+        f = open(tmpname, 'wb')
+        try:
+            bucket.write_bytecode(f)
+        finally:
+            f.close()
+        os.rename(tmpname, filename)
+
+class TemplateLoader(jinja2.FileSystemLoader):
+    """
+    A template loader that also considers a template out of date when
+    a file that would override it appears earlier in the search path,
+    e.g. when a project starts customizing one of the default templates.
+    """
+
+    def get_source(self, environment, template):
+        source, filename, uptodate = jinja2.FileSystemLoader.get_source(
+            self, environment, template
+        )
+        pieces = jinja2.loaders.split_template_path(template)
+        candidates = [os.path.join(searchpath, *pieces)
+                      for searchpath in self.searchpath]
+        overrides = candidates[:candidates.index(filename)]
+        def is_uptodate():
+            if any(os.path.exists(path) for path in overrides):
+                return False
+            return uptodate()
+        return source, filename, is_uptodate
+
+_jinja_envs = {}
+
+def make_jinja_env(project):
+    """
+    Returns the Jinja environment for the project's templates.
+
+    Environments are shared by everything that renders the same
+    templates, so that each template is only compiled once per process
+    and then recompiled only if it changes. If the project has a cache
+    open, compiled templates are also kept in it between runs.
+    """
+
+    cache_dir = None
+    if project.cache is not None:
+        cache_dir = os.path.join(os.path.dirname(project.cache.filename),
+                                 'templates')
+    key = (project.TEMPLATES_DIR, cache_dir)
+    if key not in _jinja_envs:
+        loader = TemplateLoader([
+            project.TEMPLATES_DIR,
+            pkg_path('samples', 'templates')
+        ])
+        bytecode_cache = None
+        if cache_dir is not None:
+            make_dirs(cache_dir)
+            bytecode_cache = BytecodeCache(cache_dir)
+        _jinja_envs[key] = jinja2.Environment(loader=loader,
+                                              bytecode_cache=bytecode_cache)
+    return _jinja_envs[key]
+
+def compile_templates(project):
+    """
+    Compiles all of the project's templates, storing them in its cache
+    if it has one open, and returns their names.
+    """
+
+    jinja_env = make_jinja_env(project)
+    names = jinja_env.list_templates()
+    for name in names:
+        jinja_env.get_template(name)
+    return names
+
+def template_inputs(project, template):
+    inputs = [template.filename]
+    for dirpath, dirnames, filenames in os.walk(project.TEMPLATES_DIR):
+        inputs.extend([os.path.join(dirpath, filename)
+                       for filename in sorted(filenames)])
+    return inputs
+
+def parse_assertions(project, todo):
+    # Assertions are parsed afresh rather than loaded, so that they can
+    # be garbage collected as soon as their outputs are written.
+    for filename, write_json, write_html in todo:
+        yield project.assertions.parse(filename), write_json, write_html
+
+def render_assertion_outputs(template, parsed):
+    for assn, write_json, write_html in parsed:
+        if write_json:
+            yield assn.json, assn.paths['json']
+        if write_html:
+            count('template_renders')
+            yield template.render(assertion=assn), assn.paths['html']
+
+def write_outputs(writer, outputs):
+    for data, path in outputs:
+        writer.write(data, path)
+
+def render_assertions(project, jinja_env, writer, todo):
+    """
+    Renders the given todo list of (filename, write_json, write_html)
+    tuples, which may be a generator, one assertion at a time.
+    """
 
-def export_assertions(project, jinja_env, base_dest_dir):
     template = jinja_env.get_template('assertion.html')
-    for assn in project.assertions:
-        write_data(assn.json, base_dest_dir, *assn.paths['json'])
-        evidence_html = template.render(assertion=assn)
-        write_data(evidence_html, base_dest_dir, *assn.paths['html'])
+    write_outputs(writer, render_assertion_outputs(
+        template,
+        parse_assertions(project, todo)
+    ))
 
-def export_badge_classes(project, jinja_env, base_dest_dir):
+def render_badge_classes(project, jinja_env, writer, todo):
     template = jinja_env.get_template('badge.html')
-    for badge in project.badges:
-        write_data(badge.json, base_dest_dir, *badge.paths['json'])
-        criteria_html = template.render(badge=badge)
-        write_data(criteria_html, base_dest_dir, *badge.paths['html'])
-        if badge.image_url:
-            shutil.copy(badge.image_filename,
-                        os.path.join(base_dest_dir, *badge.paths['png']))
-
-def build_website(project, dest_dir):
-    loader = jinja2.FileSystemLoader([
-        project.TEMPLATES_DIR,
-        pkg_path('samples', 'templates')
-    ])
-    env = jinja2.Environment(loader=loader)
-    if os.path.exists(dest_dir):
-        shutil.rmtree(dest_dir)
-    if os.path.exists(project.STATIC_DIR):
-        shutil.copytree(project.STATIC_DIR, dest_dir)
-    write_data(project.config['issuer'], dest_dir, *project.paths['json'])
-    export_badge_classes(project, env, dest_dir)
-    export_assertions(project, env, dest_dir)
+    for slug, write_json, write_html, copy_png in todo:
+        badge = project.badges[slug]
+        if write_json:
+            writer.write(badge.json, badge.paths['json'])
+        if write_html:
+            count('template_renders')
+            writer.write(template.render(badge=badge), badge.paths['html'])
+        if copy_png:
+            writer.copy(badge.image_filename, badge.paths['png'])
+
+RENDERERS = {
+    'assertions': render_assertions,
+    'badges': render_badge_classes
+}
+
+_worker = {}
+
+def init_worker(root_dir, base_url, cache_filename=None):
+    project = Project(root_dir)
+    if cache_filename is not None:
+        project.cache = ParseCache(cache_filename)
+    project.set_base_url(base_url)
+    _worker['project'] = project
+    _worker['jinja_env'] = make_jinja_env(project)
+
+def render_in_worker(task):
+    """
+    Renders a chunk of work in a worker process, returning the time it
+    took along with the changes it made to the worker's stats counters.
+
+    If no writer is given, the outputs are collected and returned too,
+    to be written by the parent process.
+    """
+
+    kind, writer, todo = task
+    collector = None
+    if writer is None:
+        writer = collector = OutputCollector()
+    before = stats.snapshot()
+    start = time.time()
+    RENDERERS[kind](_worker['project'], _worker['jinja_env'], writer, todo)
+    if _worker['project'].cache is not None:
+        _worker['project'].cache.flush()
+    return time.time() - start, stats.since(before), collector
+
+def chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+class Renderer(object):
+    """
+    Renders lists of outputs, either in this process or spread across a
+    pool of worker processes which each load their own copy of the
+    project from disk.
+
+    Todo lists may be generators, in which case they're consumed as
+    rendering proceeds: only a few chunks per worker are ever queued up.
+    """
+
+    CHUNK_SIZE = 64
+
+    def __init__(self, project, jobs=1):
+        self.project = project
+        self.jinja_env = make_jinja_env(project)
+        self.jobs = jobs
+        self.pool = None
+        if jobs > 1:
+            self.pool = multiprocessing.Pool(jobs, init_worker, (
+                project.ROOT,
+                project.config['issuer']['url'],
+                project.cache and project.cache.filename
+            ))
+
+    def render(self, kind, writer, todo):
+        """
+        Renders the given todo list with writer and returns the time spent
+        doing so, summed across all workers.
+        """
+
+        if self.pool is None:
+            start = time.time()
+            RENDERERS[kind](self.project, self.jinja_env, writer, todo)
+            return time.time() - start
+        if self.project.cache is not None:
+            # Don't keep workers waiting on our uncommitted writes.
+            self.project.cache.flush()
+        shared_writer = writer if writer.SHAREABLE else None
+        pending = collections.deque()
+        work = [0]
+        def finish(result):
+            elapsed, changes, collector = result.get()
+            work[0] += elapsed
+            stats.merge(changes)
+            if collector is not None:
+                collector.replay(writer)
+        for chunk in chunks(todo, self.CHUNK_SIZE):
+            pending.append(self.pool.apply_async(render_in_worker, [
+                (kind, shared_writer, chunk)
+            ]))
+            if len(pending) > self.jobs * 2:
+                finish(pending.popleft())
+        while pending:
+            finish(pending.popleft())
+        return work[0]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+    def terminate(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+
+class PhaseTimer(object):
+    """
+    Records the wall-clock time of each build phase and what happened
+    during it, as measured by the stats counters. Also records the amount
+    of rendering work done, which exceeds the wall time when rendering
+    happens in parallel.
+
+    Phases can be nested, and are listed in the order they started.
+    """
+
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        record = {'name': name, 'work': None}
+        self.phases.append(record)
+        before = stats.snapshot()
+        start = time.time()
+        yield record
+        record['wall'] = time.time() - start
+        record['counts'] = stats.since(before)
+        if record['work'] is None:
+            record['work'] = record['wall']
+
+    def speedup(self, record):
+        if not record['wall']:
+            return 1.0
+        return record['work'] / record['wall']
+
+    def describe(self, record):
+        counts = ', '.join('%s=%d' % item
+                           for item in sorted(record['counts'].items()))
+        description = '%s: %.3fs wall' % (record['name'], record['wall'])
+        if record['work'] > record['wall']:
+            description += ', %.3fs work (%.1fx speedup)' % (
+                record['work'],
+                self.speedup(record)
+            )
+        if counts:
+            description += ' (%s)' % counts
+        return description
+
+    def totals(self):
+        """
+        Returns the counts of everything that happened across all of the
+        top-level phases.
+        """
+
+        totals = collections.Counter()
+        for record in self.phases:
+            if '.' not in record['name']:
+                totals.update(record['counts'])
+        return totals
+
+    def report(self):
+        return {'phases': self.phases}
+
+def assertion_inputs(project, filename, badge):
+    inputs = [filename, project.path('config.yml'),
+              project.path('badges', '%s.yml' % badge),
+              project.path('badges', '%s.png' % badge)]
+    if project.recipients_filename:
+        inputs.append(project.recipients_filename)
+    return inputs
+
+def badge_inputs(project, filename):
+    return [filename, project.path('config.yml'),
+            os.path.splitext(filename)[0] + '.png']
+
+def plan_assertions(project, manifest, html_inputs):
+    for recipient, badge, filename in project.assertions.index['all']:
+        paths = project.assertion_paths(recipient, badge)
+        inputs = assertion_inputs(project, filename, badge)
+        write_json = not manifest.is_fresh(paths['json'], inputs)
+        write_html = not manifest.is_fresh(paths['html'],
+                                           inputs + html_inputs)
+        if write_json or write_html:
+            yield filename, write_json, write_html
+
+def export_assertions(project, renderer, writer, manifest):
+    # Planning, parsing, rendering and writing are all chained generators,
+    # so that only a handful of assertions are in memory at once.
+    template = renderer.jinja_env.get_template('assertion.html')
+    html_inputs = template_inputs(project, template)
+    return renderer.render('assertions', writer,
+                           plan_assertions(project, manifest, html_inputs))
+
+def export_badge_classes(project, renderer, writer, manifest, timer):
+    with timer.phase('badges.plan'):
+        template = renderer.jinja_env.get_template('badge.html')
+        html_inputs = template_inputs(project, template)
+        todo = []
+        for badge in project.badges:
+            inputs = badge_inputs(project, badge.filename)
+            write_json = not manifest.is_fresh(badge.paths['json'], inputs)
+            write_html = not manifest.is_fresh(badge.paths['html'],
+                                               inputs + html_inputs)
+            copy_png = bool(badge.image_url and not manifest.is_fresh(
+                badge.paths['png'],
+                [badge.image_filename]
+            ))
+            if write_json or write_html or copy_png:
+                todo.append((badge.basename, write_json, write_html,
+                             copy_png))
+    with timer.phase('badges.render') as phase:
+        phase['work'] = renderer.render('badges', writer, todo)
+    return phase['work']
+
+def static_path(project, abspath):
+    return tuple(os.path.relpath(abspath, project.STATIC_DIR).split(os.sep))
+
+def iter_static_files(dirname):
+    for dirpath, dirnames, filenames in os.walk(dirname):
+        for filename in filenames:
+            yield os.path.join(dirpath, filename)
+
+def export_static_files(project, writer, manifest):
+    for abspath in iter_static_files(project.STATIC_DIR):
+        path = static_path(project, abspath)
+        if not manifest.is_fresh(path, [abspath]):
+            writer.copy(abspath, path)
+
+def find_affected_outputs(project, changed):
+    """
+    Maps a set of changed source paths to the badge class slugs,
+    assertion filenames and static files whose outputs need to be
+    regenerated or removed, or returns None if the changes affect the
+    whole website.
+    """
+
+    affected = {'badges': set(), 'assertions': set(), 'static': set()}
+    for path in changed:
+        path = os.path.abspath(path)
+        dirname, filename = os.path.split(path)
+        slug, ext = os.path.splitext(filename)
+        if path.startswith(project.STATIC_DIR + os.sep):
+            affected['static'].add(path)
+        elif dirname == project.BADGES_DIR:
+            if ext in ('.yml', '.png'):
+                affected['badges'].add(slug)
+                affected['assertions'].update(
+                    project.assertions.filenames(badge=slug)
+                )
+        elif dirname == project.ASSERTIONS_DIR:
+            if ext == '.yml':
+                affected['assertions'].add(path)
+        elif (path.startswith(project.TEMPLATES_DIR + os.sep) or
+              path in (project.path('config.yml'), project.TEMPLATES_DIR,
+                       project.STATIC_DIR, project.BADGES_DIR,
+                       project.ASSERTIONS_DIR,
+                       project.recipients_filename)):
+            return None
+    return affected
+
+def update_website(project, dest_dir, affected, renderer=None,
+                   precompress=False):
+    """
+    Updates an existing build of the project in dest_dir in place,
+    regenerating or removing only the outputs named by affected, as
+    returned by find_affected_outputs().
+    """
+
+    if renderer is None:
+        renderer = Renderer(project)
+    writer = DirectoryWriter(dest_dir, precompress=precompress)
+    badge_todo = []
+    for slug in sorted(affected['badges']):
+        paths = project.badge_paths(slug)
+        if slug not in project.badges:
+            for path in paths.values():
+                remove_output(dest_dir, path)
+            continue
+        badge = project.badges[slug]
+        if not badge.image_url:
+            remove_output(dest_dir, paths['png'])
+        badge_todo.append((slug, True, True, bool(badge.image_url)))
+    assertion_todo = []
+    for filename in sorted(affected['assertions']):
+        if os.path.exists(filename):
+            assertion_todo.append((filename, True, True))
+            continue
+        basename = os.path.basename(os.path.splitext(filename)[0])
+        recipient, badge = basename.split('.')
+        for path in project.assertion_paths(recipient, badge).values():
+            remove_output(dest_dir, path)
+    for abspath in sorted(affected['static']):
+        if os.path.isfile(abspath):
+            writer.copy(abspath, static_path(project, abspath))
+        elif os.path.isdir(abspath):
+            # A directory that was moved or copied into static/ only
+            # shows up as a change to the directory itself.
+            for filename in iter_static_files(abspath):
+                writer.copy(filename, static_path(project, filename))
+        else:
+            remove_output(dest_dir, static_path(project, abspath))
+    renderer.render('badges', writer, badge_todo)
+    renderer.render('assertions', writer, assertion_todo)
+
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+
+def exchange_paths(a, b, libc=None):
+    """
+    Atomically swaps two paths using renameat2(2). Raises OSError or
+    AttributeError if that isn't supported.
+    """
+
+    if libc is None:
+        libc = load_libc()
+    check_libc_result(libc.renameat2(AT_FDCWD, a, AT_FDCWD, b,
+                                     RENAME_EXCHANGE))
+
+def make_staging_dir(dest_dir):
+    """
+    Creates an empty directory next to dest_dir that a new build can be
+    written to before it's swapped into place.
+    """
+
+    dest_dir = os.path.abspath(dest_dir)
+    parent, basename = os.path.split(dest_dir)
+    if not os.path.exists(parent):
+        os.makedirs(parent)
+    staging_dir = tempfile.mkdtemp(prefix='.%s-' % basename, dir=parent)
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(staging_dir, 0777 & ~umask)
+    return staging_dir
+
+def swap_into_place(staging_dir, dest_dir):
+    """
+    Replaces dest_dir with staging_dir, so that anything reading from
+    dest_dir sees either the old build or the new one, never a mix.
+
+    If dest_dir is a symlink, it's atomically re-pointed at staging_dir.
+    Otherwise the two directories are atomically exchanged if the
+    platform supports it, or renamed one after the other if not.
+    """
+
+    dest_dir = os.path.abspath(dest_dir)
+    parent = os.path.dirname(dest_dir)
+    if os.path.islink(dest_dir):
+        old_target = os.path.realpath(dest_dir)
+        link = staging_dir + '.link'
+        os.symlink(os.path.basename(staging_dir), link)
+        os.rename(link, dest_dir)
+        # Only clean up old builds we created ourselves.
+        if (os.path.dirname(old_target) == parent and
+            os.path.basename(old_target).startswith(
+                '.%s-' % os.path.basename(dest_dir)
+            )):
+            shutil.rmtree(old_target)
+    elif os.path.isdir(dest_dir):
+        try:
+            exchange_paths(staging_dir, dest_dir)
+        except (OSError, AttributeError):
+            old_dir = staging_dir + '.old'
+            os.rename(dest_dir, old_dir)
+            os.rename(staging_dir, dest_dir)
+            staging_dir = old_dir
+        shutil.rmtree(staging_dir)
+    else:
+        os.rename(staging_dir, dest_dir)
+
+def build_website(project, dest_dir, incremental=False, jobs=1, timer=None,
+                  compact=False, link_mode='copy', precompress=False):
+    """
+    Builds the project's static website into dest_dir.
+
+    If incremental is true, the previous build in dest_dir is updated in
+    place, regenerating only the outputs whose inputs have changed.
+    If that build fails, the outputs written so far stay in dest_dir,
+    but its manifest isn't saved, so the next incremental build
+    regenerates them. Otherwise everything is regenerated in a staging
+    directory which then replaces dest_dir via swap_into_place(), and if
+    the build fails, dest_dir is left as it was.
+
+    If dest_dir is named like a tar or zip archive, the website is
+    written into a new archive instead, which replaces any old one once
+    it's complete. Archives can't be built incrementally.
+
+    If jobs is greater than one, badge classes and assertions are
+    rendered by a pool of that many worker processes. If a PhaseTimer
+    is passed in, the duration of each phase is recorded in it. If
+    compact is true, JSON files are written without any whitespace.
+    Badge images and static files are copied, hard-linked or reflinked
+    according to link_mode, unless they're already there. If precompress
+    is true, every JSON and HTML file also gets a gzipped sibling, plus a
+    brotli one if the brotli module is installed.
+
+    Returns the build's Manifest.
+    """
+
+    archive = is_archive(dest_dir)
+    if archive and incremental:
+        raise ValueError('archives cannot be built incrementally')
+    if timer is None:
+        timer = PhaseTimer()
+    renderer = Renderer(project, jobs=jobs)
+    if incremental:
+        writer = DirectoryWriter(dest_dir, compact=compact,
+                                 link_mode=link_mode, precompress=precompress)
+    elif archive:
+        writer = open_archive(dest_dir, compact=compact,
+                              precompress=precompress)
+    else:
+        previous_dir = None
+        if os.path.isdir(dest_dir):
+            previous_dir = os.path.realpath(dest_dir)
+        writer = DirectoryWriter(make_staging_dir(dest_dir), previous_dir,
+                                 compact=compact, link_mode=link_mode,
+                                 precompress=precompress)
+    manifest = Manifest(dest_dir, project.config['issuer']['url'],
+                        load=incremental, record=incremental,
+                        compact=compact, precompress=precompress)
+    try:
+        with timer.phase('static'):
+            export_static_files(project, writer, manifest)
+        with timer.phase('issuer'):
+            if not manifest.is_fresh(project.paths['json'],
+                                     [project.path('config.yml')]):
+                writer.write(project.config['issuer'], project.paths['json'])
+        with timer.phase('badges') as phase:
+            phase['work'] = export_badge_classes(project, renderer, writer,
+                                                 manifest, timer)
+        with timer.phase('assertions') as phase:
+            phase['work'] = export_assertions(project, renderer, writer,
+                                              manifest)
+    except:
+        renderer.terminate()
+        writer.abort()
+        if not (incremental or archive):
+            shutil.rmtree(writer.dest_dir)
+        raise
+    renderer.close()
+    if incremental:
+        manifest.remove_stale_outputs()
+        manifest.save()
+    else:
+        with timer.phase('publish'):
+            if archive:
+                writer.close()
+            else:
+                swap_into_place(writer.dest_dir, dest_dir)
+    return manifest
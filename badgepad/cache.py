@@ -0,0 +1,148 @@
+import os
+import time
+import sqlite3
+import hashlib
+import cPickle as pickle
+
+class ParseCache(object):
+    """
+    A persistent cache of parsing results, such as YAML documents and
+    rendered markdown, stored in an SQLite database and keyed by a hash
+    of whatever was parsed.
+
+    Writes are buffered in memory until flush() is called, or until
+    enough of them pile up to be worth flushing anyway. When the
+    cache grows beyond max_size bytes, the least recently used entries
+    are evicted.
+
+    It also keeps a table of hashed recipient identities, which are
+    loaded by salt in bulk and aren't subject to eviction.
+    """
+
+    # Bump this whenever what's parsed could change, e.g. when the YAML
+    # loader changes, so entries from older versions are never used.
+    VERSION = 2
+    MAX_PENDING = 1000
+    MAX_VARIABLES = 500
+
+    def __init__(self, filename, max_size=64 * 1024 * 1024):
+        self.filename = filename
+        self.max_size = max_size
+        self.pending = {}
+        self.accessed = set()
+        self.new_identities = {}
+        dirname = os.path.dirname(filename)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self.db = sqlite3.connect(filename, timeout=60)
+        self.db.text_factory = str
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                        'key TEXT PRIMARY KEY, value BLOB, '
+                        'size INTEGER, accessed REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_accessed '
+                        'ON entries (accessed)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS identities ('
+                        'email TEXT, salt TEXT, identity TEXT, '
+                        'PRIMARY KEY (email, salt))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS identities_salt '
+                        'ON identities (salt)')
+        self.db.commit()
+
+    def key(self, kind, content):
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        return '%s:%d:%s' % (kind, self.VERSION,
+                             hashlib.sha1(content).hexdigest())
+
+    def get(self, kind, content):
+        """
+        Returns the cached result of parsing content as the given kind
+        of thing, or None if there isn't one.
+        """
+
+        key = self.key(kind, content)
+        value = self.pending.get(key)
+        if value is None:
+            row = self.db.execute('SELECT value FROM entries WHERE key = ?',
+                                  (key,)).fetchone()
+            if row is None:
+                return None
+            value = str(row[0])
+            self.accessed.add(key)
+        return pickle.loads(value)
+
+    def set(self, kind, content, result):
+        self.pending[self.key(kind, content)] = pickle.dumps(result, 2)
+        if len(self.pending) + len(self.accessed) >= self.MAX_PENDING:
+            self.flush()
+
+    def identities(self, salts):
+        """
+        Returns a dict mapping (email, salt) tuples to hashed identities
+        for every identity in the cache with one of the given salts.
+        """
+
+        salts = set(salts)
+        identities = {}
+        chunks = list(salts)
+        for i in range(0, len(chunks), self.MAX_VARIABLES):
+            chunk = chunks[i:i + self.MAX_VARIABLES]
+            identities.update(
+                ((email, salt), identity)
+                for email, salt, identity in self.db.execute(
+                    'SELECT email, salt, identity FROM identities '
+                    'WHERE salt IN (%s)' % ','.join('?' * len(chunk)), chunk
+                )
+            )
+        identities.update((pair, identity) for pair, identity
+                          in self.new_identities.items()
+                          if pair[1] in salts)
+        return identities
+
+    def add_identities(self, identities):
+        self.new_identities.update(identities)
+        if len(self.new_identities) >= self.MAX_PENDING:
+            self.flush()
+
+    def flush(self):
+        now = time.time()
+        self.db.executemany(
+            'INSERT OR REPLACE INTO identities VALUES (?, ?, ?)',
+            [(email, salt, identity) for (email, salt), identity
+             in self.new_identities.items()]
+        )
+        self.new_identities.clear()
+        self.db.executemany(
+            'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+            [(key, sqlite3.Binary(value), len(value), now)
+             for key, value in self.pending.items()]
+        )
+        self.db.executemany('UPDATE entries SET accessed = ? WHERE key = ?',
+                            [(now, key) for key in self.accessed])
+        self.pending.clear()
+        self.accessed.clear()
+        self.evict()
+        self.db.commit()
+
+    @property
+    def size(self):
+        return self.db.execute('SELECT COALESCE(SUM(size), 0) '
+                               'FROM entries').fetchone()[0]
+
+    def evict(self):
+        excess = self.size - self.max_size
+        if excess <= 0:
+            return
+        victims = []
+        for key, size in self.db.execute('SELECT key, size FROM entries '
+                                         'ORDER BY accessed'):
+            if excess <= 0:
+                break
+            victims.append((key,))
+            excess -= size
+        self.db.executemany('DELETE FROM entries WHERE key = ?', victims)
+
+    def close(self):
+        self.flush()
+        self.db.close()
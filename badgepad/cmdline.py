@@ -1,12 +1,19 @@
 import os
 import sys
+import time
 import shutil
 import argparse
 
 from . import pkg_path
-from .project import Project
-from .build import build_website
-from .server import start_auto_rebuild_server
+from .project import Project, Recipient
+
+# Each command imports whatever else it needs itself, so that quick ones
+# like init and newbadge don't pay for importing Jinja2, markdown, PyYAML
+# or the web server.
+
+# The same as writers.LINK_MODES, which would take tarfile and zipfile
+# along with it.
+LINK_MODES = ('copy', 'hardlink', 'reflink')
 
 def nice_dir(path, cwd=None):
     if cwd is None:
@@ -30,20 +37,224 @@ def cmd_serve(project, args):
     Serve website.
     """
 
-    start_auto_rebuild_server(project.ROOT, ip=args.ip, port=args.port)
+    from .server import start_auto_rebuild_server, start_live_server
+
+    if args.live:
+        start_live_server(project.ROOT, ip=args.ip, port=args.port)
+    else:
+        start_auto_rebuild_server(project.ROOT, ip=args.ip, port=args.port,
+                                  precompress=args.precompress)
 
 def cmd_build(project, args):
     """
     Build website.
     """
 
+    import json
+    import cProfile
+    from .build import build_website, PhaseTimer
+    from .writers import is_archive
+
     if args.base_url:
         project.set_base_url(args.base_url)
     if not args.output_dir:
         args.output_dir = project.path('dist')
+    if args.incremental and is_archive(args.output_dir):
+        fail("Archives can't be built incrementally.")
+
+    if not args.no_cache:
+        project.open_cache()
+    timer = PhaseTimer()
+    profiler = None
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    manifest = build_website(project, dest_dir=args.output_dir,
+                             incremental=args.incremental,
+                             jobs=args.jobs, timer=timer,
+                             compact=args.compact_json,
+                             link_mode=args.link_assets,
+                             precompress=args.precompress)
+    if project.cache is not None:
+        project.cache.close()
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        log("Profile written to '%s'." % nice_dir(args.profile))
+    if args.timings or args.jobs > 1:
+        for phase in timer.phases:
+            log(timer.describe(phase))
+        totals = timer.totals()
+        log("Assets: %d bytes copied, %d linked, %d skipped." % (
+            totals['bytes_copied'],
+            totals['bytes_linked'],
+            totals['bytes_skipped']
+        ))
+    if args.timings_json:
+        f = open(args.timings_json, 'w')
+        json.dump(timer.report(), f, sort_keys=True, indent=True)
+        f.close()
+    if args.incremental:
+        log("Rebuilt %d of %d files, removed %d." % (
+            manifest.rebuilt,
+            len(manifest.outputs),
+            len(manifest.removed)
+        ))
+    if is_archive(args.output_dir):
+        log("Done. Static website is in archive '%s'." %
+            nice_dir(args.output_dir))
+    else:
+        log("Done. Static website is in '%s'." % nice_dir(args.output_dir))
+
+def cmd_publish(project, args):
+    """
+    Upload the built website to Amazon S3 or compatible storage.
+    """
+
+    from .publish import S3Bucket, publish
+
+    dist_dir = args.dist_dir or project.path('dist')
+    if not os.path.isdir(dist_dir):
+        fail("There's no website in '%s' to publish. Build it first." %
+             nice_dir(dist_dir))
+    access_key = os.environ.get('AWS_ACCESS_KEY_ID')
+    secret_key = os.environ.get('AWS_SECRET_ACCESS_KEY')
+    if not (access_key and secret_key):
+        fail("Set AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY to publish.")
+
+    bucket = S3Bucket(args.endpoint, args.bucket, access_key, secret_key,
+                      region=args.region, prefix=args.prefix)
+    start = time.time()
+    result = publish(dist_dir, bucket, jobs=args.jobs, dry_run=args.dry_run)
+    log("%s %d new and %d changed files, deleted %d, %d unchanged "
+        "in %.2fs." % (
+            'Would upload' if args.dry_run else 'Uploaded',
+            len(result['new']),
+            len(result['changed']),
+            len(result['removed']),
+            result['unchanged'],
+            time.time() - start
+        ))
+    paths = sorted(result['changed'] + result['removed'])
+    if paths:
+        log("Changed paths:")
+        for path in paths:
+            log('/' + path)
+
+def cmd_verify(project, args):
+    """
+    Check that every assertion in the built website verifies.
+    """
+
+    from .verify import Verifier, DirectorySite, HttpSite
+
+    if args.base_url:
+        site = HttpSite(args.base_url)
+        where = args.base_url
+    else:
+        dist_dir = args.dist_dir or project.path('dist')
+        if not os.path.isdir(dist_dir):
+            fail("There's no website in '%s' to verify. Build it first." %
+                 nice_dir(dist_dir))
+        site = DirectorySite(dist_dir)
+        where = "'%s'" % nice_dir(dist_dir)
+
+    report = Verifier(project, site, jobs=args.jobs).run()
+    latency = report['latency']
+    log("Verified %d assertions in %s with %d fetches in %.2fs "
+        "(%d per second)." % (
+            report['assertions'],
+            where,
+            report['fetches'],
+            report['seconds'],
+            report['fetches'] / max(report['seconds'], 0.001)
+        ))
+    log("Fetch latency: p50 %.1fms, p90 %.1fms, p99 %.1fms, "
+        "max %.1fms." % (
+            latency['p50'] * 1000,
+            latency['p90'] * 1000,
+            latency['p99'] * 1000,
+            latency['max'] * 1000
+        ))
+    for url, message in report['problems']:
+        log("%s: %s" % (url, message))
+    if report['problems']:
+        fail("Found %d problems." % len(report['problems']))
+    log("Everything verifies.")
+
+def cmd_export(project, args):
+    """
+    Export every assertion as NDJSON or an SQLite database.
+    """
+
+    from .export import iter_assertion_records, export_ndjson, \
+                        export_sqlite
+
+    if args.format == 'sqlite' and args.output in (None, '-'):
+        fail("Exporting to SQLite needs an output file, given with -o.")
+    if args.base_url:
+        project.set_base_url(args.base_url)
 
-    build_website(project, dest_dir=args.output_dir)
-    log("Done. Static website is in '%s'." % nice_dir(args.output_dir))
+    cache = project.open_cache()
+    start = time.time()
+    records = iter_assertion_records(project)
+    if args.format == 'sqlite':
+        exported = export_sqlite(records, args.output)
+    elif args.output in (None, '-'):
+        exported = export_ndjson(records, sys.stdout)
+    else:
+        f = open(args.output, 'wb')
+        exported = export_ndjson(records, f)
+        f.close()
+    elapsed = time.time() - start
+    cache.close()
+    if args.output not in (None, '-'):
+        log("Exported %d assertions to '%s' in %.2fs." % (
+            exported,
+            nice_dir(args.output),
+            elapsed
+        ))
+
+def cmd_compile_templates(project, args):
+    """
+    Compile templates ahead of time.
+    """
+
+    from .build import compile_templates
+
+    cache = project.open_cache()
+    names = compile_templates(project)
+    cache.close()
+    log("Compiled %d templates into %s." % (
+        len(names),
+        nice_dir(project.path(project.CACHE_DIR))
+    ))
+
+def cmd_hash_identities(project, args):
+    """
+    Precompute hashed recipient identities.
+    """
+
+    from .project import hash_identities
+
+    badges = args.badge or [badge.basename for badge in project.badges]
+    for badge in badges:
+        if badge not in project.badges:
+            fail("Badge '%s' does not exist." % badge)
+    pairs = [(recipient.email, '%s.%s' % (recipient.id, badge))
+             for recipient in project.recipients.values()
+             for badge in badges]
+
+    cache = project.open_cache()
+    start = time.time()
+    hashed = hash_identities(project, pairs, jobs=args.jobs)
+    elapsed = time.time() - start
+    cache.close()
+    log("Hashed %d identities in %.2fs, %d were already cached." % (
+        hashed,
+        elapsed,
+        len(pairs) - hashed
+    ))
 
 def cmd_init(project, args):
     """
@@ -101,6 +312,70 @@ def cmd_issue(project, args):
     shutil.copy(pkg_path('samples', 'assertion.yml'), filename)
     log("Created %s." % project.relpath(filename))
 
+def cmd_issue_bulk(project, args):
+    """
+    Issue a badge to many recipients at once.
+    """
+
+    import csv
+
+    start = time.time()
+    if not args.badge in project.badges:
+        fail("Badge '%s' does not exist." % args.badge)
+
+    if args.from_file == '-':
+        rows = list(csv.DictReader(sys.stdin))
+    else:
+        f = open(args.from_file, 'rb')
+        rows = list(csv.DictReader(f))
+        f.close()
+
+    recipients = project.recipients
+    slugs = []
+    new_recipients = {}
+    for line, row in enumerate(rows, 2):
+        slug = (row.get('slug') or '').strip()
+        if not slug or '.' in slug or '/' in slug:
+            fail("Line %d: invalid recipient '%s'." % (line, slug))
+        if slug not in recipients and slug not in new_recipients:
+            address = (row.get('email') or '').strip()
+            if not address:
+                fail("Line %d: recipient '%s' does not exist and has no "
+                     "email." % (line, slug))
+            name = (row.get('name') or '').strip().decode('utf-8')
+            new_recipients[slug] = Recipient(project, slug, name, address)
+        slugs.append(slug)
+
+    if new_recipients:
+        try:
+            project.add_recipients([new_recipients[slug]
+                                    for slug in sorted(new_recipients)])
+        except ValueError, e:
+            fail("Can't add new recipients: %s." % e)
+
+    template = open(pkg_path('samples', 'assertion.yml'), 'rb').read()
+    existing = set(os.listdir(project.ASSERTIONS_DIR))
+    issued = 0
+    for slug in slugs:
+        basename = '%s.%s.yml' % (slug, args.badge)
+        if basename in existing:
+            continue
+        f = open(os.path.join(project.ASSERTIONS_DIR, basename), 'wb')
+        f.write(template)
+        f.close()
+        existing.add(basename)
+        issued += 1
+
+    elapsed = time.time() - start
+    log("Added %d new recipients." % len(new_recipients))
+    log("Issued %d badges in %.2fs (%d per second), %d were already "
+        "issued." % (
+            issued,
+            elapsed,
+            issued / max(elapsed, 0.001),
+            len(slugs) - issued
+        ))
+
 def main(arglist=None):
     parser = argparse.ArgumentParser()
 
@@ -113,13 +388,96 @@ def main(arglist=None):
     serve.add_argument('-i', '--ip', help='ip address',
                        default='127.0.0.1')
     serve.add_argument('-p', '--port', help='port', type=int, default=8000)
+    serve.add_argument('--live', action='store_true',
+                       help='render pages on demand instead of building '
+                            'the whole site')
+    serve.add_argument('--precompress', action='store_true',
+                       help='build gzipped (and brotli) variants of JSON '
+                            'and HTML files and serve them to clients '
+                            'that accept them')
     serve.set_defaults(func=cmd_serve)
 
     build = subparsers.add_parser('build', help=cmd_build.__doc__)
     build.add_argument('-u', '--base-url', help='alternate base URL')
-    build.add_argument('-o', '--output-dir', help='output directory')
+    build.add_argument('-o', '--output-dir',
+                       help='output directory, or a .zip, .tar, .tar.gz '
+                            'or .tar.bz2 archive to write')
+    build.add_argument('--incremental', action='store_true',
+                       help='only rebuild files whose inputs changed')
+    build.add_argument('--compact-json', action='store_true',
+                       help='write JSON files without whitespace')
+    build.add_argument('--precompress', action='store_true',
+                       help='write gzipped (and brotli, if installed) '
+                            'variants of JSON and HTML files next to them')
+    build.add_argument('--link-assets', choices=LINK_MODES, default='copy',
+                       help='hard-link or reflink badge images and static '
+                            'files instead of copying them')
+    build.add_argument('--no-cache', action='store_true',
+                       help="don't use or update the cache of parsed YAML "
+                            "and markdown in %s" % Project.CACHE_DIR)
+    build.add_argument('-j', '--jobs', type=int, default=1,
+                       help='number of worker processes to render with')
+    build.add_argument('--timings', action='store_true',
+                       help='report how long each phase of the build took')
+    build.add_argument('--timings-json', metavar='FILE',
+                       help='write build phase timings to FILE as JSON')
+    build.add_argument('--profile', metavar='FILE',
+                       help='profile the build and write pstats to FILE')
     build.set_defaults(func=cmd_build)
 
+    publish = subparsers.add_parser('publish', help=cmd_publish.__doc__)
+    publish.add_argument('bucket')
+    publish.add_argument('-d', '--dist-dir',
+                         help='built website to publish (default is dist)')
+    publish.add_argument('--endpoint', default='https://s3.amazonaws.com',
+                         help='S3 endpoint URL (default is %(default)s)')
+    publish.add_argument('--region', default='us-east-1',
+                         help='region to sign requests for (default is '
+                              '%(default)s)')
+    publish.add_argument('--prefix', default='',
+                         help='key prefix to publish under')
+    publish.add_argument('-j', '--jobs', type=int, default=8,
+                         help='number of uploads to run at once')
+    publish.add_argument('--dry-run', action='store_true',
+                         help="report what would change, but don't "
+                              "change it")
+    publish.set_defaults(func=cmd_publish)
+
+    verify = subparsers.add_parser('verify', help=cmd_verify.__doc__)
+    verify.add_argument('-d', '--dist-dir',
+                        help='built website to verify (default is dist)')
+    verify.add_argument('--base-url',
+                        help='verify the website served at this URL '
+                             'instead, e.g. by badgepad serve')
+    verify.add_argument('-j', '--jobs', type=int, default=8,
+                        help='number of fetches to run at once')
+    verify.set_defaults(func=cmd_verify)
+
+    export = subparsers.add_parser('export', help=cmd_export.__doc__)
+    export.add_argument('-f', '--format', choices=('ndjson', 'sqlite'),
+                        default='ndjson',
+                        help='export format (default is %(default)s)')
+    export.add_argument('-o', '--output',
+                        help='file to export to (default is standard '
+                             'output, for ndjson)')
+    export.add_argument('-u', '--base-url', help='alternate base URL')
+    export.set_defaults(func=cmd_export)
+
+    compile_templates = subparsers.add_parser(
+        'compile-templates',
+        help=cmd_compile_templates.__doc__
+    )
+    compile_templates.set_defaults(func=cmd_compile_templates)
+
+    hash_ids = subparsers.add_parser('hash-identities',
+                                     help=cmd_hash_identities.__doc__)
+    hash_ids.add_argument('-b', '--badge', action='append',
+                          help='badge to hash identities for (can be given '
+                               'more than once, default is all badges)')
+    hash_ids.add_argument('-j', '--jobs', type=int, default=1,
+                          help='number of worker processes to hash with')
+    hash_ids.set_defaults(func=cmd_hash_identities)
+
     init = subparsers.add_parser('init', help=cmd_init.__doc__)
     init.set_defaults(func=cmd_init)
 
@@ -132,6 +490,16 @@ def main(arglist=None):
     issue.add_argument('badge')
     issue.set_defaults(func=cmd_issue)
 
+    issue_bulk = subparsers.add_parser('issue-bulk',
+                                       help=cmd_issue_bulk.__doc__)
+    issue_bulk.add_argument('badge')
+    issue_bulk.add_argument('--from', dest='from_file', default='-',
+                            metavar='FILE',
+                            help='CSV file with a slug column and, for new '
+                                 'recipients, name and email columns '
+                                 '(default is standard input)')
+    issue_bulk.set_defaults(func=cmd_issue_bulk)
+
     args = parser.parse_args(arglist)
     project = Project(args.root_dir)
 
@@ -0,0 +1,55 @@
+import httplib
+import urlparse
+import threading
+
+class KeepAliveClient(object):
+    """
+    A client of the HTTP or HTTPS server at url, where each thread
+    keeps its own keep-alive connection to the server.
+    """
+
+    TIMEOUT = 60
+
+    def __init__(self, url):
+        parts = urlparse.urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.netloc
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = set()
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            if self.scheme == 'https':
+                conn = httplib.HTTPSConnection(self.host,
+                                               timeout=self.TIMEOUT)
+            else:
+                conn = httplib.HTTPConnection(self.host, timeout=self.TIMEOUT)
+            self.local.conn = conn
+            with self.lock:
+                self.connections.add(conn)
+        return conn
+
+    def reset(self):
+        """
+        Closes the current thread's connection after an error, so its
+        next request starts afresh.
+        """
+
+        conn = self.local.conn
+        conn.close()
+        self.local.conn = None
+        with self.lock:
+            self.connections.discard(conn)
+
+    def close(self):
+        """
+        Closes the connections of every thread that's used the client.
+        """
+
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections.clear()
+        self.local = threading.local()
@@ -0,0 +1,76 @@
+import os
+import json
+import sqlite3
+
+def iter_assertion_records(project):
+    """
+    Yields a dict for every assertion in the project, with its recipient
+    and badge slugs, issuance time and assertion JSON.
+
+    Assertions are parsed one at a time and not kept around, so this
+    works in a single pass with constant memory however many there are.
+    """
+
+    for recipient, badge, filename in project.assertions.index['all']:
+        assn = project.assertions.parse(filename)
+        yield {
+            'uid': assn.basename,
+            'recipient': recipient,
+            'badge': badge,
+            'issued_on': assn.json['issuedOn'],
+            'assertion': assn.json
+        }
+
+def export_ndjson(records, f):
+    """
+    Writes each record to the file f as a line of JSON, returning the
+    number of records written.
+    """
+
+    exported = 0
+    for record in records:
+        f.write(json.dumps(record, sort_keys=True, separators=(',', ':')))
+        f.write('\n')
+        exported += 1
+    return exported
+
+def export_sqlite(records, filename):
+    """
+    Writes the records into a new SQLite database at filename, in an
+    assertions table indexed by recipient and by badge, returning the
+    number of records written.
+
+    The database is built under a temporary name and renamed into place
+    once it's complete, replacing any old export.
+    """
+
+    tmpname = os.path.join(os.path.dirname(os.path.abspath(filename)),
+                           '.%s.tmp' % os.path.basename(filename))
+    if os.path.exists(tmpname):
+        os.remove(tmpname)
+    db = sqlite3.connect(tmpname)
+    try:
+        db.execute('CREATE TABLE assertions (uid TEXT PRIMARY KEY, '
+                   'recipient TEXT NOT NULL, badge TEXT NOT NULL, '
+                   'issued_on, json TEXT NOT NULL)')
+        cursor = db.executemany(
+            'INSERT INTO assertions VALUES (?, ?, ?, ?, ?)',
+            ((record['uid'], record['recipient'], record['badge'],
+              record['issued_on'],
+              json.dumps(record['assertion'], sort_keys=True))
+             for record in records)
+        )
+        exported = cursor.rowcount
+        # Indexing everything at the end is quicker than keeping the
+        # indexes up to date row by row.
+        db.execute('CREATE INDEX assertions_recipient '
+                   'ON assertions (recipient)')
+        db.execute('CREATE INDEX assertions_badge ON assertions (badge)')
+        db.commit()
+    except:
+        db.close()
+        os.remove(tmpname)
+        raise
+    db.close()
+    os.rename(tmpname, filename)
+    return exported
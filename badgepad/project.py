@@ -1,12 +1,25 @@
 import os
 import glob
+import collections
 import urlparse
-import email.utils
 import re
 from hashlib import sha256
 
-import yaml
-from markdown import markdown
+from .stats import count
+from .cache import ParseCache
+from .recipients import open_store
+
+# PyYAML, markdown and multiprocessing are imported only when they're
+# needed, so that commands which don't use them start up quickly.
+
+def find_yaml_loader():
+    """
+    Returns the fastest safe YAML loader available, which is the libyaml
+    one if PyYAML was built with it.
+    """
+
+    import yaml
+    return getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
 
 def pathify(urlpattern, **context):
     """
@@ -23,6 +36,62 @@ def pathify(urlpattern, **context):
     path = re.sub(r':([a-z]+)', repl, urlpattern)
     return tuple(path[1:].split('/'))
 
+def unpathify(urlpattern, path):
+    """
+    The inverse of pathify(): matches a URL path against a url
+    pattern-esque string, returning a dict of the values it gives each
+    placeholder, or None if the path doesn't match.
+
+    Example:
+
+        >>> sorted(unpathify('/a/:foo/:bar.xml', '/a/beets/eggs.xml').items())
+        [('bar', 'eggs'), ('foo', 'beets')]
+        >>> print unpathify('/a/:foo/:bar.xml', '/b/beets/eggs.xml')
+        None
+    """
+
+    parts = re.split(r':([a-z]+)', urlpattern)
+    regex = ''.join(['(?P<%s>[^/]+)' % part if i % 2 else re.escape(part)
+                     for i, part in enumerate(parts)])
+    match = re.match('^%s$' % regex, path)
+    return match and match.groupdict()
+
+def hash_identity(email_and_salt):
+    """
+    Returns the hashed identity of an email address for a salt.
+
+    Example:
+
+        >>> hash_identity(('a@b.org', 'a.b'))[:20]
+        'sha256$08edebe9a6f38'
+    """
+
+    email, salt = email_and_salt
+    return 'sha256$' + sha256(email + salt).hexdigest()
+
+def hash_identities(project, pairs, jobs=1, chunksize=1000):
+    """
+    Makes sure the project's cache knows the hashed identity of every
+    (email, salt) pair given, hashing the ones it doesn't know yet with
+    the given number of worker processes. Returns how many needed it.
+    """
+
+    known = {}
+    if project.cache is not None:
+        known = project.cache.identities(salt for email, salt in pairs)
+    missing = [pair for pair in set(pairs) if pair not in known]
+    if jobs > 1 and missing:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+        try:
+            hashed = pool.map(hash_identity, missing, chunksize)
+        finally:
+            pool.terminate()
+    else:
+        hashed = map(hash_identity, missing)
+    project.add_identities(dict(zip(missing, hashed)))
+    return len(missing)
+
 class Recipient(object):
     def __init__(self, project, id, name, email):
         self.project = project
@@ -37,9 +106,46 @@ class Recipient(object):
     def hashed_identity(self, salt):
         idobj = dict(type='email', hashed=True)
         idobj['salt'] = salt
-        idobj['identity'] = 'sha256$' + sha256(self.email + salt).hexdigest()
+        idobj['identity'] = self.project.hashed_identity(self.email, salt)
         return idobj
 
+class RecipientMap(collections.Mapping):
+    """
+    Maps slugs to the project's recipients, which are only looked up in
+    its recipient store when they're needed.
+    """
+
+    def __init__(self, project, store):
+        self.project = project
+        self.store = store
+        self.__cache = {}
+
+    def __getitem__(self, slug):
+        recipient = self.__cache.get(slug)
+        if recipient is None:
+            entry = self.store.lookup(slug)
+            if entry is None:
+                raise KeyError(slug)
+            recipient = Recipient(self.project, slug, *entry)
+            self.__cache[slug] = recipient
+        return recipient
+
+    def __contains__(self, slug):
+        return (slug in self.__cache or
+                self.store.lookup(slug) is not None)
+
+    def __iter__(self):
+        return iter(self.store.slugs())
+
+    def __len__(self):
+        return len(self.store.slugs())
+
+    def add(self, recipients):
+        self.store.add([(recipient.id, recipient.name, recipient.email)
+                        for recipient in recipients])
+        for recipient in recipients:
+            self.__cache[recipient.id] = recipient
+
 class BadgeAssertion(object):
     def __init__(self, project, filename):
         self.project = project
@@ -48,12 +154,7 @@ class BadgeAssertion(object):
         recipient, badge = self.basename.split('.')
         self.recipient = project.recipients[recipient]
         self.badge = project.badges[badge]
-        self.paths = {
-            'html': pathify(project.config['urlmap']['evidence'],
-                            recipient=recipient, badge=badge),
-            'json': pathify(project.config['urlmap']['assertion'],
-                            recipient=recipient, badge=badge),
-        }
+        self.paths = project.assertion_paths(recipient, badge)
         self.evidence_url = project.absurl(*self.paths['html'])
         self.json_url = project.absurl(*self.paths['json'])
 
@@ -85,8 +186,9 @@ class BadgeAssertion(object):
     @property
     def evidence_html(self):
         if self.evidence_markdown and (not self.__evidence_html):
-            self.__evidence_html = markdown(self.evidence_markdown,
-                                            output_format='html5')
+            self.__evidence_html = self.project.render_markdown(
+                self.evidence_markdown
+            )
         return self.__evidence_html
 
 class BadgeClass(object):
@@ -94,14 +196,7 @@ class BadgeClass(object):
         self.project = project
         self.filename = filename
         self.basename = os.path.basename(os.path.splitext(filename)[0])
-        self.paths = {
-            'png': pathify(project.config['urlmap']['image'],
-                           badge=self.basename),
-            'html': pathify(project.config['urlmap']['criteria'],
-                            badge=self.basename),
-            'json': pathify(project.config['urlmap']['badge'],
-                            badge=self.basename)
-        }
+        self.paths = project.badge_paths(self.basename)
         self.image_filename = os.path.splitext(filename)[0] + '.png'
         self.image_url = project.absurl(*self.paths['png'])
         self.issuer = project.config['issuer']
@@ -127,8 +222,9 @@ class BadgeClass(object):
     @property
     def criteria_html(self):
         if not self.__criteria_html:
-            self.__criteria_html = markdown(self.criteria_markdown,
-                                            output_format='html5')
+            self.__criteria_html = self.project.render_markdown(
+                self.criteria_markdown
+            )
         return self.__criteria_html
 
     @property
@@ -141,16 +237,45 @@ class YamlCollection(object):
 
     def __init__(self, project):
         self.project = project
+        self.__cache = {}
+
+    def load(self, filename):
+        """
+        Returns the object for the given YAML file, parsing it only if
+        it hasn't been loaded before or has changed on disk since.
+        """
+
+        slug = os.path.basename(os.path.splitext(filename)[0])
+        signature = self.signature(filename)
+        cached = self.__cache.get(slug)
+        if cached is None or cached[0] != signature:
+            cached = (signature, self.parse(filename))
+            self.__cache[slug] = cached
+        return cached[1]
+
+    def parse(self, filename):
+        """
+        Returns a new object for the given YAML file without remembering
+        it, so it can be garbage collected once it's no longer needed.
+        """
+
+        return self.CLASS(self.project, filename)
+
+    def signature(self, filename):
+        stat = os.stat(filename)
+        return (stat.st_mtime, stat.st_size)
+
+    def clear_cache(self):
+        self.__cache.clear()
 
     def __iter__(self):
         for filename in self.project.glob(self.DIRNAME, '*.yml'):
-            yield self.CLASS(self.project, filename)
+            yield self.load(filename)
 
     def __getitem__(self, key):
         if key not in self:
             raise KeyError(key)
-        return self.CLASS(self.project,
-                          self.project.path(self.DIRNAME, '%s.yml' % key))
+        return self.load(self.project.path(self.DIRNAME, '%s.yml' % key))
 
     def __contains__(self, key):
         return self.project.exists(self.DIRNAME, '%s.yml' % key)
@@ -159,27 +284,102 @@ class BadgeAssertions(YamlCollection):
     DIRNAME = 'assertions'
     CLASS = BadgeAssertion
 
+    def __init__(self, project):
+        YamlCollection.__init__(self, project)
+        self.__index = None
+        self.__index_mtime = None
+
+    def signature(self, filename):
+        # Assertions hold on to their badge class, so they need to be
+        # reloaded whenever it changes too.
+        basename = os.path.basename(os.path.splitext(filename)[0])
+        badge = basename.split('.')[-1]
+        try:
+            badge_signature = self.project.badges.signature(
+                self.project.path('badges', '%s.yml' % badge)
+            )
+        except OSError:
+            badge_signature = None
+        return (YamlCollection.signature(self, filename), badge_signature)
+
+    @property
+    def index(self):
+        """
+        Maps recipient and badge slugs to lists of
+        (recipient, badge, filename) tuples, built from a single listing
+        of the assertions directory and rebuilt whenever the directory
+        changes.
+        """
+
+        try:
+            mtime = os.stat(self.project.ASSERTIONS_DIR).st_mtime
+        except OSError:
+            mtime = None
+        if self.__index is None or mtime != self.__index_mtime:
+            index = {'all': [], 'recipient': {}, 'badge': {}}
+            for filename in sorted(self.project.glob(self.DIRNAME, '*.yml')):
+                basename = os.path.basename(os.path.splitext(filename)[0])
+                recipient, badge = basename.split('.')
+                entry = (recipient, badge, filename)
+                index['all'].append(entry)
+                index['recipient'].setdefault(recipient, []).append(entry)
+                index['badge'].setdefault(badge, []).append(entry)
+            self.__index = index
+            self.__index_mtime = mtime
+        return self.__index
+
+    def filenames(self, recipient='*', badge='*'):
+        index = self.index
+        if recipient != '*':
+            entries = index['recipient'].get(recipient, [])
+        elif badge != '*':
+            entries = index['badge'].get(badge, [])
+        else:
+            entries = index['all']
+        return [filename for (_, entry_badge, filename) in entries
+                if badge in ('*', entry_badge)]
+
+    def count(self, recipient='*', badge='*'):
+        return len(self.filenames(recipient=recipient, badge=badge))
+
     def find(self, recipient='*', badge='*'):
-        query = '%s.%s.yml' % (recipient, badge)
-        for filename in self.project.glob('assertions', query):
-            yield BadgeAssertion(self.project, filename)
+        for filename in self.filenames(recipient=recipient, badge=badge):
+            yield self.load(filename)
+
+    def __iter__(self):
+        return self.find()
 
 class BadgeClasses(YamlCollection):
     DIRNAME = 'badges'
     CLASS = BadgeClass
 
+    def signature(self, filename):
+        image_filename = os.path.splitext(filename)[0] + '.png'
+        return (YamlCollection.signature(self, filename),
+                os.path.exists(image_filename))
+
 class Project(object):
-    def __init__(self, root_dir):
+    CACHE_DIR = '.badgepad-cache'
+
+    def __init__(self, root_dir, cache=None):
         self.ROOT = os.path.abspath(root_dir)
+        self.cache = cache
         self.STATIC_DIR = self.path('static')
         self.BADGES_DIR = self.path('badges')
         self.ASSERTIONS_DIR = self.path('assertions')
         self.TEMPLATES_DIR = self.path('templates')
         self.__config = None
         self.__recipients = None
+        self.__identities = None
         self.badges = BadgeClasses(self)
         self.assertions = BadgeAssertions(self)
 
+    def open_cache(self, **kwargs):
+        self.cache = ParseCache(self.path(self.CACHE_DIR, 'parse.sqlite'),
+                                **kwargs)
+        self.__identities = None
+        return self.cache
+
     def relpath(self, *filename):
         return os.path.relpath(self.path(*filename), self.ROOT)
 
@@ -203,6 +403,9 @@ class Project(object):
         self.config['issuer']['url'] = url
         if not self.config['issuer']['url'].endswith('/'):
             self.config['issuer']['url'] += '/'
+        # Any already-loaded objects have absolute URLs baked into them.
+        self.badges.clear_cache()
+        self.assertions.clear_cache()
 
     @property
     def recipients(self):
@@ -211,27 +414,118 @@ class Project(object):
             self.config
         return self.__recipients
 
+    @property
+    def recipients_filename(self):
+        """
+        The file the project's recipients are kept in, or None if they're
+        in config.yml.
+        """
+
+        return getattr(self.recipients.store, 'filename', None)
+
     @property
     def paths(self):
         return {'json': pathify(self.config['urlmap']['issuer'])}
 
+    def badge_paths(self, badge):
+        urlmap = self.config['urlmap']
+        return {
+            'png': pathify(urlmap['image'], badge=badge),
+            'html': pathify(urlmap['criteria'], badge=badge),
+            'json': pathify(urlmap['badge'], badge=badge)
+        }
+
+    def assertion_paths(self, recipient, badge):
+        urlmap = self.config['urlmap']
+        return {
+            'html': pathify(urlmap['evidence'], recipient=recipient,
+                            badge=badge),
+            'json': pathify(urlmap['assertion'], recipient=recipient,
+                            badge=badge)
+        }
+
     @property
     def config(self):
         if not self.__config:
-            config = yaml.load(self.open('config.yml').read())
+            import yaml
+            config = yaml.load(self.open('config.yml').read(),
+                               find_yaml_loader())
 
-            recipients = {}
-            for slug, address in config['recipients'].items():
-                parts = email.utils.parseaddr(address)
-                recipient = Recipient(self, slug, parts[0], parts[1])
-                recipients[slug] = recipient
-            del config['recipients']
+            store = open_store(self.ROOT, config.pop('recipients'))
 
             self.__config = config
-            self.__recipients = recipients
+            self.__recipients = RecipientMap(self, store)
             self.set_base_url(config['issuer']['url'])
 
         return self.__config
 
+    def cached_identity(self, email, salt):
+        """
+        Returns the hashed identity of email for salt if it's in the
+        project's cache, or None. Nothing is remembered without a cache.
+
+        The cached identities of every assertion in the project are
+        loaded the first time one is needed, so this is just a dict
+        lookup.
+        """
+
+        if self.cache is None:
+            return None
+        if self.__identities is None:
+            self.__identities = self.cache.identities(
+                '%s.%s' % (recipient, badge)
+                for recipient, badge, filename in self.assertions.index['all']
+            )
+        return self.__identities.get((email, salt))
+
+    def add_identities(self, identities):
+        if self.cache is not None:
+            self.cache.add_identities(identities)
+            if self.__identities is not None:
+                self.__identities.update(identities)
+
+    def hashed_identity(self, email, salt):
+        identity = self.cached_identity(email, salt)
+        if identity is None:
+            count('identity_hashes')
+            identity = hash_identity((email, salt))
+            self.add_identities({(email, salt): identity})
+        else:
+            count('identity_cache_hits')
+        return identity
+
+    def add_recipients(self, recipients):
+        """
+        Adds the given new recipients to the project's recipient store.
+        """
+
+        self.recipients.add(recipients)
+
     def read_yaml(self, *filename):
-        return yaml.load_all(self.open(*filename))
+        import yaml
+        if self.cache is None:
+            count('yaml_parses')
+            return yaml.load_all(self.open(*filename), find_yaml_loader())
+        f = self.open(*filename)
+        content = f.read()
+        f.close()
+        documents = self.cache.get('yaml', content)
+        if documents is None:
+            count('yaml_parses')
+            documents = list(yaml.load_all(content, find_yaml_loader()))
+            self.cache.set('yaml', content, documents)
+        else:
+            count('yaml_cache_hits')
+        return iter(documents)
+
+    def render_markdown(self, text):
+        html = self.cache and self.cache.get('markdown', text)
+        if html is None:
+            count('markdown_renders')
+            from markdown import markdown
+            html = markdown(text, output_format='html5')
+            if self.cache is not None:
+                self.cache.set('markdown', text, html)
+        else:
+            count('markdown_cache_hits')
+        return html
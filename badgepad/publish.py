@@ -0,0 +1,235 @@
+import os
+import json
+import time
+import hmac
+import socket
+import httplib
+import hashlib
+import urllib
+import datetime
+import mimetypes
+from multiprocessing.pool import ThreadPool
+
+from .writers import file_digest, VARIANT_SUFFIXES
+from .connections import KeepAliveClient
+
+MANIFEST_KEY = '.badgepad-publish.json'
+
+CONTENT_TYPES = {
+    '.json': 'application/json',
+    '.html': 'text/html; charset=utf-8',
+    '.png': 'image/png'
+}
+
+EMPTY_SHA256 = hashlib.sha256('').hexdigest()
+
+class S3Error(Exception):
+    def __init__(self, method, key, status, reason, body=''):
+        Exception.__init__(self, '%s %s failed: %d %s' % (method, key,
+                                                          status, reason))
+        self.status = status
+        self.body = body
+
+def hmac_sha256(key, msg):
+    return hmac.new(key, msg, hashlib.sha256).digest()
+
+def sign_request(method, path, headers, access_key, secret_key, region,
+                 query=''):
+    """
+    Returns the Authorization header for an S3 request, using AWS
+    Signature Version 4. headers must include host, x-amz-date and
+    x-amz-content-sha256.
+    """
+
+    names = sorted(name.lower() for name in headers)
+    values = dict((name.lower(), str(value).strip())
+                  for name, value in headers.items())
+    canonical_request = '\n'.join([
+        method,
+        urllib.quote(path, safe='/~'),
+        query,
+        ''.join('%s:%s\n' % (name, values[name]) for name in names),
+        ';'.join(names),
+        values['x-amz-content-sha256']
+    ])
+    amz_date = values['x-amz-date']
+    scope = '%s/%s/s3/aws4_request' % (amz_date[:8], region)
+    string_to_sign = '\n'.join([
+        'AWS4-HMAC-SHA256',
+        amz_date,
+        scope,
+        hashlib.sha256(canonical_request).hexdigest()
+    ])
+    key = 'AWS4' + secret_key
+    for part in (amz_date[:8], region, 's3', 'aws4_request'):
+        key = hmac_sha256(key, part)
+    signature = hmac.new(key, string_to_sign, hashlib.sha256).hexdigest()
+    return ('AWS4-HMAC-SHA256 Credential=%s/%s, SignedHeaders=%s, '
+            'Signature=%s' % (access_key, scope, ';'.join(names), signature))
+
+def content_type(path):
+    ext = os.path.splitext(path)[1]
+    if ext in CONTENT_TYPES:
+        return CONTENT_TYPES[ext]
+    return mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+class S3Bucket(KeepAliveClient):
+    """
+    A bucket on Amazon S3 or anything that speaks its API, addressed as
+    endpoint/bucket/prefix/key. Failed requests are retried with
+    exponential backoff.
+    """
+
+    RETRIES = 3
+    RETRY_DELAY = 0.5
+
+    def __init__(self, endpoint, bucket, access_key, secret_key,
+                 region='us-east-1', prefix=''):
+        KeepAliveClient.__init__(self, endpoint)
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+
+    def request_once(self, method, key, body='', headers=None):
+        path = '/%s/%s%s' % (self.bucket, self.prefix, key)
+        headers = dict(headers or {})
+        headers['Host'] = self.host
+        headers['x-amz-date'] = datetime.datetime.utcnow().strftime(
+            '%Y%m%dT%H%M%SZ'
+        )
+        headers['x-amz-content-sha256'] = (hashlib.sha256(body).hexdigest()
+                                           if body else EMPTY_SHA256)
+        headers['Authorization'] = sign_request(
+            method, path, headers, self.access_key, self.secret_key,
+            self.region
+        )
+        headers['Content-Length'] = str(len(body))
+        conn = self.connection()
+        try:
+            conn.request(method, urllib.quote(path, safe='/~'), body,
+                         headers)
+            response = conn.getresponse()
+            data = response.read()
+        except (socket.error, httplib.HTTPException):
+            self.reset()
+            raise
+        if response.status >= 300 and not (method == 'GET' and
+                                            response.status == 404):
+            raise S3Error(method, key, response.status, response.reason,
+                          data)
+        return response.status, data
+
+    def request(self, method, key, body='', headers=None):
+        for attempt in range(self.RETRIES):
+            try:
+                return self.request_once(method, key, body, headers)
+            except (socket.error, httplib.HTTPException, S3Error), e:
+                retryable = not isinstance(e, S3Error) or e.status >= 500
+                if not retryable or attempt == self.RETRIES - 1:
+                    raise
+                time.sleep(self.RETRY_DELAY * (2 ** attempt))
+
+    def get(self, key):
+        """
+        Returns the contents of the given object, or None if it doesn't
+        exist.
+        """
+
+        status, data = self.request('GET', key)
+        if status == 404:
+            return None
+        return data
+
+    def put(self, key, data, content_type):
+        self.request('PUT', key, data, {'Content-Type': content_type})
+
+    def delete(self, key):
+        self.request('DELETE', key)
+
+def is_published(dirpath, filename):
+    """
+    Returns whether a file in a build should be published. Dot-files,
+    like the build manifest, aren't part of the website, and neither
+    are precompressed variants of other files, since S3 can't choose
+    between them by Accept-Encoding.
+    """
+
+    if filename.startswith('.'):
+        return False
+    base, ext = os.path.splitext(filename)
+    return not (ext in VARIANT_SUFFIXES and
+                os.path.isfile(os.path.join(dirpath, base)))
+
+def local_digests(dist_dir):
+    """
+    Returns a dict mapping the path of every published file under
+    dist_dir, with forward slashes, to a hash of its contents.
+    """
+
+    digests = {}
+    for dirpath, dirnames, filenames in os.walk(dist_dir):
+        dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+        for filename in filenames:
+            if not is_published(dirpath, filename):
+                continue
+            abspath = os.path.join(dirpath, filename)
+            path = os.path.relpath(abspath, dist_dir).replace(os.sep, '/')
+            digests[path] = file_digest(abspath)
+    return digests
+
+def diff_digests(local, remote):
+    """
+    Returns the paths that are new, changed and removed in local
+    compared to remote, each sorted.
+    """
+
+    new = sorted(path for path in local if path not in remote)
+    changed = sorted(path for path in local
+                     if path in remote and remote[path] != local[path])
+    removed = sorted(path for path in remote if path not in local)
+    return new, changed, removed
+
+def publish(dist_dir, bucket, jobs=8, dry_run=False):
+    """
+    Makes bucket match the build in dist_dir, uploading only the files
+    that are new or have changed since the last publish and deleting
+    the ones that have gone away.
+
+    What was published last is kept in a manifest of content hashes in
+    the bucket itself, which is only updated once everything else has
+    succeeded. Returns a dict of the new, changed and removed paths.
+    """
+
+    local = local_digests(dist_dir)
+    manifest = bucket.get(MANIFEST_KEY)
+    remote = json.loads(manifest) if manifest is not None else {}
+    new, changed, removed = diff_digests(local, remote)
+    result = dict(new=new, changed=changed, removed=removed,
+                  unchanged=len(local) - len(new) - len(changed))
+    if not dry_run:
+        sync(dist_dir, bucket, new + changed, removed, jobs)
+        bucket.put(MANIFEST_KEY, json.dumps(local, sort_keys=True),
+                   'application/json')
+    bucket.close()
+    return result
+
+def sync(dist_dir, bucket, uploads, deletions, jobs):
+    def upload(path):
+        f = open(os.path.join(dist_dir, *path.split('/')), 'rb')
+        data = f.read()
+        f.close()
+        bucket.put(path, data, content_type(path))
+
+    pool = ThreadPool(jobs)
+    try:
+        # Uploads go first and deletions last, so pages never link to
+        # objects that haven't been uploaded yet or were just deleted.
+        for _ in pool.imap_unordered(upload, uploads):
+            pass
+        for _ in pool.imap_unordered(bucket.delete, deletions):
+            pass
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,204 @@
+import os
+import re
+import csv
+import json
+import sqlite3
+
+class InlineStore(object):
+    """
+    Recipients listed in the recipients section of config.yml, as
+    'Name <email>' addresses that are only parsed when they're looked up.
+    """
+
+    # The line starting the recipients section, which may be commented
+    # or start out as an empty flow mapping.
+    SECTION_RE = re.compile(r'^recipients:\s*(\{\s*\}\s*)?(#.*)?$')
+
+    def __init__(self, config_filename, entries):
+        self.config_filename = config_filename
+        self.entries = entries or {}
+
+    def lookup(self, slug):
+        address = self.entries.get(slug)
+        if address is None:
+            return None
+        import email.utils
+        return email.utils.parseaddr(address)
+
+    def slugs(self):
+        return sorted(self.entries)
+
+    def add(self, entries):
+        """
+        Adds the given (slug, name, email) tuples to the end of the
+        recipients section of config.yml in a single rewrite, leaving
+        the rest of the file alone.
+        """
+
+        lines = open(self.config_filename).read().splitlines(True)
+        starts = [i for i, line in enumerate(lines)
+                  if self.SECTION_RE.match(line.rstrip())]
+        if not starts:
+            raise ValueError('config.yml has no recipients section to '
+                             'add to')
+        last = starts[0]
+        match = self.SECTION_RE.match(lines[last].rstrip())
+        if match.group(1):
+            lines[last] = 'recipients:%s\n' % (
+                match.group(2) and ' ' + match.group(2) or ''
+            )
+        indent = '  '
+        for i in range(last + 1, len(lines)):
+            line = lines[i]
+            if line[:1] in (' ', '\t'):
+                if line.strip() and not line.strip().startswith('#'):
+                    indent = line[:len(line) - len(line.lstrip())]
+                last = i
+            elif line.strip() and not line.startswith('#'):
+                break
+        if not lines[last].endswith('\n'):
+            lines[last] += '\n'
+        import email.utils
+        addresses = dict((slug, email.utils.formataddr((name, address)))
+                         for slug, name, address in entries)
+        if addresses:
+            import yaml
+            dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+            dumped = yaml.dump(addresses, Dumper=dumper,
+                               default_flow_style=False, allow_unicode=True,
+                               encoding='utf-8', width=2 ** 30)
+            lines[last + 1:last + 1] = [indent + line for line in
+                                        dumped.splitlines(True)]
+
+        tmpname = os.path.join(os.path.dirname(self.config_filename),
+                               '.config.yml.tmp')
+        f = open(tmpname, 'w')
+        f.write(''.join(lines))
+        f.close()
+        os.rename(tmpname, self.config_filename)
+        self.entries.update(addresses)
+
+class FileStore(object):
+    """
+    Recipients listed one per line in a file of their own, which is
+    only read the first time a recipient is looked up.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.__entries = None
+
+    @property
+    def entries(self):
+        if self.__entries is None:
+            self.__entries = {}
+            if os.path.exists(self.filename):
+                f = open(self.filename, 'rb')
+                for slug, name, address in self.read(f):
+                    self.__entries[slug] = (name, address)
+                f.close()
+        return self.__entries
+
+    def lookup(self, slug):
+        return self.entries.get(slug)
+
+    def slugs(self):
+        return sorted(self.entries)
+
+    def add(self, entries):
+        f = open(self.filename, 'ab')
+        self.write(f, entries)
+        f.close()
+        for slug, name, address in entries:
+            self.entries[slug] = (name, address)
+
+class CsvStore(FileStore):
+    """
+    Recipients in a CSV file with slug, name and email columns.
+    """
+
+    FIELDS = ['slug', 'name', 'email']
+
+    def read(self, f):
+        for row in csv.DictReader(f):
+            yield (row['slug'], (row.get('name') or '').decode('utf-8'),
+                   row['email'])
+
+    def write(self, f, entries):
+        writer = csv.writer(f)
+        if f.tell() == 0:
+            writer.writerow(self.FIELDS)
+        for slug, name, address in entries:
+            writer.writerow([slug, name.encode('utf-8'), address])
+
+class JsonlStore(FileStore):
+    """
+    Recipients in a file with one JSON object per line, each with slug,
+    name and email properties.
+    """
+
+    def read(self, f):
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                yield (entry['slug'], entry.get('name', u''),
+                       entry['email'])
+
+    def write(self, f, entries):
+        for slug, name, address in entries:
+            f.write(json.dumps({'slug': slug, 'name': name,
+                                'email': address}, sort_keys=True) + '\n')
+
+class SqliteStore(object):
+    """
+    Recipients in an SQLite database, in a recipients table indexed by
+    slug, so looking one up doesn't depend on how many there are.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        # The live server looks recipients up from whichever thread is
+        # handling a request, though only one at a time.
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS recipients ('
+                        'slug TEXT PRIMARY KEY, name TEXT, email TEXT)')
+        self.db.commit()
+
+    def lookup(self, slug):
+        row = self.db.execute('SELECT name, email FROM recipients '
+                              'WHERE slug = ?', (slug,)).fetchone()
+        if row is None:
+            return None
+        name, address = row
+        return (name or u'', str(address))
+
+    def slugs(self):
+        return [str(slug) for (slug,) in
+                self.db.execute('SELECT slug FROM recipients ORDER BY slug')]
+
+    def add(self, entries):
+        self.db.executemany('INSERT OR REPLACE INTO recipients '
+                            'VALUES (?, ?, ?)', entries)
+        self.db.commit()
+
+STORES = {
+    '.csv': CsvStore,
+    '.jsonl': JsonlStore,
+    '.sqlite': SqliteStore,
+    '.db': SqliteStore
+}
+
+def open_store(root_dir, recipients):
+    """
+    Returns the store for the recipients section of a project's config,
+    which is either a mapping of slugs to addresses or the name of a
+    file to keep them in, relative to root_dir.
+    """
+
+    config_filename = os.path.join(root_dir, 'config.yml')
+    if not isinstance(recipients, basestring):
+        return InlineStore(config_filename, recipients)
+    ext = os.path.splitext(recipients)[1]
+    if ext not in STORES:
+        raise ValueError('unknown recipient store: %s' % recipients)
+    return STORES[ext](os.path.join(root_dir, recipients))
@@ -1,58 +1,630 @@
 import os
 import sys
+import select
+import struct
 import hashlib
 import threading
 import time
 import shutil
 import tempfile
+import ctypes
+import urllib
+import urlparse
+import posixpath
 import traceback
+import collections
+import cStringIO
+import BaseHTTPServer
 import SimpleHTTPServer
 import SocketServer
 
-from .build import build_website
-from .project import Project
+from . import load_libc, check_libc_result
+from .build import build_website, find_affected_outputs, update_website, \
+                   make_jinja_env, template_inputs, assertion_inputs, \
+                   badge_inputs, fingerprint
+from .project import Project, unpathify
+from .writers import serialize
 
-def get_dir_state(dirname):
-    state = []
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+EVENT_HEADER = struct.Struct('iIII')
+
+# Content codings the static file server can send precompressed
+# siblings for, in order of preference.
+PRECOMPRESSED_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+def get_dir_snapshot(dirname):
+    """
+    Returns a dict mapping the path of every non-hidden file under
+    dirname to its modification time and size.
+    """
+
+    snapshot = {}
     for dirpath, dirnames, filenames in os.walk(dirname):
         dirnames[:] = [dirname for dirname in dirnames if dirname[0] != '.']
         for filename in filenames:
             if filename[0] == '.': continue
             fullpath = os.path.join(dirpath, filename)
-            state.extend([filename, str(int(os.stat(fullpath).st_mtime))])
+            stat = os.stat(fullpath)
+            snapshot[fullpath] = (stat.st_mtime, stat.st_size)
+    return snapshot
+
+def get_dir_state(dirname):
+    state = []
+    for fullpath, (mtime, size) in sorted(get_dir_snapshot(dirname).items()):
+        state.extend([fullpath, repr(mtime), str(size)])
     return hashlib.md5(':'.join(state)).hexdigest()
 
-def start_file_server(ip, port):
-    handler = SimpleHTTPServer.SimpleHTTPRequestHandler
-    httpd = SocketServer.TCPServer((ip, port), handler)
+class PollingWatcher(object):
+    """
+    Detects changes to a directory tree by periodically comparing
+    snapshots of it.
+    """
+
+    def __init__(self, root_dir, interval=1):
+        self.root_dir = root_dir
+        self.interval = interval
+        self.snapshot = get_dir_snapshot(root_dir)
+
+    def wait(self, timeout=None):
+        """
+        Blocks until something changes, returning the set of changed
+        paths, or an empty set if timeout seconds pass first.
+        """
+
+        start = time.time()
+        while True:
+            time.sleep(self.interval)
+            snapshot = get_dir_snapshot(self.root_dir)
+            changed = set(path for path in set(snapshot) | set(self.snapshot)
+                          if snapshot.get(path) != self.snapshot.get(path))
+            self.snapshot = snapshot
+            if changed or (timeout is not None and
+                           time.time() - start >= timeout):
+                return changed
+
+    def close(self):
+        pass
+
+class InotifyWatcher(object):
+    """
+    Detects changes to a directory tree using Linux's inotify API, which
+    is accessed through ctypes. Raises OSError or AttributeError if
+    inotify isn't available.
+    """
+
+    EVENT_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+                  IN_MOVED_TO | IN_CREATE | IN_DELETE)
+
+    def __init__(self, root_dir, debounce=0.05, libc=None):
+        if libc is None:
+            libc = load_libc()
+        self.libc = libc
+        self.root_dir = root_dir
+        self.debounce = debounce
+        self.fd = check_libc_result(libc.inotify_init())
+        self.watches = {}
+        self.add_watches(root_dir)
+
+    def add_watches(self, dirname):
+        for dirpath, dirnames, filenames in os.walk(dirname):
+            dirnames[:] = [dirname for dirname in dirnames
+                           if dirname[0] != '.']
+            wd = check_libc_result(self.libc.inotify_add_watch(
+                self.fd, dirpath, self.EVENT_MASK
+            ))
+            self.watches[wd] = dirpath
+
+    def read_events(self):
+        """
+        Returns the set of paths changed by the events waiting to be
+        read, or None if the kernel's event queue overflowed and some
+        changes were lost.
+        """
+
+        changed = set()
+        overflowed = False
+        data = os.read(self.fd, 65536)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # Directories created since the overflow may have been
+                # missed too, so everything is watched again.
+                overflowed = True
+                self.add_watches(self.root_dir)
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches or not name or name[0] == '.':
+                continue
+            path = os.path.join(self.watches[wd], name)
+            changed.add(path)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_watches(path)
+        if overflowed:
+            return None
+        return changed
+
+    def wait(self, timeout=None):
+        """
+        Blocks until something changes, returning the set of changed
+        paths, or an empty set if timeout seconds pass first. Once a
+        change is seen, further changes are collected until none have
+        arrived for the debounce period. Returns None if changes were
+        lost, in which case anything may have changed.
+        """
+
+        changed = set()
+        while not changed:
+            if not select.select([self.fd], [], [], timeout)[0]:
+                return changed
+            changed = self.read_events()
+            if changed is None:
+                break
+        while select.select([self.fd], [], [], self.debounce)[0]:
+            events = self.read_events()
+            if changed is None or events is None:
+                changed = None
+            else:
+                changed.update(events)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+def make_watcher(root_dir):
+    """
+    Returns an InotifyWatcher for root_dir if possible, or a
+    PollingWatcher otherwise.
+    """
+
+    try:
+        return InotifyWatcher(root_dir)
+    except (OSError, AttributeError):
+        return PollingWatcher(root_dir)
+
+def make_sendfile(libc=None):
+    """
+    Returns a function that copies count bytes from the current position
+    of one file descriptor to another inside the kernel, using
+    sendfile(2). Raises OSError or AttributeError if that isn't
+    supported.
+    """
+
+    if libc is None:
+        libc = load_libc()
+    sendfile = libc.sendfile
+    sendfile.restype = ctypes.c_ssize_t
+    sendfile.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p,
+                         ctypes.c_size_t]
+    def copy(out_fd, in_fd, count):
+        while count > 0:
+            sent = check_libc_result(sendfile(out_fd, in_fd, None, count))
+            if sent == 0:
+                break
+            count -= sent
+    return copy
+
+def find_sendfile():
+    try:
+        return make_sendfile()
+    except (OSError, AttributeError):
+        return None
+
+def parse_accept_encoding(header):
+    """
+    Returns a dict mapping each content coding in an Accept-Encoding
+    header to its quality value.
+
+    >>> sorted(parse_accept_encoding('gzip, BR;q=0.5, *;q=0, x;q=?,')
+    ...        .items())
+    [('*', 0.0), ('br', 0.5), ('gzip', 1.0), ('x', 0.0)]
+    """
+
+    qualities = {}
+    for part in header.split(','):
+        params = part.split(';')
+        coding = params[0].strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+    return qualities
+
+def accepts_encoding(qualities, coding):
+    return qualities.get(coding, qualities.get('*', 0.0)) > 0
+
+class StaticFileHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """
+    Serves files from the server's root_dir over HTTP/1.1 with
+    keep-alive, answering conditional requests via ETags and sending
+    file contents with sendfile(2) where possible.
+
+    If a file has a precompressed sibling (e.g. foo.json.gz next to
+    foo.json) in a content coding the client accepts, the sibling's
+    bytes are sent instead, with a Content-Encoding header.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def translate_path(self, path):
+        path = path.split('?', 1)[0].split('#', 1)[0]
+        trailing_slash = path.rstrip().endswith('/')
+        path = posixpath.normpath(urllib.unquote(path))
+        result = self.server.root_dir
+        for word in filter(None, path.split('/')):
+            if os.path.dirname(word) or word in (os.curdir, os.pardir):
+                continue
+            result = os.path.join(result, word)
+        if trailing_slash:
+            result += '/'
+        return result
+
+    def etag_matches(self, etag):
+        header = self.headers.getheader('If-None-Match')
+        if not header:
+            return False
+        tags = [tag.strip() for tag in header.split(',')]
+        tags = [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+        return etag in tags or '*' in tags
+
+    def find_precompressed(self, path):
+        """
+        Returns a (coding, filename, precompressed) tuple, where filename
+        is the precompressed sibling of path in the client's preferred
+        coding, or path itself with a coding of None if the client
+        accepts none of them. precompressed is whether path has any
+        siblings at all, in which case responses vary by encoding.
+        """
+
+        header = self.headers.getheader('Accept-Encoding', '')
+        qualities = parse_accept_encoding(header)
+        found = False
+        for coding, suffix in PRECOMPRESSED_ENCODINGS:
+            if os.path.isfile(path + suffix):
+                found = True
+                if accepts_encoding(qualities, coding):
+                    return coding, path + suffix, True
+        return None, path, found
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            parts = urlparse.urlsplit(self.path)
+            if not parts.path.endswith('/'):
+                self.send_response(301)
+                self.send_header('Location', urlparse.urlunsplit((
+                    parts[0], parts[1], parts[2] + '/', parts[3], parts[4]
+                )))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return None
+            for index in ('index.html', 'index.htm'):
+                index = os.path.join(path, index)
+                if os.path.exists(index):
+                    path = index
+                    break
+            else:
+                return self.list_directory(path)
+        encoding, filename, precompressed = self.find_precompressed(path)
+        try:
+            f = open(filename, 'rb')
+        except IOError:
+            self.send_error(404, 'File not found')
+            return None
+        fs = os.fstat(f.fileno())
+        # Each variant is a separate file, so the inode keeps their
+        # ETags apart.
+        etag = '"%x-%x-%x"' % (fs.st_ino, fs.st_size,
+                               int(fs.st_mtime * 1000000))
+        if self.etag_matches(etag):
+            f.close()
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            if precompressed:
+                self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return None
+        self.send_response(200)
+        self.send_header('Content-Type', self.guess_type(path))
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        if precompressed:
+            self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Content-Length', str(fs.st_size))
+        self.send_header('Last-Modified', self.date_time_string(fs.st_mtime))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        return f
+
+    def copyfile(self, source, outputfile):
+        if self.server.sendfile is None or not hasattr(source, 'fileno'):
+            return shutil.copyfileobj(source, outputfile)
+        outputfile.flush()
+        size = os.fstat(source.fileno()).st_size
+        self.server.sendfile(self.connection.fileno(), source.fileno(), size)
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, root_dir,
+                 handler=StaticFileHandler):
+        self.root_dir = root_dir
+        self.sendfile = find_sendfile()
+        BaseHTTPServer.HTTPServer.__init__(self, server_address, handler)
+
+class LRUCache(object):
+    """
+    A dict-like cache that holds at most size items, evicting the least
+    recently used one when full.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.items = collections.OrderedDict()
+
+    def get(self, key):
+        if key not in self.items:
+            return None
+        value = self.items.pop(key)
+        self.items[key] = value
+        return value
+
+    def set(self, key, value):
+        self.items.pop(key, None)
+        self.items[key] = value
+        if len(self.items) > self.size:
+            self.items.popitem(last=False)
+
+    def clear(self):
+        self.items.clear()
+
+    def __len__(self):
+        return len(self.items)
+
+class LiveSite(object):
+    """
+    Renders individual pages of a project's website on demand, mapping
+    request paths back to assertions, badge classes and static files
+    through the project's urlmap.
+
+    Rendered pages are kept in an LRU cache along with a fingerprint of
+    the files they were rendered from, and re-rendered when any of
+    those files change.
+    """
+
+    def __init__(self, root_dir, cache_size=1000):
+        self.root_dir = root_dir
+        self.cache = LRUCache(cache_size)
+        self.lock = threading.Lock()
+        self.config_fingerprint = None
+        self.recipients_filename = None
+        self.renders = 0
+
+    def config_inputs(self):
+        inputs = [os.path.join(self.root_dir, 'config.yml')]
+        if self.recipients_filename:
+            inputs.append(self.recipients_filename)
+        return inputs
+
+    def refresh(self):
+        # The project caches recipients, so it's reloaded whenever the
+        # recipient store changes too.
+        if fingerprint(self.config_inputs()) != self.config_fingerprint:
+            self.project = Project(self.root_dir)
+            self.recipients_filename = self.project.recipients_filename
+            self.config_fingerprint = fingerprint(self.config_inputs())
+            self.jinja_env = make_jinja_env(self.project)
+            self.cache.clear()
+
+    def render_template(self, name, **context):
+        template = self.jinja_env.get_template(name)
+        return serialize(template.render(**context), name)
+
+    def resolve(self, path):
+        """
+        Returns a list of the input files for the page at the given URL
+        path and a function that renders it, or None if there's no such
+        page.
+        """
+
+        project = self.project
+        urlmap = project.config['urlmap']
+        if unpathify(urlmap['issuer'], path) is not None:
+            return ([project.path('config.yml')],
+                    lambda: serialize(project.config['issuer'], '.json'))
+        for name in ('assertion', 'evidence'):
+            match = unpathify(urlmap[name], path)
+            slug = match and '%(recipient)s.%(badge)s' % match
+            if slug and slug in project.assertions:
+                filename = project.path('assertions', '%s.yml' % slug)
+                inputs = assertion_inputs(project, filename, match['badge'])
+                if name == 'assertion':
+                    return inputs, lambda: serialize(
+                        project.assertions[slug].json, '.json'
+                    )
+                template = self.jinja_env.get_template('assertion.html')
+                return (inputs + template_inputs(project, template),
+                        lambda: self.render_template(
+                            'assertion.html',
+                            assertion=project.assertions[slug]
+                        ))
+        for name in ('badge', 'criteria', 'image'):
+            match = unpathify(urlmap[name], path)
+            slug = match and match['badge']
+            if slug and slug in project.badges:
+                filename = project.path('badges', '%s.yml' % slug)
+                inputs = badge_inputs(project, filename)
+                if name == 'badge':
+                    return inputs, lambda: serialize(
+                        project.badges[slug].json, '.json'
+                    )
+                elif name == 'criteria':
+                    template = self.jinja_env.get_template('badge.html')
+                    return (inputs + template_inputs(project, template),
+                            lambda: self.render_template(
+                                'badge.html',
+                                badge=project.badges[slug]
+                            ))
+                elif os.path.exists(inputs[-1]):
+                    return [inputs[-1]], lambda: open(inputs[-1], 'rb').read()
+        parts = [word for word in path.split('/')
+                 if word and not os.path.dirname(word) and
+                 word not in (os.curdir, os.pardir)]
+        if not parts or path.endswith('/'):
+            parts.append('index.html')
+        static_file = os.path.join(project.STATIC_DIR, *parts)
+        static_dir = os.path.realpath(project.STATIC_DIR)
+        if (os.path.isfile(static_file) and os.path.realpath(
+                static_file).startswith(static_dir + os.sep)):
+            return [static_file], lambda: open(static_file, 'rb').read()
+        return None
+
+    def respond(self, path):
+        """
+        Returns a (fingerprint, body) tuple for the page at the given
+        URL path, or None if there's no such page.
+        """
+
+        with self.lock:
+            self.refresh()
+            resolved = self.resolve(path)
+            if resolved is None:
+                return None
+            inputs, render = resolved
+            signature = fingerprint(inputs)
+            cached = self.cache.get(path)
+            if cached is None or cached[0] != signature:
+                self.renders += 1
+                cached = (signature, render())
+                self.cache.set(path, cached)
+            return cached
+
+class LiveHandler(StaticFileHandler):
+    """
+    Serves pages rendered on demand by the server's LiveSite.
+    """
+
+    def send_head(self):
+        rawpath = urllib.unquote(urlparse.urlsplit(self.path).path)
+        # Request targets needn't start with a slash, and normpath keeps
+        # any leading '..' of a relative path.
+        path = posixpath.normpath('/' + rawpath.lstrip('/'))
+        if rawpath.endswith('/') and not path.endswith('/'):
+            path += '/'
+        response = self.server.site.respond(path)
+        if response is None:
+            self.send_error(404, 'File not found')
+            return None
+        signature, body = response
+        etag = '"%s"' % signature
+        if self.etag_matches(etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return None
+        self.send_response(200)
+        if path.endswith('/'):
+            path += 'index.html'
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        return cStringIO.StringIO(body)
+
+def start_file_server(ip, port, root_dir):
+    httpd = ThreadingHTTPServer((ip, port), root_dir)
     print "serving at port %s on %s" % (port, ip)
     httpd.serve_forever()
 
-def auto_rebuilder(root_dir, dest_dir):
-    laststate = None
+def rebuild(project, root_dir, dest_dir, changed, precompress=False):
+    """
+    Brings the website in dest_dir up to date with the given set of
+    changed paths, regenerating only the affected outputs if possible.
+    Returns the project to use for the next rebuild.
+    """
+
+    affected = None
+    if project is not None and changed is not None:
+        affected = find_affected_outputs(project, changed)
+    if affected is None:
+        project = Project(root_dir)
+        build_website(project, dest_dir=dest_dir, incremental=True,
+                      precompress=precompress)
+    else:
+        update_website(project, dest_dir, affected,
+                       precompress=precompress)
+    return project
+
+def auto_rebuilder(root_dir, dest_dir, watcher, precompress=False):
+    """
+    Builds the website, then rebuilds the parts of it affected by
+    whatever the watcher reports as changed, yielding the set of changed
+    paths after each build. The initial build, and any build after the
+    watcher has lost track of what changed, is a full one and yields
+    None.
+    """
+
+    project = None
+    changed = None
     while True:
-        currstate = get_dir_state(root_dir)
-        if currstate != laststate:
-            laststate = currstate
+        if changed is None:
             sys.stdout.write("rebuilding website... ")
-            sys.stdout.flush()
-            try:
-                build_website(Project(root_dir), dest_dir=dest_dir)
-                sys.stdout.write("done.\n")
-            except Exception:
-                traceback.print_exc(file=sys.stdout)
-        yield
-
-def start_auto_rebuild_server(root_dir, ip, port):
+        else:
+            sys.stdout.write("%d file(s) changed, rebuilding website... " %
+                             len(changed))
+        sys.stdout.flush()
+        try:
+            project = rebuild(project, root_dir, dest_dir, changed,
+                              precompress)
+            sys.stdout.write("done.\n")
+        except Exception:
+            project = None
+            traceback.print_exc(file=sys.stdout)
+        yield changed
+        changed = watcher.wait()
+
+def start_auto_rebuild_server(root_dir, ip, port, precompress=False):
     dest_dir = tempfile.mkdtemp()
+    watcher = make_watcher(root_dir)
     thread = threading.Thread(target=start_file_server,
-                              kwargs=dict(ip=ip, port=port))
+                              kwargs=dict(ip=ip, port=port,
+                                          root_dir=dest_dir))
     thread.daemon = True
     thread.start()
     try:
-        for _ in auto_rebuilder(root_dir, dest_dir):
-            os.chdir(dest_dir)
-            time.sleep(1)
+        for _ in auto_rebuilder(root_dir, dest_dir, watcher, precompress):
+            pass
     finally:
+        watcher.close()
         if os.path.exists(dest_dir):
             shutil.rmtree(dest_dir)
+
+def start_live_server(root_dir, ip, port):
+    httpd = ThreadingHTTPServer((ip, port), root_dir, handler=LiveHandler)
+    httpd.site = LiveSite(root_dir)
+    print "serving %s live at port %s on %s" % (root_dir, port, ip)
+    httpd.serve_forever()
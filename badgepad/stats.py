@@ -0,0 +1,27 @@
+"""
+Process-wide counters used to instrument builds, e.g. how many YAML
+files were parsed or how many bytes were written.
+"""
+
+import collections
+
+counters = collections.Counter()
+
+def count(name, amount=1):
+    counters[name] += amount
+
+def snapshot():
+    return dict(counters)
+
+def since(before):
+    """
+    Returns the counters that have changed since the given snapshot,
+    along with how much they've changed by.
+    """
+
+    return dict((name, value - before.get(name, 0))
+                for name, value in counters.items()
+                if value != before.get(name, 0))
+
+def merge(changes):
+    counters.update(changes)
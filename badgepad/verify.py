@@ -0,0 +1,289 @@
+import os
+import json
+import math
+import time
+import socket
+import httplib
+import urllib
+import urlparse
+import threading
+from multiprocessing.pool import ThreadPool
+
+from .project import hash_identity
+from .connections import KeepAliveClient
+
+class FetchError(Exception):
+    pass
+
+class DirectorySite(object):
+    """
+    A built website in a directory, e.g. dist.
+    """
+
+    def __init__(self, dist_dir):
+        self.dist_dir = os.path.abspath(dist_dir)
+
+    def fetch(self, path):
+        """
+        Returns the contents of the file at the given path, relative to
+        the root of the site, or raises FetchError.
+        """
+
+        parts = [part for part in path.split('/') if part]
+        if os.pardir in parts:
+            raise FetchError('is outside the site')
+        filename = os.path.join(self.dist_dir, *parts)
+        if os.path.isdir(filename):
+            filename = os.path.join(filename, 'index.html')
+        try:
+            f = open(filename, 'rb')
+        except IOError:
+            raise FetchError('not found')
+        data = f.read()
+        f.close()
+        return data
+
+    def close(self):
+        pass
+
+class HttpSite(KeepAliveClient):
+    """
+    A website served over HTTP at url, e.g. by badgepad serve.
+    """
+
+    TIMEOUT = 30
+
+    def __init__(self, url):
+        KeepAliveClient.__init__(self, url)
+        self.root = urlparse.urlsplit(url).path.rstrip('/') + '/'
+
+    def fetch(self, path):
+        conn = self.connection()
+        try:
+            conn.request('GET', urllib.quote(self.root + path, safe='/~'))
+            response = conn.getresponse()
+            data = response.read()
+        except (socket.error, httplib.HTTPException), e:
+            self.reset()
+            raise FetchError(str(e) or e.__class__.__name__)
+        if response.status != 200:
+            raise FetchError('HTTP %d %s' % (response.status,
+                                              response.reason))
+        return data
+
+def percentiles(values, points=(50, 90, 99)):
+    """
+    Returns a dict mapping each of the given percentiles of values, and
+    'max', to the nearest-rank value.
+
+    >>> sorted(percentiles(range(1, 101)).items())
+    [('max', 100), ('p50', 50), ('p90', 90), ('p99', 99)]
+    """
+
+    values = sorted(values) or [0]
+    result = {'max': values[-1]}
+    for point in points:
+        rank = int(math.ceil(point / 100.0 * len(values)))
+        result['p%d' % point] = values[max(rank, 1) - 1]
+    return result
+
+class Verifier(object):
+    """
+    Checks that a built website verifies: that every assertion in the
+    project is hosted where its verify.url says, for the right
+    recipient, and that the badge class, issuer, image, criteria and
+    evidence it refers to are all there and refer to each other.
+
+    Assertions are fetched by a pool of jobs threads, while the shared
+    documents they refer to, like badge classes, are only fetched and
+    checked once. The time each fetch takes is recorded, and problems
+    are collected as (url, message) tuples.
+    """
+
+    def __init__(self, project, site, jobs=8):
+        self.project = project
+        self.site = site
+        self.jobs = jobs
+        self.lock = threading.Lock()
+        self.memo = {}
+        self.latencies = []
+        self.problems = []
+
+    def problem(self, url, message):
+        with self.lock:
+            self.problems.append((url, message))
+
+    def once(self, key, func, *args):
+        """
+        Returns func(*args), calling it only the first time key is seen.
+        Other threads wanting the same key wait for that first call.
+        """
+
+        with self.lock:
+            entry = self.memo.get(key)
+            first = entry is None
+            if first:
+                entry = self.memo[key] = {'done': threading.Event()}
+        if first:
+            try:
+                entry['value'] = func(*args)
+            finally:
+                entry['done'].set()
+        else:
+            entry['done'].wait()
+        return entry.get('value')
+
+    def fetch(self, url):
+        """
+        Returns the document at url, or None if it can't be fetched.
+        """
+
+        base_url = self.project.config['issuer']['url']
+        if not url.startswith(base_url):
+            self.problem(url, 'is not part of the site at %s' % base_url)
+            return None
+        path = urllib.unquote(url[len(base_url):].split('#')[0]
+                              .split('?')[0])
+        start = time.time()
+        try:
+            return self.site.fetch(path)
+        except FetchError, e:
+            self.problem(url, str(e))
+            return None
+        finally:
+            with self.lock:
+                self.latencies.append(time.time() - start)
+
+    def fetch_json(self, url):
+        data = self.fetch(url)
+        if data is None:
+            return None
+        try:
+            obj = json.loads(data)
+        except ValueError:
+            obj = None
+        if not isinstance(obj, dict):
+            self.problem(url, 'is not a JSON object')
+            return None
+        return obj
+
+    def expect(self, url, name, value, expected):
+        if value != expected:
+            self.problem(url, '%s is %s, expected %s' % (
+                name, json.dumps(value), json.dumps(expected)
+            ))
+
+    def require(self, url, obj, names):
+        for name in names:
+            if not obj.get(name):
+                self.problem(url, '%s is missing' % name)
+
+    def check_issuer(self):
+        """
+        Checks the issuer, and makes the project use the base URL the
+        site was built with, which is the issuer's url.
+        """
+
+        path = '/'.join(self.project.paths['json'])
+        url = self.project.absurl(path)
+        try:
+            issuer = json.loads(self.site.fetch(path))
+        except FetchError, e:
+            self.problem(url, str(e))
+            return
+        except ValueError:
+            issuer = None
+        if not (isinstance(issuer, dict) and issuer.get('url')):
+            self.problem(url, 'is not an issuer with a url')
+            return
+        self.project.set_base_url(issuer['url'])
+        self.require(self.project.absurl(path), issuer, ['name'])
+
+    def check_badge(self, url):
+        badge = self.fetch_json(url)
+        if badge is None:
+            return
+        self.require(url, badge, ['name', 'description', 'criteria',
+                                  'issuer'])
+        if badge.get('issuer'):
+            self.expect(url, 'issuer', badge['issuer'], self.project.absurl(
+                *self.project.paths['json']
+            ))
+        for name in ('criteria', 'image'):
+            if badge.get(name):
+                self.fetch(badge[name])
+
+    def check_assertion(self, entry):
+        """
+        Checks everything about the assertion for the given index entry
+        that doesn't involve its recipient, returning its recipient
+        slug, URL and JSON (or None if it couldn't be fetched).
+        """
+
+        recipient, badge, filename = entry
+        project = self.project
+        paths = project.assertion_paths(recipient, badge)
+        url = project.absurl(*paths['json'])
+        assn = self.fetch_json(url)
+        if assn is None:
+            return recipient, url, None
+        self.expect(url, 'uid', assn.get('uid'), '%s.%s' % (recipient, badge))
+        verify = assn.get('verify')
+        if not isinstance(verify, dict):
+            verify = {}
+        self.expect(url, 'verify.type', verify.get('type'), 'hosted')
+        self.expect(url, 'verify.url', verify.get('url'), url)
+        self.require(url, assn, ['issuedOn'])
+        self.expect(url, 'badge', assn.get('badge'),
+                    project.absurl(*project.badge_paths(badge)['json']))
+        if assn.get('badge'):
+            self.once(('badge', assn['badge']), self.check_badge,
+                      assn['badge'])
+        if assn.get('evidence'):
+            self.fetch(assn['evidence'])
+        return recipient, url, assn
+
+    def check_recipient(self, url, slug, identity):
+        if slug not in self.project.recipients:
+            self.problem(url, "recipient '%s' does not exist" % slug)
+            return
+        if not isinstance(identity, dict):
+            self.problem(url, 'recipient is missing')
+            return
+        email = self.project.recipients[slug].email
+        if identity.get('hashed'):
+            email = hash_identity((email, identity.get('salt') or ''))
+        if identity.get('identity') != email:
+            self.problem(url, "recipient does not match %s's email "
+                              "address" % slug)
+
+    def run(self):
+        """
+        Checks the whole site and returns a report of how many
+        assertions were checked, how many documents were fetched, how
+        long it took, the latency percentiles of the fetches in seconds
+        and the problems found, sorted by URL.
+        """
+
+        start = time.time()
+        self.check_issuer()
+        entries = self.project.assertions.index['all']
+        pool = ThreadPool(self.jobs)
+        try:
+            # Recipients are looked up here rather than in the pool,
+            # since recipient stores aren't necessarily thread-safe.
+            for slug, url, assn in pool.imap_unordered(self.check_assertion,
+                                                       entries):
+                if assn is not None:
+                    self.check_recipient(url, slug, assn.get('recipient'))
+        finally:
+            pool.close()
+            pool.join()
+            self.site.close()
+        return {
+            'assertions': len(entries),
+            'fetches': len(self.latencies),
+            'seconds': time.time() - start,
+            'latency': percentiles(self.latencies),
+            'problems': sorted(self.problems)
+        }
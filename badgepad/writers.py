@@ -0,0 +1,410 @@
+import os
+import gzip
+import json
+import time
+import errno
+import fcntl
+import shutil
+import hashlib
+import tarfile
+import zipfile
+import tempfile
+from cStringIO import StringIO
+
+from .stats import count
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2')
+LINK_MODES = ('copy', 'hardlink', 'reflink')
+FICLONE = 0x40049409
+
+# Outputs that get precompressed siblings, and the suffixes those
+# siblings can have.
+COMPRESSIBLE_SUFFIXES = ('.json', '.html')
+VARIANT_SUFFIXES = ('.gz', '.br')
+
+# Copying a file's modification time can lose sub-microsecond precision,
+# so times this close together are considered equal.
+MTIME_WINDOW = 0.001
+
+def make_dirs(dirname):
+    """
+    Like os.makedirs(), but doesn't mind if the directory already
+    exists, e.g. because another worker process just created it.
+    """
+
+    try:
+        os.makedirs(dirname)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+
+def remove_file(filename):
+    """
+    Like os.remove(), but doesn't mind if the file doesn't exist.
+    """
+
+    try:
+        os.remove(filename)
+    except OSError, e:
+        if e.errno != errno.ENOENT:
+            raise
+
+def serialize(data, filename, compact=False):
+    """
+    Returns the bytes to store in the given output file for data.
+    """
+
+    if filename.endswith('.json'):
+        if compact:
+            return json.dumps(data, sort_keys=True, separators=(',', ':'))
+        return json.dumps(data, sort_keys=True, indent=True)
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    return data
+
+def is_archive(filename):
+    return filename.endswith(ARCHIVE_SUFFIXES)
+
+def gzip_compress(data):
+    """
+    Gzips data at the highest compression level. The result depends only
+    on data, so unchanged outputs have unchanged siblings.
+    """
+
+    out = StringIO()
+    f = gzip.GzipFile(filename='', mode='wb', compresslevel=9, fileobj=out,
+                      mtime=0)
+    f.write(data)
+    f.close()
+    return out.getvalue()
+
+def compressors():
+    """
+    Returns a (suffix, compress) pair for each precompressed sibling to
+    write: gzip always, and brotli if the brotli module is installed.
+    """
+
+    result = [('.gz', gzip_compress)]
+    if brotli is not None:
+        result.append(('.br', brotli.compress))
+    return result
+
+def variants(data, path):
+    """
+    Yields the path and contents of each precompressed sibling of the
+    output at path.
+    """
+
+    if path[-1].endswith(COMPRESSIBLE_SUFFIXES):
+        for suffix, compress in compressors():
+            yield tuple(path[:-1]) + (path[-1] + suffix,), compress(data)
+
+def has_content(filename, data):
+    try:
+        if os.path.getsize(filename) != len(data):
+            return False
+        f = open(filename, 'rb')
+        try:
+            return f.read() == data
+        finally:
+            f.close()
+    except (OSError, IOError):
+        return False
+
+def file_digest(filename):
+    digest = hashlib.sha1()
+    f = open(filename, 'rb')
+    for chunk in iter(lambda: f.read(65536), ''):
+        digest.update(chunk)
+    f.close()
+    return digest.hexdigest()
+
+def same_file(filename, src):
+    """
+    Returns whether filename is a copy of src. Files of the same size and
+    modification time are assumed to be copies, as rsync does; otherwise
+    their contents are hashed.
+    """
+
+    try:
+        a = os.stat(filename)
+        b = os.stat(src)
+    except OSError:
+        return False
+    if (a.st_dev, a.st_ino) == (b.st_dev, b.st_ino):
+        return True
+    if a.st_size != b.st_size:
+        return False
+    if abs(a.st_mtime - b.st_mtime) < MTIME_WINDOW:
+        return True
+    return file_digest(filename) == file_digest(src)
+
+def reflink(src, dest):
+    """
+    Makes dest a copy-on-write clone of src, which takes no time or space
+    on filesystems like btrfs and XFS. Raises IOError on filesystems that
+    don't support it.
+    """
+
+    src_file = open(src, 'rb')
+    try:
+        dest_file = open(dest, 'wb')
+        try:
+            fcntl.ioctl(dest_file.fileno(), FICLONE, src_file.fileno())
+        finally:
+            dest_file.close()
+    finally:
+        src_file.close()
+    shutil.copystat(src, dest)
+
+def default_mode(mode):
+    umask = os.umask(0)
+    os.umask(umask)
+    return mode & ~umask
+
+class DirectoryWriter(object):
+    """
+    Writes output files under dest_dir, creating each directory only
+    once.
+
+    Files whose content wouldn't change are left alone, so their
+    modification times stay put and sync tools have less to transfer.
+    If previous_dir is given, dest_dir is taken to be a fresh directory
+    and unchanged files are hard-linked from previous_dir instead.
+
+    Copied files can be hard-linked or reflinked to their sources instead,
+    depending on link_mode, falling back to copying if that's not
+    possible.
+
+    If precompress is true, JSON and HTML files also get gzipped (and
+    brotli-compressed) siblings, which are left alone along with them
+    when they haven't changed.
+
+    Writers can be passed to worker processes.
+    """
+
+    SHAREABLE = True
+
+    def __init__(self, dest_dir, previous_dir=None, compact=False,
+                 link_mode='copy', precompress=False):
+        if link_mode not in LINK_MODES:
+            raise ValueError('unknown link mode: %s' % link_mode)
+        self.dest_dir = os.path.abspath(dest_dir)
+        self.previous_dir = previous_dir
+        self.compact = compact
+        self.link_mode = link_mode
+        self.precompress = precompress
+        self.dirs = set()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['dirs'] = set()
+        return state
+
+    def make_dir(self, dirname):
+        if dirname not in self.dirs:
+            make_dirs(dirname)
+            self.dirs.add(dirname)
+
+    def reuse(self, path, matches, counter='files_unchanged'):
+        existing = os.path.join(self.previous_dir or self.dest_dir, *path)
+        if not matches(existing):
+            return False
+        if self.previous_dir:
+            abspath = os.path.join(self.dest_dir, *path)
+            self.make_dir(os.path.dirname(abspath))
+            try:
+                os.link(existing, abspath)
+            except OSError:
+                return False
+        count(counter)
+        return True
+
+    def replace(self, abspath, fill):
+        # Write to a temporary file and rename it into place, so that
+        # anyone reading the file while the site is rebuilt in place
+        # never sees it half-written.
+        dirname = os.path.dirname(abspath)
+        self.make_dir(dirname)
+        tmppath = os.path.join(dirname, '.%s.tmp' % os.path.basename(abspath))
+        fill(tmppath)
+        os.rename(tmppath, abspath)
+
+    def write_bytes(self, data, path):
+        def fill(tmppath):
+            f = open(tmppath, 'wb')
+            f.write(data)
+            f.close()
+        self.replace(os.path.join(self.dest_dir, *path), fill)
+
+    def write(self, data, path):
+        data = serialize(data, path[-1], self.compact)
+        unchanged = self.reuse(path,
+                               lambda filename: has_content(filename, data))
+        if not unchanged:
+            self.write_bytes(data, path)
+            count('files_written')
+            count('bytes_written', len(data))
+        if self.precompress:
+            self.write_variants(data, path, unchanged)
+        elif not unchanged and self.previous_dir is None:
+            # Siblings left by an earlier precompressed build in place
+            # would no longer match.
+            for suffix in VARIANT_SUFFIXES:
+                remove_file(os.path.join(self.dest_dir, *path) + suffix)
+
+    def write_variants(self, data, path, unchanged):
+        if not path[-1].endswith(COMPRESSIBLE_SUFFIXES):
+            return
+        for suffix, compress in compressors():
+            variant = tuple(path[:-1]) + (path[-1] + suffix,)
+            if unchanged and self.reuse(variant, os.path.exists,
+                                        'files_compressed_unchanged'):
+                continue
+            compressed = compress(data)
+            self.write_bytes(compressed, variant)
+            count('files_compressed')
+            count('bytes_compressed', len(compressed))
+
+    def copy(self, src, path):
+        size = os.path.getsize(src)
+        if self.reuse(path, lambda filename: same_file(filename, src)):
+            count('bytes_skipped', size)
+            return
+        self.replace(os.path.join(self.dest_dir, *path),
+                     lambda tmppath: self.transfer(src, tmppath, size))
+
+    def transfer(self, src, dest, size):
+        if self.link_mode != 'copy':
+            try:
+                if self.link_mode == 'hardlink':
+                    os.link(src, dest)
+                else:
+                    reflink(src, dest)
+                count('files_linked')
+                count('bytes_linked', size)
+                return
+            except EnvironmentError:
+                pass
+        shutil.copy2(src, dest)
+        count('files_copied')
+        count('bytes_copied', size)
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+class ArchiveWriter(object):
+    """
+    Writes output files into a new archive, which replaces filename when
+    close() is called.
+
+    Archives can't be shared with worker processes, so their outputs
+    are sent back to be written by the process that owns the archive.
+    """
+
+    SHAREABLE = False
+
+    def __init__(self, filename, compact=False, precompress=False):
+        self.filename = os.path.abspath(filename)
+        self.compact = compact
+        self.precompress = precompress
+        dirname, basename = os.path.split(self.filename)
+        make_dirs(dirname)
+        fd, self.tmppath = tempfile.mkstemp(prefix='.%s-' % basename,
+                                            suffix='.tmp', dir=dirname)
+        os.close(fd)
+        self.open_archive()
+
+    def write(self, data, path):
+        data = serialize(data, path[-1], self.compact)
+        self.add_data('/'.join(path), data)
+        count('files_written')
+        count('bytes_written', len(data))
+        if self.precompress:
+            for variant, compressed in variants(data, path):
+                self.add_data('/'.join(variant), compressed)
+                count('files_compressed')
+                count('bytes_compressed', len(compressed))
+
+    def copy(self, src, path):
+        self.add_file('/'.join(path), src)
+        count('files_copied')
+        count('bytes_copied', os.path.getsize(src))
+
+    def close(self):
+        self.archive.close()
+        os.chmod(self.tmppath, default_mode(0666))
+        os.rename(self.tmppath, self.filename)
+
+    def abort(self):
+        self.archive.close()
+        os.remove(self.tmppath)
+
+class TarWriter(ArchiveWriter):
+    def open_archive(self):
+        if self.filename.endswith(('.gz', '.tgz')):
+            mode = 'w:gz'
+        elif self.filename.endswith('.bz2'):
+            mode = 'w:bz2'
+        else:
+            mode = 'w'
+        self.archive = tarfile.open(self.tmppath, mode)
+
+    def add_data(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = time.time()
+        info.mode = default_mode(0666)
+        self.archive.addfile(info, StringIO(data))
+
+    def add_file(self, name, src):
+        self.archive.add(src, name)
+
+class ZipWriter(ArchiveWriter):
+    def open_archive(self):
+        self.archive = zipfile.ZipFile(self.tmppath, 'w',
+                                       zipfile.ZIP_DEFLATED)
+
+    def add_data(self, name, data):
+        info = zipfile.ZipInfo(name, time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = default_mode(0666) << 16
+        self.archive.writestr(info, data)
+
+    def add_file(self, name, src):
+        self.archive.write(src, name)
+
+def open_archive(filename, compact=False, precompress=False):
+    if filename.endswith('.zip'):
+        return ZipWriter(filename, compact=compact, precompress=precompress)
+    return TarWriter(filename, compact=compact, precompress=precompress)
+
+class OutputCollector(object):
+    """
+    Stands in for a writer that can't be shared with a worker process,
+    remembering what was written so it can be replayed into the real
+    writer later.
+    """
+
+    SHAREABLE = True
+
+    def __init__(self):
+        self.outputs = []
+
+    def write(self, data, path):
+        self.outputs.append(('write', data, path))
+
+    def copy(self, src, path):
+        self.outputs.append(('copy', src, path))
+
+    def replay(self, writer):
+        for method, arg, path in self.outputs:
+            getattr(writer, method)(arg, path)
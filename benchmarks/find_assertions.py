@@ -0,0 +1,76 @@
+"""
+Compares glob-based assertion lookups against the in-memory index.
+
+Usage:
+
+    python benchmarks/find_assertions.py [num-assertions] [num-lookups]
+"""
+
+import os
+import sys
+import time
+import shutil
+import random
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from badgepad.project import Project
+
+NUM_BADGES = 200
+
+def make_project(dirname, num_assertions):
+    os.mkdir(os.path.join(dirname, 'assertions'))
+    num_recipients = max(num_assertions / NUM_BADGES, 1)
+    for i in range(num_assertions):
+        recipient = 'r%d' % (i % num_recipients)
+        badge = 'b%d' % (i / num_recipients)
+        filename = os.path.join(dirname, 'assertions',
+                                '%s.%s.yml' % (recipient, badge))
+        open(filename, 'w').close()
+    return num_recipients
+
+def timeit(func, queries):
+    start = time.time()
+    for recipient, badge in queries:
+        func(recipient, badge)
+    return time.time() - start
+
+def main(num_assertions=50000, num_lookups=200):
+    dirname = tempfile.mkdtemp()
+    try:
+        num_recipients = make_project(dirname, num_assertions)
+        project = Project(dirname)
+        queries = []
+        for i in range(num_lookups):
+            if i % 2:
+                queries.append(('r%d' % random.randrange(num_recipients),
+                                '*'))
+            else:
+                queries.append(('*', 'b%d' % random.randrange(NUM_BADGES)))
+
+        glob_time = timeit(lambda r, b: project.glob(
+            'assertions', '%s.%s.yml' % (r, b)
+        ), queries)
+
+        start = time.time()
+        project.assertions.index
+        index_build_time = time.time() - start
+
+        index_time = timeit(lambda r, b: project.assertions.filenames(
+            recipient=r, badge=b
+        ), queries)
+
+        print "%d assertions, %d lookups" % (num_assertions, num_lookups)
+        print "  glob:  %8.3fs (%.3fms/lookup)" % (
+            glob_time, glob_time * 1000 / num_lookups
+        )
+        print "  index: %8.3fs (%.3fms/lookup, plus %.3fs to build)" % (
+            index_time, index_time * 1000 / num_lookups, index_build_time
+        )
+    finally:
+        shutil.rmtree(dirname)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,35 @@
+"""
+Reports how long each badgepad command takes to start up, and which
+imports cost it the most, in the spirit of python -X importtime.
+
+Usage:
+
+    python benchmarks/startup.py [num-imports]
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from badgepad.bench import run_startup_benchmarks
+
+def main(num_imports=5):
+    dirname = tempfile.mkdtemp()
+    try:
+        results = run_startup_benchmarks(dirname)
+    finally:
+        shutil.rmtree(dirname)
+
+    for name, report in sorted(results.items()):
+        print "%-18s %6.1fms" % (name, report['seconds'] * 1000)
+        slowest = sorted(report['imports'].items(),
+                         key=lambda item: item[1], reverse=True)
+        for module, seconds in slowest[:num_imports]:
+            print "    %-22s %6.1fms" % (module, seconds * 1000)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
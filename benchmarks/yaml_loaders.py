@@ -0,0 +1,54 @@
+"""
+Compares the libyaml and pure-Python safe loaders on a synthetic
+project's assertions.
+
+Usage:
+
+    python benchmarks/yaml_loaders.py [num-assertions]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from badgepad.bench import generate_project
+from badgepad.project import find_yaml_loader
+
+def parse_all(contents, loader):
+    start = time.time()
+    for content in contents:
+        list(yaml.load_all(content, loader))
+    return time.time() - start
+
+def main(num_assertions=10000):
+    dirname = tempfile.mkdtemp()
+    try:
+        generate_project(dirname, recipients=max(num_assertions / 10, 1),
+                         badges=10, assertions=num_assertions)
+        assertions_dir = os.path.join(dirname, 'assertions')
+        contents = [open(os.path.join(assertions_dir, filename)).read()
+                    for filename in os.listdir(assertions_dir)]
+
+        print "%d assertions, badgepad uses %s" % (len(contents),
+                                                   find_yaml_loader().__name__)
+        python_time = parse_all(contents, yaml.SafeLoader)
+        print "  SafeLoader:  %8.3fs" % python_time
+        if hasattr(yaml, 'CSafeLoader'):
+            c_time = parse_all(contents, yaml.CSafeLoader)
+            print "  CSafeLoader: %8.3fs (%.1fx faster)" % (
+                c_time, python_time / c_time
+            )
+        else:
+            print "  CSafeLoader: unavailable (PyYAML lacks libyaml)"
+    finally:
+        shutil.rmtree(dirname)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
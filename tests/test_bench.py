@@ -0,0 +1,103 @@
+import os
+import sys
+import json
+import runpy
+import Queue
+import tempfile
+import shutil
+import unittest
+from cStringIO import StringIO
+
+from badgepad import bench
+from badgepad.project import Project, find_yaml_loader
+
+class GenerateProjectTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testProjectIsGenerated(self):
+        bench.generate_project(self.dir, recipients=3, badges=2,
+                               assertions=5)
+        proj = Project(self.dir)
+        self.assertEqual(len(proj.recipients), 3)
+        self.assertEqual(len(list(proj.badges)), 2)
+        self.assertTrue(proj.badges['b0'].image_url)
+        self.assertEqual(proj.assertions.count(), 5)
+        self.assertTrue('<em>great things</em>' in
+                        proj.assertions['r0.b0'].evidence_html)
+
+    def testAssertionsAreCapped(self):
+        bench.generate_project(self.dir, recipients=2, badges=2,
+                               assertions=10)
+        self.assertEqual(Project(self.dir).assertions.count(), 4)
+
+    def testFullBuildWorks(self):
+        bench.generate_project(self.dir, recipients=2, badges=1,
+                               assertions=2)
+        bench.full_build(self.dir, os.path.join(self.dir, 'dist'))
+        self.assertTrue(os.path.exists(os.path.join(self.dir, 'dist',
+                                                    'issuer.json')))
+
+class PeakRssGrowthTests(unittest.TestCase):
+    def testGrowthIsReportedInProcess(self):
+        queue = Queue.Queue()
+        bench.report_peak_rss_growth(queue, lambda size: 'x' * size,
+                                     [64 * 1024 * 1024])
+        self.assertTrue(queue.get() >= 60 * 1024)
+
+    def testGrowthIsMeasuredInChildProcess(self):
+        growth = bench.peak_rss_growth(lambda size: 'x' * size,
+                                       64 * 1024 * 1024)
+        self.assertTrue(growth >= 60 * 1024)
+
+class MainTests(unittest.TestCase):
+    ARGS = ['--recipients', '3', '--badges', '2', '--assertions', '4']
+
+    def testResultsAreWrittenToStdout(self):
+        stdout = StringIO()
+        bench.main(self.ARGS, stdout=stdout)
+        report = json.loads(stdout.getvalue())
+        self.assertEqual(report['size']['assertions'], 4)
+        self.assertEqual(report['yaml_loader'],
+                         find_yaml_loader().__name__)
+        self.assertEqual(sorted(report['results']), [
+            'build',
+            'build_peak_rss_growth_kb',
+            'build_phases',
+            'export',
+            'export_query',
+            'get_dir_state',
+            'incremental_build_unchanged',
+            'load_project',
+            'serve_rebuild_one_assertion',
+            'startup'
+        ])
+        self.assertEqual(sorted(report['results']['startup']),
+                         sorted(name for name, argv
+                                in bench.STARTUP_COMMANDS))
+        self.assertTrue('jinja2' in
+                        report['results']['startup']['build']['imports'])
+        self.assertTrue('assertions' in report['results']['build_phases'])
+
+    def testResultsAreWrittenToFile(self):
+        dirname = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(dirname, 'results.json')
+            bench.main(self.ARGS + ['-o', filename])
+            self.assertTrue(json.load(open(filename))['results']['build'])
+        finally:
+            shutil.rmtree(dirname)
+
+    def testModuleIsRunnable(self):
+        old_argv, old_stdout = sys.argv, sys.stdout
+        sys.argv = ['bench'] + self.ARGS
+        sys.stdout = StringIO()
+        try:
+            runpy.run_module('badgepad.bench', run_name='__main__')
+            output = sys.stdout.getvalue()
+        finally:
+            sys.argv, sys.stdout = old_argv, old_stdout
+        self.assertTrue('"results"' in output)
@@ -0,0 +1,656 @@
+import os
+import gzip
+import json
+import time
+import tempfile
+import shutil
+import zipfile
+import unittest
+import jinja2
+from minimock import mock, restore
+
+from badgepad.project import Project, hash_identity
+from badgepad import build, bench, stats
+from badgepad.build import build_website, Manifest, PhaseTimer, \
+                           find_affected_outputs, update_website, \
+                           exchange_paths
+from badgepad.writers import DirectoryWriter
+
+from .test_project import SAMPLE_PROJECT, use_recipients_file
+
+class BaseBuildTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.dir, 'proj')
+        self.dest = os.path.join(self.dir, 'dist')
+        shutil.copytree(SAMPLE_PROJECT, self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def build(self, **kwargs):
+        return build_website(Project(self.root), self.dest, **kwargs)
+
+    def dest_path(self, *path):
+        return os.path.join(self.dest, *path)
+
+    def touch(self, *path):
+        filename = os.path.join(self.root, *path)
+        future = time.time() + 10
+        os.utime(filename, (future, future))
+
+    def read_tree(self, dirname):
+        files = {}
+        for dirpath, dirnames, filenames in os.walk(dirname):
+            for filename in filenames:
+                abspath = os.path.join(dirpath, filename)
+                files[os.path.relpath(abspath, dirname)] = \
+                    open(abspath, 'rb').read()
+        return files
+
+class ParallelBuildTests(BaseBuildTest):
+    def testOutputMatchesSerialBuild(self):
+        build_website(Project(self.root), self.dest_path('serial'))
+        build_website(Project(self.root), self.dest_path('parallel'),
+                      jobs=2)
+        serial = self.read_tree(self.dest_path('serial'))
+        self.assertEqual(len(serial), 16)
+        self.assertEqual(self.read_tree(self.dest_path('parallel')), serial)
+
+    def testWorkersShareParseCache(self):
+        project = Project(self.root)
+        project.open_cache()
+        build_website(project, self.dest, jobs=2)
+        project.cache.close()
+        project = Project(self.root)
+        project.open_cache()
+        project.cache.max_size = 0
+        timer = PhaseTimer()
+        build_website(project, self.dest, jobs=2, timer=timer)
+        project.cache.close()
+        counts = timer.phases[-1]['counts']
+        self.assertEqual(counts.get('yaml_parses', 0), 0)
+        self.assertEqual(counts.get('markdown_renders', 0), 0)
+
+    def testTodoGeneratorsAreRenderedInChunks(self):
+        project = Project(self.root)
+        renderer = build.Renderer(project, jobs=2)
+        renderer.CHUNK_SIZE = 1
+        consumed = []
+        def todo():
+            for filename in project.assertions.filenames():
+                consumed.append(filename)
+                yield filename, True, False
+        try:
+            renderer.render('assertions', DirectoryWriter(self.dest),
+                            todo())
+        finally:
+            renderer.close()
+        self.assertEqual(len(consumed), 5)
+        self.assertEqual(len(os.listdir(self.dest_path('assertions'))), 4)
+
+    def testChunksWork(self):
+        self.assertEqual(list(build.chunks(range(5), 2)),
+                         [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(build.chunks([], 2)), [])
+
+    def testWorkerOutputsCanBeCollected(self):
+        build.init_worker(self.root, 'http://worker/')
+        try:
+            filename = build._worker['project'].path('assertions',
+                                                     'foo.img.yml')
+            elapsed, counts, collector = build.render_in_worker((
+                'assertions', None, [(filename, True, True)]
+            ))
+        finally:
+            build._worker.clear()
+        self.assertFalse('files_written' in counts)
+        self.assertEqual([(method, path) for method, data, path
+                          in collector.outputs], [
+            ('write', ('assertions', 'foo', 'img.json')),
+            ('write', ('assertions', 'foo', 'img.html'))
+        ])
+
+    def testWorkerErrorsPropagate(self):
+        f = open(os.path.join(self.root, 'assertions', 'foo.img.yml'), 'w')
+        f.write('name: [unclosed')
+        f.close()
+        self.assertRaises(Exception, self.build, jobs=2)
+
+    def testWorkerRendersInProcess(self):
+        cache_filename = os.path.join(self.dir, 'parse.sqlite')
+        build.init_worker(self.root, 'http://worker/', cache_filename)
+        try:
+            proj = build._worker['project']
+            filename = proj.path('assertions', 'foo.img.yml')
+            elapsed, counts, collector = build.render_in_worker((
+                'assertions', DirectoryWriter(self.dest),
+                [(filename, True, False)]
+            ))
+            proj.cache.close()
+        finally:
+            build._worker.clear()
+        self.assertEqual(counts['files_written'], 1)
+        self.assertEqual(collector, None)
+        self.assertTrue(os.path.getsize(cache_filename) > 0)
+        self.assertTrue('http://worker/' in open(
+            self.dest_path('assertions', 'foo', 'img.json')
+        ).read())
+        self.assertFalse(os.path.exists(
+            self.dest_path('assertions', 'foo', 'img.html')
+        ))
+
+class StreamingBuildTests(unittest.TestCase):
+    # A full build shouldn't hold on to anything per assertion except its
+    # filename in the assertion index, so its peak memory use should grow
+    # by well under 1 KB per assertion. Holding on to every parsed
+    # assertion costs several times that.
+    MAX_GROWTH_PER_ASSERTION_KB = 1.0
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def peak_rss_growth(self, assertions):
+        root_dir = os.path.join(self.dir, str(assertions))
+        bench.generate_project(root_dir, recipients=assertions / 10,
+                               badges=10, assertions=assertions)
+        return bench.peak_rss_growth(bench.full_build, root_dir,
+                                     os.path.join(root_dir, 'dist'))
+
+    def testMemoryUseIsBounded(self):
+        small = self.peak_rss_growth(100)
+        large = self.peak_rss_growth(1500)
+        self.assertTrue(large - small <
+                        1400 * self.MAX_GROWTH_PER_ASSERTION_KB,
+                        'peak RSS grew by %d KB' % (large - small))
+
+class TemplateTests(BaseBuildTest):
+    def project(self):
+        project = Project(self.root)
+        project.open_cache()
+        return project
+
+    def cache_dir(self):
+        return os.path.join(self.root, Project.CACHE_DIR, 'templates')
+
+    def testEnvironmentIsShared(self):
+        env = build.make_jinja_env(self.project())
+        self.assertTrue(build.make_jinja_env(self.project()) is env)
+        self.assertFalse(build.make_jinja_env(Project(self.root)) is env)
+
+    def write_template(self, name, content):
+        project = Project(self.root)
+        build.make_dirs(project.TEMPLATES_DIR)
+        f = open(os.path.join(project.TEMPLATES_DIR, name), 'w')
+        f.write(content)
+        f.close()
+
+    def testChangedTemplatesAreReloaded(self):
+        env = build.make_jinja_env(self.project())
+        self.write_template('a.html', 'old')
+        self.assertEqual(env.get_template('a.html').render(), 'old')
+        self.write_template('a.html', 'new')
+        self.touch('templates', 'a.html')
+        self.assertEqual(env.get_template('a.html').render(), 'new')
+
+    def testOverridingTemplatesAreNoticed(self):
+        env = build.make_jinja_env(self.project())
+        self.assertNotEqual(env.get_template('badge.html').render(badge={}),
+                            'custom')
+        self.write_template('badge.html', 'custom')
+        self.assertEqual(env.get_template('badge.html').render(), 'custom')
+
+    def testTemplatesAreCompiledIntoCache(self):
+        project = self.project()
+        names = build.compile_templates(project)
+        self.assertTrue('assertion.html' in names)
+        filenames = os.listdir(self.cache_dir())
+        self.assertEqual(len(filenames), len(names))
+        self.assertFalse([f for f in filenames if f.endswith('.tmp')])
+
+    def testCompiledTemplatesAreReused(self):
+        build.compile_templates(self.project())
+        del build._jinja_envs[(self.project().TEMPLATES_DIR,
+                               self.cache_dir())]
+        mock('jinja2.Environment.compile', raises=AssertionError)
+        try:
+            build.compile_templates(self.project())
+        finally:
+            restore()
+
+class PhaseTimerTests(BaseBuildTest):
+    def testPhasesAreRecorded(self):
+        timer = PhaseTimer()
+        self.build(timer=timer)
+        self.assertEqual([phase['name'] for phase in timer.phases],
+                         ['static', 'issuer', 'badges', 'badges.plan',
+                          'badges.render', 'assertions', 'publish'])
+        for phase in timer.phases:
+            self.assertTrue(phase['wall'] >= 0)
+            self.assertTrue(phase['work'] >= 0)
+        self.assertEqual(timer.report(), {'phases': timer.phases})
+
+    def testCountsAreRecorded(self):
+        timer = PhaseTimer()
+        self.build(timer=timer)
+        phases = dict((phase['name'], phase) for phase in timer.phases)
+        self.assertEqual(phases['assertions']['counts']['files_written'], 10)
+        self.assertEqual(phases['assertions']['counts']['yaml_parses'], 5)
+        self.assertEqual(phases['badges']['counts']['files_copied'], 1)
+        self.assertEqual(phases['badges']['counts']['markdown_renders'], 2)
+        self.assertFalse('yaml_parses' in phases['badges.render']['counts'])
+
+    def testCountsFromWorkersAreRecorded(self):
+        timer = PhaseTimer()
+        self.build(timer=timer, jobs=2)
+        phases = dict((phase['name'], phase) for phase in timer.phases)
+        self.assertEqual(phases['assertions']['counts']['files_written'], 10)
+
+    def testTotalsWork(self):
+        timer = PhaseTimer()
+        with timer.phase('a'):
+            stats.count('foo')
+            with timer.phase('a.b'):
+                stats.count('foo')
+        with timer.phase('c'):
+            stats.count('foo')
+        self.assertEqual(timer.totals(), {'foo': 3})
+
+    def testDescribeWorks(self):
+        timer = PhaseTimer()
+        self.assertEqual(timer.describe({
+            'name': 'foo', 'wall': 1.0, 'work': 1.0, 'counts': {}
+        }), 'foo: 1.000s wall')
+        self.assertEqual(timer.describe({
+            'name': 'foo', 'wall': 1.0, 'work': 3.0,
+            'counts': {'b': 2, 'a': 1}
+        }), 'foo: 1.000s wall, 3.000s work (3.0x speedup) (a=1, b=2)')
+
+    def testSpeedupWorks(self):
+        timer = PhaseTimer()
+        self.assertEqual(timer.speedup({'wall': 2.0, 'work': 6.0}), 3.0)
+        self.assertEqual(timer.speedup({'wall': 0, 'work': 0}), 1.0)
+
+class OutputTests(BaseBuildTest):
+    def testUnchangedFilesAreKeptAcrossFullBuilds(self):
+        self.build()
+        inode = os.stat(self.dest_path('issuer.json')).st_ino
+        timer = PhaseTimer()
+        self.build(timer=timer)
+        self.assertEqual(os.stat(self.dest_path('issuer.json')).st_ino,
+                         inode)
+        self.assertEqual(timer.phases[-1]['counts'], {})
+        counts = dict((phase['name'], phase['counts'])
+                      for phase in timer.phases)
+        self.assertEqual(counts['assertions'].get('files_written', 0), 0)
+        self.assertEqual(counts['assertions']['files_unchanged'], 10)
+
+    def testAssetsCanBeHardLinked(self):
+        self.build(link_mode='hardlink')
+        self.assertEqual(
+            os.stat(os.path.join(self.root, 'badges', 'img.png')).st_ino,
+            os.stat(self.dest_path('badges', 'img.png')).st_ino
+        )
+
+    def testCompactJsonIsWritten(self):
+        self.build(compact=True)
+        self.assertFalse('\n' in open(self.dest_path('issuer.json')).read())
+
+    def testCompactnessChangeRebuildsEverything(self):
+        self.build(incremental=True)
+        manifest = self.build(incremental=True, compact=True)
+        self.assertEqual(manifest.rebuilt, len(manifest.outputs))
+
+    def testPrecompressedVariantsAreWritten(self):
+        self.build(precompress=True, jobs=2)
+        for path in (('issuer.json',), ('assertions', 'foo', 'img.html')):
+            self.assertEqual(
+                gzip.GzipFile(self.dest_path(*path) + '.gz').read(),
+                open(self.dest_path(*path)).read()
+            )
+        self.assertFalse(os.path.exists(self.dest_path('badges',
+                                                       'img.png.gz')))
+
+    def testPrecompressionChangeRebuildsEverything(self):
+        self.build(incremental=True)
+        manifest = self.build(incremental=True, precompress=True)
+        self.assertEqual(manifest.rebuilt, len(manifest.outputs))
+        self.assertTrue(os.path.exists(self.dest_path('issuer.json.gz')))
+
+    def testArchivesAreWritten(self):
+        for jobs in (1, 2):
+            self.dest = os.path.join(self.dir, 'site%d.zip' % jobs)
+            self.build(jobs=jobs)
+            names = zipfile.ZipFile(self.dest).namelist()
+            self.assertEqual(len(names), 16)
+            self.assertTrue('assertions/foo/img.html' in names)
+
+    def testFailedArchiveBuildLeavesNothingBehind(self):
+        self.dest = os.path.join(self.dir, 'site.tar.gz')
+        f = open(os.path.join(self.root, 'assertions', 'foo.img.yml'), 'w')
+        f.write('name: [unclosed')
+        f.close()
+        self.assertRaises(Exception, self.build)
+        self.assertEqual(os.listdir(self.dir), ['proj'])
+
+    def testArchivesCannotBeBuiltIncrementally(self):
+        self.dest = os.path.join(self.dir, 'site.tar')
+        self.assertRaises(ValueError, self.build, incremental=True)
+
+class AtomicBuildTests(BaseBuildTest):
+    def leftovers(self):
+        return sorted(name for name in os.listdir(self.dir)
+                      if name not in ('proj', 'dist'))
+
+    def testRebuildReplacesOldBuild(self):
+        self.build()
+        open(self.dest_path('stray.txt'), 'w').close()
+        self.build()
+        self.assertFalse(os.path.exists(self.dest_path('stray.txt')))
+        self.assertTrue(os.path.exists(self.dest_path('issuer.json')))
+        self.assertEqual(self.leftovers(), [])
+
+    def testBuildIsReadableByOthers(self):
+        self.build()
+        self.assertTrue(os.stat(self.dest).st_mode & 0005)
+
+    def testFailedBuildLeavesOldBuildAlone(self):
+        self.build()
+        f = open(os.path.join(self.root, 'assertions', 'foo.img.yml'), 'w')
+        f.write('name: [unclosed')
+        f.close()
+        self.assertRaises(Exception, self.build)
+        self.assertTrue(os.path.exists(self.dest_path('issuer.json')))
+        self.assertEqual(self.leftovers(), [])
+
+    def testSymlinkIsFlipped(self):
+        os.symlink('.dist-first', self.dest)
+        os.mkdir(os.path.join(self.dir, '.dist-first'))
+        self.build()
+        target = os.readlink(self.dest)
+        self.assertTrue(target.startswith('.dist-'))
+        self.assertTrue(os.path.exists(self.dest_path('issuer.json')))
+        self.build()
+        self.assertNotEqual(os.readlink(self.dest), target)
+        self.assertEqual(self.leftovers(), [os.readlink(self.dest)])
+
+    def testSymlinkToForeignDirIsNotRemoved(self):
+        os.mkdir(os.path.join(self.dir, 'www'))
+        os.symlink('www', self.dest)
+        self.build()
+        self.assertTrue(os.path.exists(os.path.join(self.dir, 'www')))
+        self.assertTrue(os.path.exists(self.dest_path('issuer.json')))
+
+    def testRenameFallbackWorks(self):
+        self.build()
+        original = build.exchange_paths
+        def unsupported(a, b):
+            raise OSError(38, 'Function not implemented')
+        build.exchange_paths = unsupported
+        try:
+            self.build()
+        finally:
+            build.exchange_paths = original
+        self.assertTrue(os.path.exists(self.dest_path('issuer.json')))
+        self.assertEqual(self.leftovers(), [])
+
+    def testExchangePathsRaisesWithoutRenameat2(self):
+        self.assertRaises(AttributeError, exchange_paths, 'a', 'b',
+                          libc=object())
+
+class IncrementalBuildTests(BaseBuildTest):
+    def testFullBuildDoesNotWriteManifest(self):
+        self.build()
+        self.assertFalse(os.path.exists(self.dest_path(Manifest.FILENAME)))
+
+    def testFullBuildRemovesStrayFiles(self):
+        self.build(incremental=True)
+        open(self.dest_path('stray.txt'), 'w').close()
+        self.build()
+        self.assertFalse(os.path.exists(self.dest_path('stray.txt')))
+
+    def testFirstIncrementalBuildBuildsEverything(self):
+        manifest = self.build(incremental=True)
+        self.assertEqual(manifest.rebuilt, len(manifest.outputs))
+        self.assertTrue(os.path.exists(self.dest_path(Manifest.FILENAME)))
+        self.assertTrue('assertions/foo/img.json' in manifest.outputs)
+
+    def testUnchangedProjectRebuildsNothing(self):
+        self.build(incremental=True)
+        manifest = self.build(incremental=True)
+        self.assertEqual(manifest.rebuilt, 0)
+        self.assertEqual(manifest.removed, [])
+
+    def testChangedAssertionRebuildsItsOutputs(self):
+        self.build(incremental=True)
+        self.touch('assertions', 'foo.img.yml')
+        manifest = self.build(incremental=True)
+        self.assertEqual(manifest.rebuilt, 2)
+
+    def testChangedBadgeRebuildsItsAssertions(self):
+        self.build(incremental=True)
+        self.touch('badges', 'img.yml')
+        manifest = self.build(incremental=True)
+        self.assertEqual(manifest.rebuilt, 4)
+
+    def testChangedConfigRebuildsEverything(self):
+        first = self.build(incremental=True)
+        self.touch('config.yml')
+        manifest = self.build(incremental=True)
+        self.assertEqual(manifest.rebuilt, len(first.outputs) - 1)
+
+    def testChangedRecipientStoreRebuildsAssertions(self):
+        use_recipients_file(self.root)
+        self.build(incremental=True)
+        use_recipients_file(self.root, 'foo@example.org')
+        manifest = self.build(incremental=True)
+        self.assertEqual(manifest.rebuilt, 10)
+        identity = json.load(open(self.dest_path(
+            'assertions', 'foo', 'img.json'
+        )))['recipient']['identity']
+        self.assertEqual(identity,
+                         hash_identity(('foo@example.org', 'foo.img')))
+
+    def testFailedBuildIsRedoneNextTime(self):
+        self.build(incremental=True)
+        open(os.path.join(self.root, 'badges', 'img.yml'), 'w').write(
+            'name: Renamed\n---\ncriteria'
+        )
+        assertion = os.path.join(self.root, 'assertions', 'foo.no-img.yml')
+        content = open(assertion).read()
+        open(assertion, 'w').write('name: [unclosed')
+        self.assertRaises(Exception, self.build, incremental=True)
+        self.assertTrue('Renamed' in open(self.dest_path('badges',
+                                                         'img.json')).read())
+        open(assertion, 'w').write(content)
+        manifest = self.build(incremental=True)
+        self.assertEqual(manifest.rebuilt, 6)
+
+    def testChangedBaseUrlRebuildsEverything(self):
+        self.build(incremental=True)
+        proj = Project(self.root)
+        proj.set_base_url('http://other/')
+        manifest = build_website(proj, self.dest, incremental=True)
+        self.assertEqual(manifest.rebuilt, len(manifest.outputs))
+        self.assertTrue('http://other/' in
+                        open(self.dest_path('issuer.json')).read())
+
+    def testChangedTemplateRebuildsHtml(self):
+        os.mkdir(os.path.join(self.root, 'templates'))
+        self.build(incremental=True)
+        f = open(os.path.join(self.root, 'templates', 'badge.html'), 'w')
+        f.write('custom {{ badge.name }}')
+        f.close()
+        manifest = self.build(incremental=True)
+        self.assertEqual(manifest.rebuilt, 7)
+        self.assertEqual(open(self.dest_path('badges', 'img.html')).read(),
+                         'custom Image')
+
+    def testDeletedOutputIsRebuilt(self):
+        self.build(incremental=True)
+        os.remove(self.dest_path('badges', 'img.png'))
+        manifest = self.build(incremental=True)
+        self.assertEqual(manifest.rebuilt, 1)
+        self.assertTrue(os.path.exists(self.dest_path('badges', 'img.png')))
+
+    def testRemovedSourcesRemoveOutputs(self):
+        self.build(incremental=True)
+        os.remove(os.path.join(self.root, 'assertions', 'foo.img.yml'))
+        os.remove(os.path.join(self.root, 'badges', 'img.png'))
+        manifest = self.build(incremental=True)
+        self.assertEqual(manifest.removed, [
+            'assertions/foo/img.html',
+            'assertions/foo/img.json',
+            'badges/img.png'
+        ])
+        self.assertFalse(os.path.exists(self.dest_path('badges', 'img.png')))
+        self.assertFalse(os.path.exists(self.dest_path('assertions', 'foo',
+                                                       'img.json')))
+        self.assertTrue(os.path.exists(self.dest_path('assertions', 'foo')))
+
+    def testRemovedOutputsLoseTheirVariants(self):
+        self.build(incremental=True, precompress=True)
+        os.remove(os.path.join(self.root, 'assertions', 'bar.no-img.yml'))
+        self.build(incremental=True, precompress=True)
+        self.assertFalse(os.path.exists(self.dest_path('assertions', 'bar')))
+
+    def testEmptyDirectoriesAreRemoved(self):
+        self.build(incremental=True)
+        os.remove(os.path.join(self.root, 'assertions', 'bar.no-img.yml'))
+        self.build(incremental=True)
+        self.assertFalse(os.path.exists(self.dest_path('assertions', 'bar')))
+
+    def testStaticFilesAreCopied(self):
+        os.makedirs(os.path.join(self.root, 'static', 'css'))
+        f = open(os.path.join(self.root, 'static', 'css', 'a.css'), 'w')
+        f.write('body {}')
+        f.close()
+        self.build(incremental=True)
+        self.assertEqual(open(self.dest_path('css', 'a.css')).read(),
+                         'body {}')
+        manifest = self.build(incremental=True)
+        self.assertEqual(manifest.rebuilt, 0)
+
+    def testOldManifestVersionIsIgnored(self):
+        self.build(incremental=True)
+        f = open(self.dest_path(Manifest.FILENAME), 'w')
+        f.write('{"version": 0}')
+        f.close()
+        manifest = self.build(incremental=True)
+        self.assertEqual(manifest.rebuilt, len(manifest.outputs))
+
+class UpdateWebsiteTests(BaseBuildTest):
+    def setUp(self):
+        BaseBuildTest.setUp(self)
+        self.project = Project(self.root)
+        build_website(self.project, self.dest)
+
+    def source(self, *path):
+        return os.path.join(self.root, *path)
+
+    def affected(self, *paths):
+        return find_affected_outputs(self.project,
+                                     [self.source(*path) for path in paths])
+
+    def update(self, *paths):
+        update_website(self.project, self.dest, self.affected(*paths))
+
+    def write(self, content, *path):
+        f = open(self.source(*path), 'w')
+        f.write(content)
+        f.close()
+
+    def testConfigAndTemplatesAffectEverything(self):
+        self.assertEqual(self.affected(['config.yml']), None)
+        self.assertEqual(self.affected(['templates']), None)
+        self.assertEqual(self.affected(['templates', 'badge.html']), None)
+        self.assertEqual(self.affected(['badges']), None)
+
+    def testRecipientStoreAffectsEverything(self):
+        use_recipients_file(self.root)
+        self.project = Project(self.root)
+        self.assertEqual(self.affected(['people.csv']), None)
+
+    def testUnrelatedFilesAffectNothing(self):
+        self.assertEqual(self.affected(['README'], ['badges', 'notes.txt'],
+                                       ['assertions', 'notes.txt']), {
+            'badges': set(), 'assertions': set(), 'static': set()
+        })
+
+    def testBadgeAffectsItsAssertions(self):
+        self.assertEqual(self.affected(['badges', 'img.png']), {
+            'badges': set(['img']),
+            'assertions': set([self.source('assertions', 'foo.img.yml')]),
+            'static': set()
+        })
+
+    def testChangedAssertionIsRegenerated(self):
+        self.write('new evidence', 'assertions', 'foo.img.yml')
+        self.update(['assertions', 'foo.img.yml'])
+        self.assertTrue('new evidence' in open(
+            self.dest_path('assertions', 'foo', 'img.html')
+        ).read())
+
+    def testDeletedAssertionIsRemoved(self):
+        os.remove(self.source('assertions', 'bar.no-img.yml'))
+        self.update(['assertions', 'bar.no-img.yml'])
+        self.assertFalse(os.path.exists(self.dest_path('assertions', 'bar')))
+
+    def testChangedBadgeRegeneratesItsAssertions(self):
+        self.project.assertions['foo.img']
+        self.write('name: Renamed\n---\ncriteria', 'badges', 'img.yml')
+        self.update(['badges', 'img.yml'])
+        self.assertTrue('Renamed' in open(
+            self.dest_path('assertions', 'foo', 'img.html')
+        ).read())
+
+    def testDeletedBadgeImageIsRemoved(self):
+        os.remove(self.source('badges', 'img.png'))
+        self.update(['badges', 'img.png'])
+        self.assertFalse(os.path.exists(self.dest_path('badges', 'img.png')))
+        self.assertTrue('"image"' not in open(
+            self.dest_path('badges', 'img.json')
+        ).read())
+
+    def testDeletedBadgeIsRemoved(self):
+        os.remove(self.source('badges', 'no-img.yml'))
+        for filename in os.listdir(self.source('assertions')):
+            if 'no-img' in filename:
+                os.remove(self.source('assertions', filename))
+        self.update(['badges', 'no-img.yml'])
+        self.assertFalse(os.path.exists(self.dest_path('badges',
+                                                       'no-img.json')))
+
+    def testVariantsAreUpdated(self):
+        build_website(self.project, self.dest, precompress=True)
+        self.write('new evidence', 'assertions', 'foo.img.yml')
+        update_website(self.project, self.dest,
+                       self.affected(['assertions', 'foo.img.yml']),
+                       precompress=True)
+        self.assertTrue('new evidence' in gzip.GzipFile(
+            self.dest_path('assertions', 'foo', 'img.html.gz')
+        ).read())
+
+    def testStaticFilesAreCopiedAndRemoved(self):
+        os.mkdir(self.source('static'))
+        self.write('hi', 'static', 'a.txt')
+        self.update(['static', 'a.txt'])
+        self.assertEqual(open(self.dest_path('a.txt')).read(), 'hi')
+        os.remove(self.source('static', 'a.txt'))
+        self.update(['static', 'a.txt'])
+        self.assertFalse(os.path.exists(self.dest_path('a.txt')))
+
+    def testStaticDirectoriesAreCopiedAndRemoved(self):
+        os.makedirs(self.source('static', 'css', 'print'))
+        self.write('a', 'static', 'css', 'a.css')
+        self.write('b', 'static', 'css', 'print', 'b.css')
+        self.update(['static', 'css'])
+        self.assertEqual(open(self.dest_path('css', 'a.css')).read(), 'a')
+        self.assertEqual(open(self.dest_path('css', 'print',
+                                             'b.css')).read(), 'b')
+        shutil.rmtree(self.source('static', 'css'))
+        self.update(['static', 'css'])
+        self.assertFalse(os.path.exists(self.dest_path('css')))
@@ -0,0 +1,99 @@
+import os
+import tempfile
+import shutil
+import unittest
+
+from badgepad.cache import ParseCache
+
+class ParseCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'cache', 'parse.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testMissingEntriesReturnNone(self):
+        cache = ParseCache(self.filename)
+        self.assertEqual(cache.get('yaml', 'a: 1'), None)
+        cache.close()
+
+    def testPendingEntriesAreReturned(self):
+        cache = ParseCache(self.filename)
+        cache.set('yaml', 'a: 1', [{'a': 1}])
+        self.assertEqual(cache.get('yaml', 'a: 1'), [{'a': 1}])
+        self.assertEqual(cache.get('markdown', 'a: 1'), None)
+        cache.close()
+
+    def testEntriesArePersisted(self):
+        cache = ParseCache(self.filename)
+        cache.set('markdown', u'caf\xe9', u'<p>caf\xe9</p>')
+        cache.close()
+        cache = ParseCache(self.filename)
+        self.assertEqual(cache.get('markdown', u'caf\xe9'),
+                         u'<p>caf\xe9</p>')
+        cache.close()
+
+    def testEntriesAreCopies(self):
+        cache = ParseCache(self.filename)
+        cache.set('yaml', 'a: 1', [{'a': 1}])
+        cache.get('yaml', 'a: 1')[0]['b'] = 2
+        self.assertEqual(cache.get('yaml', 'a: 1'), [{'a': 1}])
+        cache.close()
+
+    def testLeastRecentlyUsedEntriesAreEvicted(self):
+        cache = ParseCache(self.filename)
+        cache.set('yaml', 'old', 'x' * 100)
+        cache.set('yaml', 'used', 'x' * 100)
+        cache.flush()
+        entry_size = cache.size / 2
+        cache.max_size = entry_size * 2
+        cache.get('yaml', 'used')
+        cache.set('yaml', 'new', 'x' * 100)
+        cache.flush()
+        self.assertEqual(cache.size, entry_size * 2)
+        self.assertEqual(cache.get('yaml', 'old'), None)
+        self.assertEqual(cache.get('yaml', 'used'), 'x' * 100)
+        self.assertEqual(cache.get('yaml', 'new'), 'x' * 100)
+        cache.close()
+
+    def testEntriesFromOldVersionsAreIgnored(self):
+        cache = ParseCache(self.filename)
+        cache.VERSION = 1
+        cache.set('yaml', 'a: 1', 'unsafe')
+        cache.close()
+        cache = ParseCache(self.filename)
+        self.assertEqual(cache.get('yaml', 'a: 1'), None)
+        cache.close()
+
+    def testWritesAreFlushedWhenTheyPileUp(self):
+        cache = ParseCache(self.filename)
+        cache.MAX_PENDING = 2
+        cache.set('yaml', 'a', 1)
+        self.assertEqual(cache.size, 0)
+        cache.set('yaml', 'b', 2)
+        self.assertEqual(cache.pending, {})
+        self.assertTrue(cache.size > 0)
+        cache.close()
+
+    def testIdentitiesArePersisted(self):
+        cache = ParseCache(self.filename)
+        cache.add_identities({('a@b.org', 'a.b'): 'sha256$1',
+                              ('a@b.org', 'a.c'): 'sha256$2'})
+        self.assertEqual(cache.identities(['a.b']),
+                         {('a@b.org', 'a.b'): 'sha256$1'})
+        cache.close()
+        cache = ParseCache(self.filename)
+        self.assertEqual(cache.identities(['a.b', 'a.d']),
+                         {('a@b.org', 'a.b'): 'sha256$1'})
+        cache.MAX_VARIABLES = 1
+        self.assertEqual(len(cache.identities(['a.b', 'a.c', 'a.d'])), 2)
+        cache.close()
+
+    def testIdentitiesAreFlushedWhenTheyPileUp(self):
+        cache = ParseCache(self.filename)
+        cache.MAX_PENDING = 2
+        cache.add_identities({('a', '1'): 'x', ('a', '2'): 'y'})
+        self.assertEqual(cache.new_identities, {})
+        self.assertEqual(cache.identities(['2']), {('a', '2'): 'y'})
+        cache.close()
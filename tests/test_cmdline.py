@@ -1,13 +1,22 @@
 import os
+import sys
+import json
+import pstats
 import unittest
 import tempfile
 import doctest
 import shutil
+import threading
+from cStringIO import StringIO
 from minimock import mock, Mock, restore
 
 import badgepad.cmdline
+import badgepad.server
+from badgepad import bench
+from badgepad.project import Project
 
 from .test_project import SAMPLE_PROJECT
+from .test_publish import FakeS3Server
 
 def load_tests(loader, tests, ignore):
     tests.addTests(doctest.DocTestSuite())
@@ -15,19 +24,28 @@ def load_tests(loader, tests, ignore):
 
 def test_cmd_serve():
     """
-    >>> mock('badgepad.cmdline.start_auto_rebuild_server')
+    >>> mock('badgepad.server.start_auto_rebuild_server')
     >>> os.chdir(SAMPLE_PROJECT)
     >>> badgepad.cmdline.main(['serve'])                # doctest: +ELLIPSIS
-    Called badgepad.cmdline.start_auto_rebuild_server(
+    Called badgepad.server.start_auto_rebuild_server(
         '...sample-project',
         ip='127.0.0.1',
-        port=8000)
+        port=8000,
+        precompress=False)
     >>> badgepad.cmdline.main(['serve', '-p', '1234', '-i',
-    ...                        '1.2.3.4'])              # doctest: +ELLIPSIS
-    Called badgepad.cmdline.start_auto_rebuild_server(
+    ...                        '1.2.3.4', '--precompress'])
+    ...                                                 # doctest: +ELLIPSIS
+    Called badgepad.server.start_auto_rebuild_server(
         '...sample-project',
         ip='1.2.3.4',
-        port=1234)
+        port=1234,
+        precompress=True)
+    >>> mock('badgepad.server.start_live_server')
+    >>> badgepad.cmdline.main(['serve', '--live'])     # doctest: +ELLIPSIS
+    Called badgepad.server.start_live_server(
+        '...sample-project',
+        ip='127.0.0.1',
+        port=8000)
     >>> restore()
     """
 
@@ -82,10 +100,276 @@ class BaseCmdlineTest(unittest.TestCase):
 class SampleProjectTest(BaseCmdlineTest):
     def test(self):
         badgepad.cmdline.main(['--root-dir', SAMPLE_PROJECT, 'build',
-                               '--output-dir', self.path('out')])
+                               '--no-cache', '--output-dir', self.path('out')])
         self.assertPathExists('out', 'issuer.json')
         self.assertPathExists('out', 'badges', 'img.json')
 
+    def testPrecompress(self):
+        badgepad.cmdline.main(['--root-dir', SAMPLE_PROJECT, 'build',
+                               '--no-cache', '--output-dir', self.path('out'),
+                               '--precompress'])
+        self.assertPathExists('out', 'issuer.json.gz')
+        self.assertPathExists('out', 'badges', 'img.html.gz')
+
+    def testJobs(self):
+        badgepad.cmdline.main(['--root-dir', SAMPLE_PROJECT, 'build',
+                               '--no-cache', '--output-dir', self.path('out'),
+                               '-j', '2'])
+        self.assertPathExists('out', 'assertions', 'foo', 'img.json')
+        self.assertTrue(self.loglines[5].startswith('assertions: '))
+
+    def testTimings(self):
+        badgepad.cmdline.main(['--root-dir', SAMPLE_PROJECT, 'build',
+                               '--no-cache', '--output-dir', self.path('out'),
+                               '--timings',
+                               '--timings-json', self.path('t.json')])
+        self.assertTrue(self.loglines[0].startswith('static: '))
+        self.assertTrue(self.loglines[-2].startswith('Assets: '))
+        report = json.load(open(self.path('t.json')))
+        self.assertEqual(report['phases'][0]['name'], 'static')
+
+    def testProfile(self):
+        badgepad.cmdline.main(['--root-dir', SAMPLE_PROJECT, 'build',
+                               '--no-cache', '--output-dir', self.path('out'),
+                               '--profile', self.path('build.prof')])
+        self.assertTrue(self.loglines[0].startswith('Profile written to '))
+        stats = pstats.Stats(self.path('build.prof'))
+        self.assertTrue(stats.total_calls > 0)
+
+    def testArchive(self):
+        badgepad.cmdline.main(['--root-dir', SAMPLE_PROJECT, 'build',
+                               '--no-cache', '--compact-json',
+                               '--output-dir', self.path('site.tar.gz')])
+        self.assertTrue(self.loglines[-1].startswith(
+            "Done. Static website is in archive '"
+        ))
+        self.assertPathExists('site.tar.gz')
+        self.assertRaises(SystemExit, badgepad.cmdline.main, [
+            '--root-dir', SAMPLE_PROJECT, 'build', '--incremental',
+            '--output-dir', self.path('site.zip')
+        ])
+        self.assertEqual(self.loglines[-1],
+                         "Archives can't be built incrementally.")
+
+    def testIncremental(self):
+        args = ['--root-dir', SAMPLE_PROJECT, 'build', '--no-cache',
+                '--output-dir', self.path('out'), '--incremental']
+        badgepad.cmdline.main(args)
+        badgepad.cmdline.main(args)
+        self.assertEqual(self.loglines[-2], 'Rebuilt 0 of 16 files, '
+                                            'removed 0.')
+
+class IssueBulkTest(BaseCmdlineTest):
+    def setUp(self):
+        BaseCmdlineTest.setUp(self)
+        shutil.copytree(SAMPLE_PROJECT, self.path('proj'))
+
+    def issue(self, badge, csv):
+        f = open(self.path('r.csv'), 'w')
+        f.write(csv)
+        f.close()
+        badgepad.cmdline.main(['--root-dir', self.path('proj'), 'issue-bulk',
+                               badge, '--from', self.path('r.csv')])
+
+    def assertErr(self, badge, csv, msg):
+        self.assertRaises(SystemExit, self.issue, badge, csv)
+        self.assertEqual(self.loglines[-1], msg)
+
+    def test(self):
+        self.issue('img', 'slug,name,email\n'
+                          'foo,,\n'
+                          'bar,,\n'
+                          'new,Caf\xc3\xa9 Person,cafe@person.com\n')
+        self.assertEqual(self.loglines[0],
+                         'Added 1 new recipients.')
+        self.assertTrue(self.loglines[1].startswith('Issued 2 badges in '))
+        self.assertTrue(self.loglines[1].endswith(', 1 were already issued.'))
+        self.assertPathExists('proj', 'assertions', 'bar.img.yml')
+        self.assertPathExists('proj', 'assertions', 'new.img.yml')
+        recipient = Project(self.path('proj')).recipients['new']
+        self.assertEqual(recipient.name, u'Caf\xe9 Person')
+        self.assertEqual(recipient.email, 'cafe@person.com')
+
+    def testStdinIsRead(self):
+        mock('sys.stdin', mock_obj=StringIO('slug\nbaz\n'))
+        badgepad.cmdline.main(['--root-dir', self.path('proj'), 'issue-bulk',
+                               'img'])
+        self.assertPathExists('proj', 'assertions', 'baz.img.yml')
+        restore()
+
+    def testNothingIsIssuedIfAnyRowIsInvalid(self):
+        self.assertErr('zzz', 'slug\nfoo\n', "Badge 'zzz' does not exist.")
+        self.assertErr('img', 'slug\nbar\nz.z\n',
+                       "Line 3: invalid recipient 'z.z'.")
+        self.assertErr('img', 'slug\nbar\nzzz\n',
+                       "Line 3: recipient 'zzz' does not exist and has no "
+                       "email.")
+        self.assertFalse(os.path.exists(self.path('proj', 'assertions',
+                                                  'bar.img.yml')))
+
+    def testUnaddableRecipientsFail(self):
+        filename = self.path('proj', 'config.yml')
+        config = open(filename).read()
+        open(filename, 'w').write(config[:config.index('recipients:')] +
+                                  'recipients: {foo: foo@bar.org}\n')
+        self.assertErr('img', 'slug,email\nnew,new@bar.org\n',
+                       "Can't add new recipients: config.yml has no "
+                       "recipients section to add to.")
+
+class VerifyTest(BaseCmdlineTest):
+    def setUp(self):
+        BaseCmdlineTest.setUp(self)
+        shutil.copytree(SAMPLE_PROJECT, self.path('proj'))
+
+    def cmdline(self, *args):
+        badgepad.cmdline.main(['--root-dir', self.path('proj')] +
+                              list(args))
+
+    def test(self):
+        self.assertRaises(SystemExit, self.cmdline, 'verify')
+        self.assertTrue(self.loglines[-1].startswith("There's no website "
+                                                     "in '"))
+        self.cmdline('build', '--no-cache')
+        self.cmdline('verify', '-j', '2')
+        self.assertTrue(self.loglines[-3].startswith('Verified 5 assertions '
+                                                     "in '"))
+        self.assertTrue(self.loglines[-2].startswith('Fetch latency: p50 '))
+        self.assertEqual(self.loglines[-1], 'Everything verifies.')
+        os.remove(self.path('proj', 'dist', 'badges', 'img.html'))
+        self.assertRaises(SystemExit, self.cmdline, 'verify')
+        self.assertEqual(self.loglines[-2:], [
+            'http://foo.org/badges/img.html: not found',
+            'Found 1 problems.'
+        ])
+
+    def testRunningServerIsVerified(self):
+        self.cmdline('build', '--no-cache')
+        httpd = badgepad.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), self.path('proj', 'dist')
+        )
+        thread = threading.Thread(target=httpd.serve_forever, args=(0.01,))
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:%d/' % httpd.server_port
+            self.cmdline('verify', '--base-url', url)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+            thread.join()
+        self.assertTrue(self.loglines[-3].startswith(
+            'Verified 5 assertions in %s with 12 fetches' % url
+        ))
+
+class ExportTest(BaseCmdlineTest):
+    def setUp(self):
+        BaseCmdlineTest.setUp(self)
+        shutil.copytree(SAMPLE_PROJECT, self.path('proj'))
+
+    def export(self, *args):
+        badgepad.cmdline.main(['--root-dir', self.path('proj'), 'export'] +
+                              list(args))
+
+    def testNdjsonIsWrittenToStdout(self):
+        old_stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.export('-u', 'http://example.org/')
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = old_stdout
+        records = [json.loads(line) for line in output.splitlines()]
+        self.assertEqual(len(records), 5)
+        self.assertEqual(records[0]['assertion']['verify']['url'],
+                         'http://example.org/assertions/bar/no-img.json')
+        self.assertEqual(self.loglines, [])
+
+    def testNdjsonIsWrittenToFile(self):
+        self.export('-o', self.path('out.ndjson'))
+        self.assertEqual(len(self.contents('out.ndjson').splitlines()), 5)
+        self.assertTrue(self.loglines[0].startswith(
+            "Exported 5 assertions to '"
+        ))
+
+    def testSqliteIsWritten(self):
+        self.export('--format', 'sqlite', '-o', self.path('out.sqlite'))
+        self.assertPathExists('out.sqlite')
+        self.assertRaises(SystemExit, self.export, '-f', 'sqlite')
+        self.assertEqual(self.loglines[-1], "Exporting to SQLite needs an "
+                                            "output file, given with -o.")
+
+class PublishTest(BaseCmdlineTest):
+    def setUp(self):
+        BaseCmdlineTest.setUp(self)
+        self.server = FakeS3Server()
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  args=(0.01,))
+        thread.daemon = True
+        thread.start()
+        self.old_environ = os.environ.copy()
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.old_environ)
+        self.server.shutdown()
+        self.server.server_close()
+        BaseCmdlineTest.tearDown(self)
+
+    def publish(self, *args):
+        badgepad.cmdline.main([
+            '--root-dir', SAMPLE_PROJECT, 'publish', 'site',
+            '--dist-dir', self.path('out'),
+            '--endpoint', 'http://127.0.0.1:%d' % self.server.server_port
+        ] + list(args))
+
+    def test(self):
+        os.environ['AWS_ACCESS_KEY_ID'] = 'key'
+        os.environ['AWS_SECRET_ACCESS_KEY'] = 'secret'
+        badgepad.cmdline.main(['--root-dir', SAMPLE_PROJECT, 'build',
+                               '--no-cache', '--output-dir', self.path('out')])
+        self.publish('--dry-run')
+        self.assertTrue(self.loglines[-1].startswith(
+            'Would upload 16 new and 0 changed files, deleted 0, 0 unchanged'
+        ))
+        self.publish()
+        self.assertTrue(self.loglines[-1].startswith('Uploaded 16 new '))
+        self.assertEqual(self.server.objects['/site/issuer.json'][1],
+                         'application/json')
+        os.remove(self.path('out', 'issuer.json'))
+        self.publish('-j', '1')
+        self.assertEqual(self.loglines[-2:], ['Changed paths:',
+                                              '/issuer.json'])
+
+    def testErrors(self):
+        self.assertRaises(SystemExit, self.publish)
+        self.assertTrue(self.loglines[-1].startswith(
+            "There's no website in "
+        ))
+        os.mkdir(self.path('out'))
+        os.environ.pop('AWS_ACCESS_KEY_ID', None)
+        self.assertRaises(SystemExit, self.publish)
+        self.assertEqual(self.loglines[-1], 'Set AWS_ACCESS_KEY_ID and '
+                                            'AWS_SECRET_ACCESS_KEY to '
+                                            'publish.')
+
+class StartupImportsTest(BaseCmdlineTest):
+    HEAVY = ['jinja2', 'markdown', 'yaml', 'SimpleHTTPServer',
+             'multiprocessing']
+
+    def imports(self, *argv):
+        return bench.profile_command(self.dir, list(argv))['imports']
+
+    def assertImportsNone(self, imports, modules):
+        self.assertEqual([m for m in modules if m in imports], [])
+
+    def test(self):
+        self.assertImportsNone(self.imports('init'), self.HEAVY)
+        self.assertImportsNone(self.imports('newbadge', 'foo'), self.HEAVY)
+        imports = self.imports('issue', 'pat', 'foo')
+        self.assertTrue('yaml' in imports)
+        self.assertImportsNone(imports, ['jinja2', 'markdown',
+                                         'SimpleHTTPServer'])
+        self.assertPathExists('assertions', 'pat.foo.yml')
+
 class ProjectFromScratchTest(BaseCmdlineTest):
     def cmdline(self, *args):
         badgepad.cmdline.main(['--root-dir', self.dir] + list(args))
@@ -131,5 +415,23 @@ class ProjectFromScratchTest(BaseCmdlineTest):
         self.assertPathExists('dist', 'badges', 'foo.json')
         self.assertPathExists('dist', 'issuer.json')
 
+        self.assertPathExists('.badgepad-cache', 'parse.sqlite')
+        self.assertTrue(os.listdir(self.path('.badgepad-cache', 'templates')))
+
+        self.cmdline('hash-identities', '-j', '2')
+        self.assertTrue(self.loglines[-1].startswith('Hashed '))
+        self.cmdline('hash-identities', '-b', 'foo')
+        self.assertTrue(self.loglines[-1].startswith('Hashed 0 identities '))
+        self.assertErr(['hash-identities', '-b', 'nope'],
+                       "Badge 'nope' does not exist.")
+
+        self.cmdline('compile-templates')
+        self.assertTrue(self.loglines[-1].startswith('Compiled '))
+        self.assertTrue(self.loglines[-1].endswith(
+            ' templates into .badgepad-cache.'
+        ))
+
         self.cmdline('build', '-u', 'http://b')
         self.assertTrue('http://b/' in self.contents('dist', 'issuer.json'))
+        self.assertTrue(u'o yea \u2026'.encode('utf-8') in
+                        self.contents('dist', 'assertions', 'lol', 'foo.html'))
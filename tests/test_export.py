@@ -0,0 +1,90 @@
+import os
+import json
+import sqlite3
+import tempfile
+import shutil
+import unittest
+from cStringIO import StringIO
+
+from badgepad.project import Project
+from badgepad.export import iter_assertion_records, export_ndjson, \
+                            export_sqlite
+
+from .test_project import SAMPLE_PROJECT
+
+class ExportTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.project = Project(SAMPLE_PROJECT)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self, *path):
+        return os.path.join(self.dir, *path)
+
+    def records(self):
+        return iter_assertion_records(self.project)
+
+    def testRecordsAreYielded(self):
+        records = list(self.records())
+        self.assertEqual([record['uid'] for record in records], [
+            'bar.no-img', 'baz.no-img', 'foo.img', 'foo.no-img',
+            'quux.no-img'
+        ])
+        record = records[2]
+        self.assertEqual(record['recipient'], 'foo')
+        self.assertEqual(record['badge'], 'img')
+        self.assertEqual(record['assertion'],
+                         self.project.assertions['foo.img'].json)
+        self.assertEqual(record['issued_on'],
+                         record['assertion']['issuedOn'])
+        self.assertEqual(records[0]['issued_on'], 'i am a custom timestamp')
+
+    def testNdjsonIsWritten(self):
+        f = StringIO()
+        self.assertEqual(export_ndjson(self.records(), f), 5)
+        lines = f.getvalue().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(json.loads(lines[2])['assertion']['uid'], 'foo.img')
+
+    def testSqliteIsWritten(self):
+        filename = self.path('assertions.sqlite')
+        self.assertEqual(export_sqlite(self.records(), filename), 5)
+        db = sqlite3.connect(filename)
+        rows = db.execute('SELECT uid, issued_on, json FROM assertions '
+                          'WHERE badge = ? ORDER BY uid',
+                          ('img',)).fetchall()
+        self.assertEqual([row[0] for row in rows], ['foo.img'])
+        self.assertEqual(rows[0][1], json.loads(rows[0][2])['issuedOn'])
+        self.assertEqual(json.loads(rows[0][2])['recipient'],
+                         self.project.assertions['foo.img'].json['recipient'])
+        plan = db.execute('EXPLAIN QUERY PLAN SELECT uid FROM assertions '
+                          'WHERE recipient = ?', ('foo',)).fetchall()
+        self.assertTrue('assertions_recipient' in str(plan))
+        indexes = [name for (name,) in db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' "
+            "AND tbl_name = 'assertions' ORDER BY name"
+        )]
+        self.assertTrue('assertions_badge' in indexes)
+        db.close()
+        self.assertEqual(os.listdir(self.dir), ['assertions.sqlite'])
+
+    def testSqliteExportIsReplaced(self):
+        filename = self.path('assertions.sqlite')
+        open(filename, 'w').write('old')
+        open(self.path('.assertions.sqlite.tmp'), 'w').write('stale')
+        export_sqlite(self.records(), filename)
+        db = sqlite3.connect(filename)
+        self.assertEqual(db.execute('SELECT COUNT(*) FROM assertions')
+                         .fetchone(), (5,))
+        db.close()
+        self.assertEqual(os.listdir(self.dir), ['assertions.sqlite'])
+
+    def testFailedSqliteExportLeavesNothingBehind(self):
+        def records():
+            yield iter(self.records()).next()
+            raise ValueError('hmph')
+        self.assertRaises(ValueError, export_sqlite, records(),
+                          self.path('assertions.sqlite'))
+        self.assertEqual(os.listdir(self.dir), [])
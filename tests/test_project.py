@@ -1,9 +1,15 @@
 import os
 import doctest
 import unittest
+import tempfile
+import shutil
+
+import yaml
 
 import badgepad.project
-from badgepad.project import Project, BadgeAssertion, pathify
+from badgepad import stats
+from badgepad.project import Project, BadgeAssertion, pathify, \
+                             hash_identity, hash_identities
 
 path = lambda *x: os.path.join(ROOT, *x)
 ROOT = os.path.dirname(os.path.abspath(__file__))
@@ -13,9 +19,56 @@ def load_tests(loader, tests, ignore):
     tests.addTests(doctest.DocTestSuite(badgepad.project))
     return tests
 
+def use_recipients_file(root_dir, foo_email='foo@bar.org'):
+    """
+    Moves the recipients of the sample project in root_dir into
+    people.csv, giving foo the given email address.
+    """
+
+    filename = os.path.join(root_dir, 'config.yml')
+    config = open(filename).read()
+    if 'recipients: people.csv' not in config:
+        f = open(filename, 'w')
+        f.write(config[:config.index('recipients:')] +
+                'recipients: people.csv\n')
+        f.close()
+    f = open(os.path.join(root_dir, 'people.csv'), 'w')
+    f.write('slug,name,email\nfoo,Foo,%s\n' % foo_email)
+    for slug in ['bar', 'baz', 'quux']:
+        f.write('%s,%s,%s@bar.org\n' % (slug, slug.title(), slug))
+    f.close()
+
 def getitem(obj, key):
     return obj[key]
 
+class YamlLoaderTests(unittest.TestCase):
+    def testLibyamlIsPreferred(self):
+        self.assertEqual(badgepad.project.find_yaml_loader(),
+                         getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+    def testPurePythonLoaderIsFallback(self):
+        CSafeLoader = getattr(yaml, 'CSafeLoader', None)
+        if CSafeLoader is not None:
+            del yaml.CSafeLoader
+        try:
+            self.assertEqual(badgepad.project.find_yaml_loader(),
+                             yaml.SafeLoader)
+        finally:
+            if CSafeLoader is not None:
+                yaml.CSafeLoader = CSafeLoader
+
+    def testUnsafeTagsAreRejected(self):
+        dirname = tempfile.mkdtemp()
+        try:
+            f = open(os.path.join(dirname, 'evil.yml'), 'w')
+            f.write('!!python/object/apply:os.getcwd []\n')
+            f.close()
+            proj = Project(dirname)
+            self.assertRaises(yaml.constructor.ConstructorError,
+                              list, proj.read_yaml('evil.yml'))
+        finally:
+            shutil.rmtree(dirname)
+
 class BadgeClassTests(unittest.TestCase):
     def testKeyErrorIsRaised(self):
         proj = Project(SAMPLE_PROJECT)
@@ -83,6 +136,24 @@ class FindBadgeAssertionTests(unittest.TestCase):
         results = [a for a in proj.assertions.find(badge='zzz')]
         self.assertEqual(len(results), 0)
 
+    def testFindIsSorted(self):
+        proj = Project(SAMPLE_PROJECT)
+        results = [a.basename for a in proj.assertions]
+        self.assertEqual(results, sorted(results))
+
+    def testCountWorks(self):
+        proj = Project(SAMPLE_PROJECT)
+        self.assertEqual(proj.assertions.count(), 5)
+        self.assertEqual(proj.assertions.count(recipient='foo'), 2)
+        self.assertEqual(proj.assertions.count(badge='no-img'), 4)
+        self.assertEqual(proj.assertions.count(recipient='foo',
+                                               badge='img'), 1)
+        self.assertEqual(proj.assertions.count(recipient='zzz'), 0)
+
+    def testCountWorksWithoutAssertionsDir(self):
+        proj = Project(os.path.join(SAMPLE_PROJECT, 'nonexistent'))
+        self.assertEqual(proj.assertions.count(), 0)
+
 class BadgeAssertionTests(unittest.TestCase):
     def testKeyErrorIsRaised(self):
         proj = Project(SAMPLE_PROJECT)
@@ -153,3 +224,245 @@ class ConfigTests(unittest.TestCase):
         self.assertEqual(proj.config['issuer']['url'], 'http://p/blah/')
         proj.set_base_url('http://m/meh')
         self.assertEqual(proj.config['issuer']['url'], 'http://m/meh/')
+
+class CacheTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.dir, 'proj')
+        shutil.copytree(SAMPLE_PROJECT, self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testBadgesAreSharedByAssertions(self):
+        proj = Project(self.root)
+        badge = proj.badges['no-img']
+        self.assertTrue(proj.badges['no-img'] is badge)
+        self.assertTrue(proj.assertions['foo.no-img'].badge is badge)
+        self.assertTrue([b for b in proj.badges
+                         if b.basename == 'no-img'][0] is badge)
+
+    def testAssertionsAreSharedByFind(self):
+        proj = Project(self.root)
+        assn = proj.assertions['foo.img']
+        self.assertTrue(list(proj.assertions.find(badge='img'))[0] is assn)
+
+    def testChangedFilesAreReloaded(self):
+        proj = Project(self.root)
+        badge = proj.badges['img']
+        f = open(os.path.join(self.root, 'badges', 'img.yml'), 'w')
+        f.write('name: Changed\n---\nnew criteria.\n')
+        f.close()
+        self.assertEqual(proj.badges['img'].name, 'Changed')
+        self.assertFalse(proj.badges['img'] is badge)
+
+    def testIndexIsRebuiltWhenAssertionsChange(self):
+        proj = Project(self.root)
+        self.assertEqual(proj.assertions.count(recipient='baz'), 1)
+        shutil.copy(os.path.join(self.root, 'assertions', 'foo.img.yml'),
+                    os.path.join(self.root, 'assertions', 'baz.img.yml'))
+        os.utime(os.path.join(self.root, 'assertions'), (0, 0))
+        self.assertEqual(proj.assertions.count(recipient='baz'), 2)
+
+    def testBadgesAreReloadedWhenImageIsRemoved(self):
+        proj = Project(self.root)
+        self.assertTrue(proj.badges['img'].image_url)
+        os.remove(os.path.join(self.root, 'badges', 'img.png'))
+        self.assertEqual(proj.badges['img'].image_url, None)
+
+    def testAssertionsAreReloadedWhenBadgeChanges(self):
+        proj = Project(self.root)
+        self.assertEqual(proj.assertions['foo.img'].badge.name, 'Image')
+        f = open(os.path.join(self.root, 'badges', 'img.yml'), 'w')
+        f.write('name: Changed\n---\nnew criteria.\n')
+        f.close()
+        self.assertEqual(proj.assertions['foo.img'].badge.name, 'Changed')
+
+    def testAssertionsForMissingBadgesCannotBeLoaded(self):
+        proj = Project(self.root)
+        os.remove(os.path.join(self.root, 'badges', 'img.yml'))
+        filename = os.path.join(self.root, 'assertions', 'foo.img.yml')
+        self.assertEqual(proj.assertions.signature(filename)[1], None)
+        self.assertRaises(KeyError, proj.assertions.load, filename)
+
+    def testParseCacheIsUsed(self):
+        proj = Project(self.root)
+        proj.open_cache()
+        first = [(a.json, a.evidence_html) for a in proj.assertions]
+        proj.cache.close()
+        proj = Project(self.root)
+        proj.open_cache()
+        before = stats.snapshot()
+        second = [(a.json, a.evidence_html) for a in proj.assertions]
+        counts = stats.since(before)
+        proj.cache.close()
+        self.assertEqual(second, first)
+        self.assertEqual(counts.get('yaml_parses', 0), 0)
+        self.assertEqual(counts.get('markdown_renders', 0), 0)
+        self.assertEqual(counts['yaml_cache_hits'], 7)
+        self.assertEqual(counts['markdown_cache_hits'], 2)
+
+    def testHashedIdentitiesAreCached(self):
+        proj = Project(self.root)
+        proj.open_cache()
+        before = stats.snapshot()
+        first = proj.assertions['foo.img'].json['recipient']
+        self.assertEqual(stats.since(before)['identity_hashes'], 1)
+        proj.cache.close()
+        proj = Project(self.root)
+        proj.open_cache()
+        before = stats.snapshot()
+        second = proj.assertions['foo.img'].json['recipient']
+        counts = stats.since(before)
+        proj.cache.close()
+        self.assertEqual(second, first)
+        self.assertEqual(counts.get('identity_hashes', 0), 0)
+        self.assertEqual(counts['identity_cache_hits'], 1)
+
+    def testCachedIdentitiesAreLoadedOnce(self):
+        proj = Project(self.root)
+        proj.open_cache()
+        [a.json for a in proj.assertions]
+        proj.cache.close()
+        proj = Project(self.root)
+        cache = proj.open_cache()
+        loads = []
+        load = cache.identities
+        def identities(salts):
+            loads.append(1)
+            return load(salts)
+        cache.identities = identities
+        before = stats.snapshot()
+        [a.json for a in proj.assertions]
+        counts = stats.since(before)
+        cache.close()
+        self.assertEqual(loads, [1])
+        self.assertEqual(counts.get('identity_hashes', 0), 0)
+        self.assertEqual(counts['identity_cache_hits'], 5)
+
+    def testIdentitiesCanBeHashedInBulk(self):
+        pairs = [('a@b.org', 'a.%d' % i) for i in range(10)]
+        for jobs in (1, 2):
+            proj = Project(self.root)
+            proj.open_cache()
+            self.assertEqual(hash_identities(proj, pairs, jobs=jobs), 10)
+            self.assertEqual(hash_identities(proj, pairs, jobs=jobs), 0)
+            self.assertEqual(proj.cache.identities(['a.3']),
+                             {pairs[3]: hash_identity(pairs[3])})
+            proj.cache.close()
+            shutil.rmtree(proj.path(proj.CACHE_DIR))
+
+    def testIdentitiesAreNotKeptWithoutCache(self):
+        proj = Project(self.root)
+        pairs = [('a@b.org', 'a.1')]
+        self.assertEqual(hash_identities(proj, pairs), 1)
+        self.assertEqual(hash_identities(proj, pairs), 1)
+        self.assertEqual(proj.cached_identity(*pairs[0]), None)
+
+    def testRecipientsCanBeAdded(self):
+        f = open(os.path.join(self.root, 'config.yml'), 'a')
+        f.write('  # Keep me.\n\n# And me.\nextra: 1')
+        f.close()
+        proj = Project(self.root)
+        proj.add_recipients([
+            badgepad.project.Recipient(proj, 'a', u'A: \xe9', 'a@b.org'),
+            badgepad.project.Recipient(proj, 'b', '', 'b@b.org')
+        ])
+        self.assertEqual(proj.recipients['a'].email, 'a@b.org')
+        config = open(os.path.join(self.root, 'config.yml')).read()
+        self.assertTrue(config.endswith('  # Keep me.\n'
+                                        '  a: \'"A: \xc3\xa9" <a@b.org>\'\n'
+                                        '  b: b@b.org\n'
+                                        '\n# And me.\nextra: 1'))
+        proj = Project(self.root)
+        self.assertEqual(proj.recipients['a'].name, u'A: \xe9')
+        self.assertEqual(proj.recipients['b'].email, 'b@b.org')
+        self.assertEqual(proj.config['extra'], 1)
+
+    def testRecipientsCanBeAddedAfterLastLine(self):
+        f = open(os.path.join(self.root, 'config.yml'), 'a')
+        f.write('  z: z@b.org')
+        f.close()
+        proj = Project(self.root)
+        proj.add_recipients([
+            badgepad.project.Recipient(proj, 'b', '', 'b@b.org')
+        ])
+        config = open(os.path.join(self.root, 'config.yml')).read()
+        self.assertTrue(config.endswith('  z: z@b.org\n  b: b@b.org\n'))
+
+    def set_recipients_section(self, section):
+        filename = os.path.join(self.root, 'config.yml')
+        config = open(filename).read()
+        f = open(filename, 'w')
+        f.write(config[:config.index('recipients:')] + section)
+        f.close()
+
+    def testRecipientsSectionIsRequiredToAddRecipients(self):
+        self.set_recipients_section('recipients: {a: a@b.org}\n')
+        proj = Project(self.root)
+        self.assertRaises(ValueError, proj.add_recipients, [])
+
+    def testRecipientsCanBeAddedToAnySection(self):
+        for section, added in [
+            ('recipients:  # people\n  a: a@b.org\n',
+             'recipients:  # people\n  a: a@b.org\n  b: b@b.org\n'),
+            ('recipients: {}\n', 'recipients:\n  b: b@b.org\n'),
+            ('recipients: { } # none yet\n',
+             'recipients: # none yet\n  b: b@b.org\n')
+        ]:
+            self.set_recipients_section(section)
+            proj = Project(self.root)
+            proj.add_recipients([
+                badgepad.project.Recipient(proj, 'b', '', 'b@b.org')
+            ])
+            config = open(os.path.join(self.root, 'config.yml')).read()
+            self.assertTrue(config.endswith(added))
+            self.assertEqual(Project(self.root).recipients['b'].email,
+                             'b@b.org')
+
+    def testRecipientsAreLoadedLazily(self):
+        proj = Project(self.root)
+        proj.config
+        recipients = proj.recipients
+        self.assertTrue(isinstance(recipients, badgepad.project.RecipientMap))
+        self.assertEqual(len(recipients), 4)
+        self.assertTrue('foo' in recipients)
+        self.assertFalse('zzz' in recipients)
+        self.assertRaises(KeyError, getitem, recipients, 'zzz')
+        self.assertTrue(recipients['foo'] is recipients['foo'])
+        self.assertTrue('foo' in recipients)
+
+    def testRecipientsCanBeKeptInExternalStore(self):
+        filename = os.path.join(self.root, 'config.yml')
+        config = open(filename).read()
+        f = open(filename, 'w')
+        f.write(config[:config.index('recipients:')] +
+                'recipients: people.sqlite\n')
+        f.close()
+        proj = Project(self.root)
+        proj.add_recipients([
+            badgepad.project.Recipient(proj, slug, slug.title(),
+                                       '%s@bar.org' % slug)
+            for slug in ['foo', 'bar', 'baz', 'quux']
+        ])
+        self.assertPathExists('people.sqlite')
+        proj = Project(self.root)
+        self.assertEqual(proj.assertions['foo.img'].recipient.name, 'Foo')
+        self.assertEqual(sorted(proj.recipients),
+                         ['bar', 'baz', 'foo', 'quux'])
+
+    def testRecipientsFilenameIsKnown(self):
+        self.assertEqual(Project(self.root).recipients_filename, None)
+        use_recipients_file(self.root)
+        self.assertEqual(Project(self.root).recipients_filename,
+                         os.path.join(self.root, 'people.csv'))
+
+    def assertPathExists(self, *path):
+        self.assertTrue(os.path.exists(os.path.join(self.root, *path)))
+
+    def testSetBaseUrlClearsCache(self):
+        proj = Project(self.root)
+        badge = proj.badges['img']
+        proj.set_base_url('http://p/')
+        self.assertEqual(proj.badges['img'].json_url,
+                         'http://p/badges/img.json')
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import shutil
+import unittest
+import email.utils
+from minimock import mock, restore
+
+from badgepad.recipients import open_store, InlineStore, CsvStore, \
+                                JsonlStore, SqliteStore
+
+ENTRIES = [('b', u'B\xe9', 'b@b.org'), ('a', u'', 'a@b.org')]
+
+class BaseStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        restore()
+
+    def path(self, *path):
+        return os.path.join(self.dir, *path)
+
+class InlineStoreTests(BaseStoreTest):
+    def testAddressesAreParsedOnlyWhenLookedUp(self):
+        mock('email.utils.parseaddr', raises=AssertionError)
+        store = open_store(self.dir, {'a': 'A <a@b.org>'})
+        self.assertTrue(isinstance(store, InlineStore))
+        self.assertEqual(store.slugs(), ['a'])
+        restore()
+        self.assertEqual(store.lookup('a'), ('A', 'a@b.org'))
+        self.assertEqual(store.lookup('b'), None)
+
+    def testEmptySectionHasNoRecipients(self):
+        self.assertEqual(open_store(self.dir, None).slugs(), [])
+
+class ExternalStoreTests(BaseStoreTest):
+    def check(self, filename, cls):
+        store = open_store(self.dir, filename)
+        self.assertTrue(isinstance(store, cls))
+        self.assertEqual(store.lookup('a'), None)
+        store.add(ENTRIES[:1])
+        store.add(ENTRIES[1:])
+        self.assertEqual(store.lookup('b'), (u'B\xe9', 'b@b.org'))
+        store = open_store(self.dir, filename)
+        self.assertEqual(store.slugs(), ['a', 'b'])
+        self.assertEqual(store.lookup('a'), (u'', 'a@b.org'))
+        self.assertEqual(store.lookup('b'), (u'B\xe9', 'b@b.org'))
+        self.assertEqual(store.lookup('c'), None)
+        return store
+
+    def testCsvWorks(self):
+        self.check('people.csv', CsvStore)
+        self.assertEqual(open(self.path('people.csv')).read(),
+                         'slug,name,email\r\n'
+                         'b,B\xc3\xa9,b@b.org\r\n'
+                         'a,,a@b.org\r\n')
+
+    def testJsonlWorks(self):
+        self.check('people.jsonl', JsonlStore)
+        f = open(self.path('people.jsonl'), 'a')
+        f.write('\n')
+        f.close()
+        self.assertEqual(len(open_store(self.dir, 'people.jsonl').slugs()),
+                         2)
+
+    def testSqliteWorks(self):
+        self.check('people.sqlite', SqliteStore)
+
+    def testUnknownStoresAreRejected(self):
+        self.assertRaises(ValueError, open_store, self.dir, 'people.txt')
@@ -3,23 +3,28 @@ import tempfile
 import shutil
 import unittest
 import doctest
+import threading
+import httplib
+import socket
 from minimock import mock, Mock, restore
 
 from badgepad import server
 from badgepad.server import get_dir_state
+from badgepad.recipients import SqliteStore
+
+from .test_project import SAMPLE_PROJECT, use_recipients_file
 
 def load_tests(loader, tests, ignore):
     tests.addTests(doctest.DocTestSuite())
+    tests.addTests(doctest.DocTestSuite(server))
     return tests
 
 def test_start_auto_rebuild_server():
     """
     >>> import threading
-    >>> import time
     >>> mock('threading.Thread', returns=Mock('thread'))
-    >>> mock('time.sleep')
     >>> mock('tempfile.mkdtemp', returns='temp')
-    >>> mock('os.chdir')
+    >>> mock('server.make_watcher', returns=Mock('watcher'))
     >>> mock('server.auto_rebuilder', returns=[1, 2])
     >>> mock('shutil.rmtree')
     >>> mock('os.path.exists', returns=True)
@@ -30,15 +35,17 @@ def test_start_auto_rebuild_server():
     ...     3000
     ... )                                                # doctest: +ELLIPSIS
     Called tempfile.mkdtemp()
+    Called server.make_watcher('root')
     Called threading.Thread(
-        kwargs={'ip': '127.0.0.1', 'port': 3000},
+        kwargs={'ip': '127.0.0.1', 'root_dir': 'temp', 'port': 3000},
         target=<function start_file_server at ...>)
     Called thread.start()
-    Called server.auto_rebuilder('root', 'temp')
-    Called os.chdir('temp')
-    Called time.sleep(1)
-    Called os.chdir('temp')
-    Called time.sleep(1)
+    Called server.auto_rebuilder(
+        'root',
+        'temp',
+        <Mock ... watcher>,
+        False)
+    Called watcher.close()
     Called os.path.exists('temp')
     Called shutil.rmtree('temp')
 
@@ -49,38 +56,100 @@ def test_start_auto_rebuild_server():
 
 def test_auto_rebuilder():
     """
-    >>> mock('server.build_website')
-    >>> mock('server.get_dir_state', returns='abc')
-    >>> mock('server.Project', returns='proj')
+    >>> mock('server.rebuild', returns='proj')
+    >>> watcher = Mock('watcher')
+    >>> watcher.wait.mock_returns = set(['root/a.yml'])
 
-    >>> ar = server.auto_rebuilder('root', 'dest')
-    >>> ar.next()
-    Called server.get_dir_state('root')
-    rebuilding website... Called server.Project('root')
-    Called server.build_website('proj', dest_dir='dest')
+    >>> ar = server.auto_rebuilder('root', 'dest', watcher)
+    >>> ar.next()                        # doctest: +NORMALIZE_WHITESPACE
+    rebuilding website... Called server.rebuild(None, 'root', 'dest', None,
+        False)
     done.
 
-    >>> ar.next()
-    Called server.get_dir_state('root')
-
-    >>> server.get_dir_state.mock_returns = 'def'
-    >>> server.build_website.mock_raises = Exception('hmph')
-    >>> ar.next()                                        # doctest: +ELLIPSIS
-    Called server.get_dir_state('root')
-    rebuilding website... Called server.Project('root')
-    Called server.build_website('proj', dest_dir='dest')
+    >>> server.rebuild.mock_raises = Exception('hmph')
+    >>> ar.next()                    # doctest: +ELLIPSIS +NORMALIZE_WHITESPACE
+    Called watcher.wait()
+    1 file(s) changed, rebuilding website... Called server.rebuild('proj',
+        'root', 'dest', set(['root/a.yml']), False)
     Traceback (most recent call last):
     ...
     Exception: hmph
+    set(['root/a.yml'])
 
-    >>> server.get_dir_state.mock_returns = 'ghi'
-    >>> server.build_website.mock_raises = None
-    >>> ar.next()
-    Called server.get_dir_state('root')
-    rebuilding website... Called server.Project('root')
-    Called server.build_website('proj', dest_dir='dest')
+    >>> server.rebuild.mock_raises = None
+    >>> ar.next()                        # doctest: +NORMALIZE_WHITESPACE
+    Called watcher.wait()
+    1 file(s) changed, rebuilding website... Called server.rebuild(None,
+        'root', 'dest', set(['root/a.yml']), False)
     done.
+    set(['root/a.yml'])
+
+    >>> restore()
+    """
+
+    pass
+
+def test_rebuild():
+    """
+    >>> mock('server.build_website')
+    >>> mock('server.update_website')
+    >>> mock('server.find_affected_outputs', returns=None)
+    >>> mock('server.Project', returns='proj')
+
+    >>> server.rebuild(None, 'root', 'dest', None)
+    Called server.Project('root')
+    Called server.build_website(
+        'proj',
+        dest_dir='dest',
+        incremental=True,
+        precompress=False)
+    'proj'
+
+    >>> server.rebuild('proj', 'root', 'dest', set(['root/config.yml']))
+    Called server.find_affected_outputs('proj', set(['root/config.yml']))
+    Called server.Project('root')
+    Called server.build_website(
+        'proj',
+        dest_dir='dest',
+        incremental=True,
+        precompress=False)
+    'proj'
+
+    >>> server.find_affected_outputs.mock_returns = 'affected'
+    >>> server.rebuild('proj', 'root', 'dest', set(['root/a/b.yml']),
+    ...                precompress=True)
+    Called server.find_affected_outputs('proj', set(['root/a/b.yml']))
+    Called server.update_website('proj', 'dest', 'affected', precompress=True)
+    'proj'
+
+    >>> restore()
+    """
+
+    pass
+
+def test_make_watcher_falls_back_to_polling():
+    """
+    >>> mock('server.InotifyWatcher', raises=OSError(38, 'nope'))
+    >>> mock('server.PollingWatcher', returns='poller')
+    >>> server.make_watcher('root')
+    Called server.InotifyWatcher('root')
+    Called server.PollingWatcher('root')
+    'poller'
+    >>> restore()
+    """
+
+    pass
 
+def test_check_libc_result():
+    """
+    >>> server.check_libc_result(3)
+    3
+    >>> import ctypes
+    >>> mock('ctypes.get_errno', returns=2)
+    >>> server.check_libc_result(-1)
+    Traceback (most recent call last):
+    ...
+    OSError: [Errno 2] No such file or directory
     >>> restore()
     """
 
@@ -88,13 +157,9 @@ def test_auto_rebuilder():
 
 def test_start_file_server_works():
     """
-    >>> import SocketServer
-    >>> mock('SocketServer.TCPServer')
-    >>> SocketServer.TCPServer.mock_returns = Mock('httpd')
-    >>> server.start_file_server('127.0.0.1', 8000)     # doctest: +ELLIPSIS
-    Called SocketServer.TCPServer(
-        ('127.0.0.1', 8000),
-        <class SimpleHTTPServer.SimpleHTTPRequestHandler at ...>)
+    >>> mock('server.ThreadingHTTPServer', returns=Mock('httpd'))
+    >>> server.start_file_server('127.0.0.1', 8000, 'dist')
+    Called server.ThreadingHTTPServer(('127.0.0.1', 8000), 'dist')
     serving at port 8000 on 127.0.0.1
     Called httpd.serve_forever()
     >>> restore()
@@ -102,6 +167,57 @@ def test_start_file_server_works():
 
     pass
 
+def test_start_live_server_works():
+    """
+    >>> mock('server.ThreadingHTTPServer', returns=Mock('httpd'))
+    >>> mock('server.LiveSite', returns='site')
+    >>> server.start_live_server('root', '127.0.0.1', 8000)
+    ...                                                  # doctest: +ELLIPSIS
+    Called server.ThreadingHTTPServer(
+        ('127.0.0.1', 8000),
+        'root',
+        handler=<class badgepad.server.LiveHandler at ...>)
+    Called server.LiveSite('root')
+    serving root live at port 8000 on 127.0.0.1
+    Called httpd.serve_forever()
+    >>> restore()
+    """
+
+    pass
+
+def test_lru_cache():
+    """
+    >>> cache = server.LRUCache(2)
+    >>> cache.set('a', 1)
+    >>> cache.set('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.set('c', 3)
+    >>> print cache.get('b')
+    None
+    >>> cache.set('a', 4)
+    >>> sorted(cache.items.items())
+    [('a', 4), ('c', 3)]
+    >>> len(cache)
+    2
+    >>> cache.clear()
+    >>> len(cache)
+    0
+    """
+
+    pass
+
+def test_find_sendfile_falls_back():
+    """
+    >>> mock('server.make_sendfile', raises=AttributeError('sendfile'))
+    >>> print server.find_sendfile()
+    Called server.make_sendfile()
+    None
+    >>> restore()
+    """
+
+    pass
+
 class ServerTests(unittest.TestCase):
     def testGetDirStateWorks(self):
         tmpdir = tempfile.mkdtemp()
@@ -121,3 +237,400 @@ class ServerTests(unittest.TestCase):
             self.assertNotEqual(get_dir_state(tmpdir), state2)
         finally:
             shutil.rmtree(tmpdir)
+
+class BaseWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.watcher = self.make_watcher()
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.dir)
+
+    def path(self, *args):
+        return os.path.join(self.dir, *args)
+
+    def write(self, *args):
+        open(self.path(*args), 'w').write('hi')
+
+class PollingWatcherTests(BaseWatcherTest):
+    def make_watcher(self):
+        return server.PollingWatcher(self.dir, interval=0)
+
+    def testTimeoutWorks(self):
+        self.assertEqual(self.watcher.wait(timeout=0), set())
+
+    def testChangesAreReported(self):
+        self.write('foo')
+        self.write('.hidden')
+        self.assertEqual(self.watcher.wait(), set([self.path('foo')]))
+        os.remove(self.path('foo'))
+        self.assertEqual(self.watcher.wait(), set([self.path('foo')]))
+
+class InotifyWatcherTests(BaseWatcherTest):
+    def make_watcher(self):
+        return server.InotifyWatcher(self.dir)
+
+    def testTimeoutWorks(self):
+        self.assertEqual(self.watcher.wait(timeout=0), set())
+
+    def testChangesAreReported(self):
+        self.write('foo')
+        self.write('.hidden')
+        self.assertEqual(self.watcher.wait(timeout=5),
+                         set([self.path('foo')]))
+
+    def testBurstsAreDebounced(self):
+        import threading
+        self.watcher.debounce = 1
+        self.write('foo')
+        timer = threading.Timer(0.1, self.write, ['bar'])
+        timer.start()
+        try:
+            self.assertEqual(self.watcher.wait(timeout=5),
+                             set([self.path('foo'), self.path('bar')]))
+        finally:
+            timer.join()
+
+    def testNewDirectoriesAreWatched(self):
+        os.mkdir(self.path('bar'))
+        self.assertEqual(self.watcher.wait(timeout=5),
+                         set([self.path('bar')]))
+        self.write('bar', 'baz')
+        self.assertEqual(self.watcher.wait(timeout=5),
+                         set([self.path('bar', 'baz')]))
+        shutil.rmtree(self.path('bar'))
+        self.assertEqual(self.watcher.wait(timeout=5),
+                         set([self.path('bar'), self.path('bar', 'baz')]))
+        self.assertEqual(self.watcher.watches.values(), [self.dir])
+
+    def fake_read(self, *events):
+        packets = [server.EVENT_HEADER.pack(wd, mask, 0, len(name)) + name
+                   for wd, mask, name in events]
+        real_read = os.read
+        def read(fd, size):
+            if fd == self.watcher.fd and packets:
+                return packets.pop(0)
+            return real_read(fd, size)
+        os.read = read
+        self.addCleanup(setattr, os, 'read', real_read)
+
+    def testQueueOverflowReportsEverythingChanged(self):
+        os.mkdir(self.path('bar'))
+        self.fake_read((-1, server.IN_Q_OVERFLOW, ''))
+        self.assertEqual(self.watcher.read_events(), None)
+        self.assertTrue(self.path('bar') in self.watcher.watches.values())
+        self.write('foo')
+        self.fake_read((-1, server.IN_Q_OVERFLOW, ''),
+                       (1, server.IN_CREATE, 'baz\0'))
+        self.assertEqual(self.watcher.wait(timeout=5), None)
+        self.write('foo')
+        self.fake_read((1, server.IN_CREATE, 'baz\0'),
+                       (-1, server.IN_Q_OVERFLOW, ''))
+        self.assertEqual(self.watcher.wait(timeout=5), None)
+
+    def testMissingInotifyRaisesError(self):
+        self.assertRaises(AttributeError, server.InotifyWatcher, self.dir,
+                          libc=object())
+
+class FileServerTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir, 'sub'))
+        os.mkdir(os.path.join(self.dir, 'site'))
+        self.write('hello', 'foo.json')
+        self.write('index', 'site', 'index.html')
+        self.httpd = server.ThreadingHTTPServer(('127.0.0.1', 0), self.dir)
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       args=(0.01,))
+        self.thread.start()
+        self.conn = httplib.HTTPConnection('127.0.0.1',
+                                           self.httpd.server_address[1])
+
+    def tearDown(self):
+        self.conn.close()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+        shutil.rmtree(self.dir)
+
+    def write(self, content, *path):
+        open(os.path.join(self.dir, *path), 'w').write(content)
+
+    def request(self, path, method='GET', **headers):
+        self.conn.request(method, path, headers=headers)
+        response = self.conn.getresponse()
+        return response, response.read()
+
+    def testFilesAreServedOverOneConnection(self):
+        response, body = self.request('/foo.json')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, 'hello')
+        self.assertEqual(response.getheader('content-type'),
+                         'application/json')
+        sock = self.conn.sock
+        response, body = self.request('/foo.json?x=1')
+        self.assertEqual(body, 'hello')
+        self.assertTrue(self.conn.sock is sock)
+
+    def testSendfileStopsAtEndOfFile(self):
+        sendfile = server.make_sendfile()
+        src = open(os.path.join(self.dir, 'foo.json'), 'rb')
+        dest = open(os.path.join(self.dir, 'copy.json'), 'wb')
+        sendfile(dest.fileno(), src.fileno(), 100)
+        src.close()
+        dest.close()
+        self.assertEqual(open(os.path.join(self.dir, 'copy.json')).read(),
+                         'hello')
+
+    def testSendfileFallbackWorks(self):
+        self.httpd.sendfile = None
+        response, body = self.request('/foo.json')
+        self.assertEqual(body, 'hello')
+
+    def testEtagsWork(self):
+        response, body = self.request('/foo.json')
+        etag = response.getheader('etag')
+        response, body = self.request('/foo.json', **{
+            'If-None-Match': 'W/"nope", %s' % etag
+        })
+        self.assertEqual(response.status, 304)
+        self.assertEqual(body, '')
+        self.write('changed', 'foo.json')
+        response, body = self.request('/foo.json', **{
+            'If-None-Match': etag
+        })
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, 'changed')
+        self.assertNotEqual(response.getheader('etag'), etag)
+
+    def testHeadWorks(self):
+        response, body = self.request('/foo.json', method='HEAD')
+        self.assertEqual(response.getheader('content-length'), '5')
+        self.assertEqual(body, '')
+
+    def testMissingFilesReturn404(self):
+        response, body = self.request('/nope.json')
+        self.assertEqual(response.status, 404)
+
+    def testPathsCannotEscapeRoot(self):
+        handler = Mock('handler', server=self.httpd)
+        translate_path = server.StaticFileHandler.translate_path.im_func
+        self.assertEqual(translate_path(handler, 'sub/../../etc/passwd'),
+                         os.path.join(self.dir, 'etc', 'passwd'))
+
+    def testDirectoriesAreRedirected(self):
+        response, body = self.request('/sub?a=b')
+        self.assertEqual(response.status, 301)
+        self.assertEqual(response.getheader('location'), '/sub/?a=b')
+        response, body = self.request('/sub/')
+        self.assertEqual(response.status, 200)
+        self.assertTrue('Directory listing' in body)
+
+    def testPrecompressedFilesAreNegotiated(self):
+        self.write('gzipped', 'foo.json.gz')
+        response, body = self.request('/foo.json', **{
+            'Accept-Encoding': 'deflate, gzip'
+        })
+        self.assertEqual(body, 'gzipped')
+        self.assertEqual(response.getheader('content-encoding'), 'gzip')
+        self.assertEqual(response.getheader('content-type'),
+                         'application/json')
+        self.assertEqual(response.getheader('vary'), 'Accept-Encoding')
+        gzip_etag = response.getheader('etag')
+        response, body = self.request('/foo.json', **{
+            'Accept-Encoding': 'gzip;q=0, identity'
+        })
+        self.assertEqual(body, 'hello')
+        self.assertEqual(response.getheader('content-encoding'), None)
+        self.assertEqual(response.getheader('vary'), 'Accept-Encoding')
+        self.assertNotEqual(response.getheader('etag'), gzip_etag)
+        response, body = self.request('/foo.json', **{
+            'Accept-Encoding': 'gzip',
+            'If-None-Match': gzip_etag
+        })
+        self.assertEqual(response.status, 304)
+        self.assertEqual(response.getheader('vary'), 'Accept-Encoding')
+
+    def testBrotliIsPreferred(self):
+        self.write('gzipped', 'foo.json.gz')
+        self.write('brotlied', 'foo.json.br')
+        response, body = self.request('/foo.json', **{
+            'Accept-Encoding': 'gzip, br'
+        })
+        self.assertEqual(body, 'brotlied')
+        self.assertEqual(response.getheader('content-encoding'), 'br')
+        response, body = self.request('/foo.json', **{
+            'Accept-Encoding': '*;q=0.1, br;q=0'
+        })
+        self.assertEqual(response.getheader('content-encoding'), 'gzip')
+
+    def testUncompressedFilesDontVary(self):
+        response, body = self.request('/foo.json', **{
+            'Accept-Encoding': 'gzip'
+        })
+        self.assertEqual(body, 'hello')
+        self.assertEqual(response.getheader('vary'), None)
+
+    def testIndexFilesAreServed(self):
+        response, body = self.request('/site/')
+        self.assertEqual(body, 'index')
+
+class LiveSiteTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.dir, 'proj')
+        shutil.copytree(SAMPLE_PROJECT, self.root)
+        os.mkdir(os.path.join(self.root, 'static'))
+        self.write('body {}', 'static', 'a.css')
+        self.site = server.LiveSite(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, content, *path):
+        open(os.path.join(self.root, *path), 'w').write(content)
+
+    def body(self, path):
+        response = self.site.respond(path)
+        return response and response[1]
+
+    def testPagesAreRendered(self):
+        self.assertTrue('"name": "Foo"' in self.body('/issuer.json'))
+        self.assertTrue('"uid": "foo.img"' in
+                        self.body('/assertions/foo/img.json'))
+        self.assertTrue('<h1>Image</h1>' in
+                        self.body('/assertions/foo/img.html'))
+        self.assertTrue('"criteria"' in self.body('/badges/img.json'))
+        self.assertTrue('Image here.' in self.body('/badges/img.html'))
+        self.assertEqual(self.body('/badges/img.png'), open(
+            os.path.join(self.root, 'badges', 'img.png'), 'rb'
+        ).read())
+        self.assertEqual(self.body('/a.css'), 'body {}')
+
+    def testMissingPagesAreNotFound(self):
+        self.assertEqual(self.site.respond('/assertions/zzz/img.json'), None)
+        self.assertEqual(self.site.respond('/badges/zzz.json'), None)
+        self.assertEqual(self.site.respond('/badges/no-img.png'), None)
+        self.assertEqual(self.site.respond('/nope.css'), None)
+        self.assertEqual(self.site.respond('/'), None)
+
+    def testDirectoriesServeIndexFiles(self):
+        self.write('home', 'static', 'index.html')
+        os.mkdir(os.path.join(self.root, 'static', 'docs'))
+        self.write('docs', 'static', 'docs', 'index.html')
+        self.assertEqual(self.body('/'), 'home')
+        self.assertEqual(self.body(''), 'home')
+        self.assertEqual(self.body('/docs/'), 'docs')
+
+    def testPagesAreCached(self):
+        first = self.site.respond('/assertions/foo/img.html')
+        self.assertEqual(self.site.respond('/assertions/foo/img.html'),
+                         first)
+        self.assertEqual(self.site.renders, 1)
+
+    def testChangedInputsAreRerendered(self):
+        self.body('/assertions/foo/img.html')
+        self.write('name: Renamed\n---\ncriteria', 'badges', 'img.yml')
+        self.assertTrue('Renamed' in self.body('/assertions/foo/img.html'))
+        self.assertEqual(self.site.renders, 2)
+
+    def testChangedConfigReloadsProject(self):
+        self.body('/issuer.json')
+        config = open(os.path.join(self.root, 'config.yml')).read()
+        self.write(config.replace('name: Foo', 'name: Changed'),
+                   'config.yml')
+        self.assertTrue('"name": "Changed"' in self.body('/issuer.json'))
+
+    def testChangedRecipientStoreReloadsProject(self):
+        use_recipients_file(self.root)
+        first = self.body('/assertions/foo/img.json')
+        use_recipients_file(self.root, 'foo@example.org')
+        self.assertNotEqual(self.body('/assertions/foo/img.json'), first)
+
+class LiveHandlerTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.dir, 'proj')
+        shutil.copytree(SAMPLE_PROJECT, self.root)
+        os.mkdir(os.path.join(self.root, 'static'))
+        self.httpd = server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                self.root,
+                                                handler=server.LiveHandler)
+        self.httpd.site = server.LiveSite(self.root)
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       args=(0.01,))
+        self.thread.start()
+        self.conn = httplib.HTTPConnection('127.0.0.1',
+                                           self.httpd.server_address[1])
+
+    def tearDown(self):
+        self.conn.close()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+        shutil.rmtree(self.dir)
+
+    def request(self, path, **headers):
+        self.conn.request('GET', path, headers=headers)
+        response = self.conn.getresponse()
+        return response, response.read()
+
+    def raw_request(self, target):
+        sock = socket.create_connection(self.httpd.server_address)
+        sock.sendall('GET %s HTTP/1.0\r\n\r\n' % target)
+        response = httplib.HTTPResponse(sock)
+        response.begin()
+        sock.close()
+        return response
+
+    def testPagesAreServed(self):
+        response, body = self.request('/badges/img.json?v=1')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader('content-type'),
+                         'application/json')
+        self.assertTrue('"criteria"' in body)
+        response, body = self.request('/badges/img.json', **{
+            'If-None-Match': response.getheader('etag')
+        })
+        self.assertEqual(response.status, 304)
+
+    def testMissingPagesReturn404(self):
+        response, body = self.request('/badges/zzz.json')
+        self.assertEqual(response.status, 404)
+
+    def testSqliteRecipientsWorkFromEveryThread(self):
+        config = open(os.path.join(self.root, 'config.yml')).read()
+        open(os.path.join(self.root, 'config.yml'), 'w').write(
+            config[:config.index('recipients:')] +
+            'recipients: people.sqlite\n'
+        )
+        store = SqliteStore(os.path.join(self.root, 'people.sqlite'))
+        store.add([(slug, slug.title(), '%s@bar.org' % slug)
+                   for slug in ('foo', 'bar', 'baz', 'quux')])
+        store.db.close()
+        for path in ('foo/img', 'foo/no-img', 'bar/no-img', 'baz/no-img',
+                     'quux/no-img'):
+            response = self.raw_request('/assertions/%s.json' % path)
+            self.assertEqual(response.status, 200)
+
+    def testFilesOutsideTheSiteAreNotServed(self):
+        open(os.path.join(self.dir, 'secret.txt'), 'w').write('secret')
+        os.symlink(os.path.join(self.dir, 'secret.txt'),
+                   os.path.join(self.root, 'static', 'link.txt'))
+        for target in ('../config.yml', '../../secret.txt',
+                       './../config.yml', '/static/../../secret.txt',
+                       '/link.txt'):
+            self.assertEqual(self.raw_request(target).status, 404)
+        self.assertEqual(self.raw_request('badges/img.json').status, 200)
+
+    def testDirectoriesServeIndexFiles(self):
+        paths = []
+        def respond(path):
+            paths.append(path)
+            return ('abc', 'docs')
+        self.httpd.site.respond = respond
+        response, body = self.request('/docs/./')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader('content-type'), 'text/html')
+        self.assertEqual(paths, ['/docs/'])
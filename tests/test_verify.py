@@ -0,0 +1,222 @@
+import os
+import json
+import httplib
+import doctest
+import tempfile
+import shutil
+import threading
+import unittest
+
+import badgepad.verify
+from badgepad import server
+from badgepad.project import Project
+from badgepad.build import build_website
+from badgepad.verify import Verifier, DirectorySite, HttpSite, FetchError
+
+from .test_project import SAMPLE_PROJECT
+
+def load_tests(loader, tests, ignore):
+    tests.addTests(doctest.DocTestSuite(badgepad.verify))
+    return tests
+
+class CountingSite(DirectorySite):
+    def __init__(self, dist_dir):
+        DirectorySite.__init__(self, dist_dir)
+        self.fetched = []
+
+    def fetch(self, path):
+        self.fetched.append(path)
+        return DirectorySite.fetch(self, path)
+
+class BaseVerifyTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.dir, 'proj')
+        self.dest = os.path.join(self.dir, 'dist')
+        shutil.copytree(SAMPLE_PROJECT, self.root)
+        build_website(Project(self.root), self.dest)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def dest_path(self, *path):
+        return os.path.join(self.dest, *path)
+
+    def verify(self, site=None):
+        if site is None:
+            site = DirectorySite(self.dest)
+        return Verifier(Project(self.root), site, jobs=4).run()
+
+    def problems(self):
+        return self.verify()['problems']
+
+    def edit_json(self, func, *path):
+        data = json.load(open(self.dest_path(*path)))
+        func(data)
+        json.dump(data, open(self.dest_path(*path), 'w'))
+
+class VerifierTests(BaseVerifyTest):
+    def testBuiltSiteVerifies(self):
+        report = self.verify()
+        self.assertEqual(report['problems'], [])
+        self.assertEqual(report['assertions'], 5)
+        self.assertEqual(report['fetches'], 12)
+        self.assertEqual(sorted(report['latency']),
+                         ['max', 'p50', 'p90', 'p99'])
+
+    def testBadgeClassesAreFetchedOnce(self):
+        site = CountingSite(self.dest)
+        self.verify(site)
+        self.assertEqual(site.fetched.count('badges/no-img.json'), 1)
+        self.assertEqual(site.fetched.count('badges/no-img.html'), 1)
+        self.assertEqual(len(site.fetched), 13)
+
+    def testSiteBuiltWithOtherBaseUrlVerifies(self):
+        project = Project(self.root)
+        project.set_base_url('http://localhost:8000/site')
+        build_website(project, self.dest)
+        self.assertEqual(self.problems(), [])
+
+    def testAssertionProblemsAreFound(self):
+        def tamper(assn):
+            assn['uid'] = 'nope'
+            assn['verify']['url'] = 'http://foo.org/elsewhere.json'
+            assn['badge'] = 'http://evil.org/badge.json'
+            del assn['issuedOn']
+        self.edit_json(tamper, 'assertions', 'foo', 'img.json')
+        url = 'http://foo.org/assertions/foo/img.json'
+        self.assertEqual(self.problems(), [
+            ('http://evil.org/badge.json',
+             'is not part of the site at http://foo.org/'),
+            (url, 'badge is "http://evil.org/badge.json", expected '
+                  '"http://foo.org/badges/img.json"'),
+            (url, 'issuedOn is missing'),
+            (url, 'uid is "nope", expected "foo.img"'),
+            (url, 'verify.url is "http://foo.org/elsewhere.json", '
+                  'expected "http://foo.org/assertions/foo/img.json"'),
+        ])
+
+    def testMissingDocumentsAreFound(self):
+        os.remove(self.dest_path('assertions', 'bar', 'no-img.json'))
+        os.remove(self.dest_path('badges', 'img.png'))
+        open(self.dest_path('assertions', 'foo', 'img.json'),
+             'w').write('[]')
+        open(self.dest_path('assertions', 'quux', 'no-img.json'),
+             'w').write('{')
+        self.edit_json(lambda assn: assn.pop('verify'),
+                       'assertions', 'baz', 'no-img.json')
+        self.assertEqual(self.problems(), [
+            ('http://foo.org/assertions/bar/no-img.json', 'not found'),
+            ('http://foo.org/assertions/baz/no-img.json',
+             'verify.type is null, expected "hosted"'),
+            ('http://foo.org/assertions/baz/no-img.json',
+             'verify.url is null, expected '
+             '"http://foo.org/assertions/baz/no-img.json"'),
+            ('http://foo.org/assertions/foo/img.json',
+             'is not a JSON object'),
+            ('http://foo.org/assertions/quux/no-img.json',
+             'is not a JSON object'),
+        ])
+
+    def testBadgeProblemsAreFound(self):
+        def tamper(badge):
+            badge['issuer'] = 'http://foo.org/other.json'
+            del badge['name']
+        self.edit_json(tamper, 'badges', 'no-img.json')
+        os.remove(self.dest_path('badges', 'no-img.html'))
+        url = 'http://foo.org/badges/no-img.json'
+        self.assertEqual(self.problems(), [
+            ('http://foo.org/badges/no-img.html', 'not found'),
+            (url, 'issuer is "http://foo.org/other.json", expected '
+                  '"http://foo.org/issuer.json"'),
+            (url, 'name is missing'),
+        ])
+
+    def testMissingBadgeIsReportedOnce(self):
+        os.remove(self.dest_path('badges', 'no-img.json'))
+        self.assertEqual(self.problems(), [
+            ('http://foo.org/badges/no-img.json', 'not found')
+        ])
+
+    def testRecipientProblemsAreFound(self):
+        config = open(os.path.join(self.root, 'config.yml')).read()
+        config = config.replace('foo@bar.org', 'foo@baz.org')
+        config = config.replace('  quux: Quux <quux@bar.org>\n', '')
+        open(os.path.join(self.root, 'config.yml'), 'w').write(config)
+        self.edit_json(lambda assn: assn.pop('recipient'),
+                       'assertions', 'bar', 'no-img.json')
+        self.assertEqual(self.problems(), [
+            ('http://foo.org/assertions/bar/no-img.json',
+             'recipient is missing'),
+            ('http://foo.org/assertions/foo/img.json',
+             "recipient does not match foo's email address"),
+            ('http://foo.org/assertions/foo/no-img.json',
+             "recipient does not match foo's email address"),
+            ('http://foo.org/assertions/quux/no-img.json',
+             "recipient 'quux' does not exist"),
+        ])
+
+    def testUnhashedRecipientsAreChecked(self):
+        def unhash(assn):
+            assn['recipient'] = {'type': 'email', 'hashed': False,
+                                 'identity': 'foo@bar.org'}
+        self.edit_json(unhash, 'assertions', 'foo', 'img.json')
+        self.assertEqual(self.problems(), [])
+
+    def testIssuerProblemsAreFound(self):
+        url = 'http://foo.org/issuer.json'
+        self.edit_json(lambda issuer: issuer.pop('name'), 'issuer.json')
+        self.assertEqual(self.problems(), [(url, 'name is missing')])
+        open(self.dest_path('issuer.json'), 'w').write('nope')
+        self.assertTrue((url, 'is not an issuer with a url') in
+                        self.problems())
+        os.remove(self.dest_path('issuer.json'))
+        self.assertTrue((url, 'not found') in self.problems())
+
+class DirectorySiteTests(BaseVerifyTest):
+    def testParentPathsAreRejected(self):
+        site = DirectorySite(self.dest)
+        self.assertRaises(FetchError, site.fetch, 'badges/../../proj')
+
+    def testDirectoriesServeIndexFiles(self):
+        open(self.dest_path('index.html'), 'w').write('hi')
+        self.assertEqual(DirectorySite(self.dest).fetch(''), 'hi')
+
+class HttpSiteTests(BaseVerifyTest):
+    def setUp(self):
+        BaseVerifyTest.setUp(self)
+        self.httpd = server.ThreadingHTTPServer(('127.0.0.1', 0), self.dir)
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       args=(0.01,))
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/dist' % self.httpd.server_port
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+        BaseVerifyTest.tearDown(self)
+
+    def testServedSiteVerifies(self):
+        report = self.verify(HttpSite(self.url))
+        self.assertEqual(report['problems'], [])
+        self.assertEqual(report['fetches'], 12)
+
+    def testErrorsAreRaised(self):
+        site = HttpSite(self.url)
+        self.assertRaises(FetchError, site.fetch, 'nope.json')
+        try:
+            site.fetch('nope.json')
+        except FetchError, e:
+            self.assertEqual(str(e), 'HTTP 404 File not found')
+        site.close()
+        site = HttpSite('http://127.0.0.1:1/')
+        self.assertRaises(FetchError, site.fetch, 'issuer.json')
+        self.assertEqual(site.local.conn, None)
+        site.close()
+
+    def testHttpsIsSupported(self):
+        site = HttpSite('https://example.org')
+        self.assertTrue(isinstance(site.connection(),
+                                   httplib.HTTPSConnection))
+        site.close()
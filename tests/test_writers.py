@@ -0,0 +1,331 @@
+import os
+import gzip
+import json
+import errno
+import fcntl
+import pickle
+import tarfile
+import zipfile
+import tempfile
+import shutil
+import unittest
+from cStringIO import StringIO
+from minimock import mock, restore, Mock
+
+import badgepad.writers
+from badgepad import stats
+from badgepad.writers import make_dirs, serialize, is_archive, \
+                             open_archive, DirectoryWriter, TarWriter, \
+                             ZipWriter, OutputCollector, same_file, \
+                             gzip_compress, compressors, remove_file
+
+class BaseWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        restore()
+
+    def path(self, *path):
+        return os.path.join(self.dir, *path)
+
+    def write(self, content, *path):
+        make_dirs(os.path.dirname(self.path(*path)))
+        f = open(self.path(*path), 'wb')
+        f.write(content)
+        f.close()
+
+class MakeDirsTests(BaseWriterTest):
+    def testExistingDirsAreIgnored(self):
+        make_dirs(self.dir)
+        make_dirs(self.path('a', 'b'))
+        self.assertTrue(os.path.isdir(self.path('a', 'b')))
+
+    def testOtherErrorsAreRaised(self):
+        self.write('', 'file')
+        self.assertRaises(OSError, make_dirs, self.path('file', 'a'))
+
+    def testMissingFilesAreNotRemoved(self):
+        remove_file(self.path('nope'))
+        self.assertRaises(OSError, remove_file, self.dir)
+
+class SerializeTests(unittest.TestCase):
+    def testJsonIsIndented(self):
+        self.assertEqual(serialize({'a': [1]}, 'a.json'),
+                         '{\n "a": [\n  1\n ]\n}')
+
+    def testJsonCanBeCompact(self):
+        self.assertEqual(serialize({'a': [1], 'b': 2}, 'a.json', True),
+                         '{"a":[1],"b":2}')
+
+    def testUnicodeIsEncoded(self):
+        self.assertEqual(serialize(u'\u2026', 'a.html'), '\xe2\x80\xa6')
+
+    def testArchivesAreRecognized(self):
+        self.assertTrue(is_archive('site.tar.gz'))
+        self.assertTrue(is_archive('site.zip'))
+        self.assertFalse(is_archive('dist'))
+
+class DirectoryWriterTests(BaseWriterTest):
+    def counts(self, func, *args):
+        before = stats.snapshot()
+        func(*args)
+        return stats.since(before)
+
+    def testFilesAreWritten(self):
+        writer = DirectoryWriter(self.path('dist'))
+        counts = self.counts(writer.write, {'a': 1}, ('a', 'b.json'))
+        self.assertEqual(json.load(open(self.path('dist', 'a', 'b.json'))),
+                         {'a': 1})
+        self.assertEqual(counts['files_written'], 1)
+        self.assertEqual(os.listdir(self.path('dist', 'a')), ['b.json'])
+
+    def testDirectoriesAreOnlyCreatedOnce(self):
+        writer = DirectoryWriter(self.path('dist'))
+        writer.write('1', ('a', '1.html'))
+        mock('badgepad.writers.make_dirs', raises=AssertionError)
+        writer.write('2', ('a', '2.html'))
+        self.assertEqual(open(self.path('dist', 'a', '2.html')).read(), '2')
+
+    def testUnchangedFilesAreLeftAlone(self):
+        self.write('same', 'dist', 'a.html')
+        os.utime(self.path('dist', 'a.html'), (1, 1))
+        writer = DirectoryWriter(self.path('dist'))
+        counts = self.counts(writer.write, 'same', ('a.html',))
+        self.assertEqual(counts, {'files_unchanged': 1})
+        self.assertEqual(os.path.getmtime(self.path('dist', 'a.html')), 1)
+        writer.write('diff', ('a.html',))
+        self.assertEqual(open(self.path('dist', 'a.html')).read(), 'diff')
+
+    def testUnchangedFilesAreLinkedFromPreviousDir(self):
+        self.write('same', 'old', 'a', 'b.html')
+        writer = DirectoryWriter(self.path('new'), self.path('old'))
+        writer.write('same', ('a', 'b.html'))
+        writer.write('diff', ('a', 'c.html'))
+        self.assertEqual(os.stat(self.path('old', 'a', 'b.html')).st_ino,
+                         os.stat(self.path('new', 'a', 'b.html')).st_ino)
+        self.assertEqual(open(self.path('new', 'a', 'c.html')).read(),
+                         'diff')
+
+    def testFilesAreWrittenIfLinkingFails(self):
+        self.write('same', 'old', 'a.html')
+        mock('os.link', raises=OSError(errno.EXDEV, 'nope'))
+        writer = DirectoryWriter(self.path('new'), self.path('old'))
+        counts = self.counts(writer.write, 'same', ('a.html',))
+        self.assertEqual(counts['files_written'], 1)
+        self.assertEqual(open(self.path('new', 'a.html')).read(), 'same')
+
+    def testFilesAreCopied(self):
+        self.write('png', 'src.png')
+        os.utime(self.path('src.png'), (1, 1))
+        writer = DirectoryWriter(self.path('dist'))
+        counts = self.counts(writer.copy, self.path('src.png'), ('a.png',))
+        self.assertEqual(counts, {'files_copied': 1, 'bytes_copied': 3})
+        self.assertEqual(os.path.getmtime(self.path('dist', 'a.png')), 1)
+        counts = self.counts(writer.copy, self.path('src.png'), ('a.png',))
+        self.assertEqual(counts, {'files_unchanged': 1, 'bytes_skipped': 3})
+
+    def testFilesCanBeHardLinked(self):
+        self.write('png', 'src.png')
+        writer = DirectoryWriter(self.path('dist'), link_mode='hardlink')
+        counts = self.counts(writer.copy, self.path('src.png'), ('a.png',))
+        self.assertEqual(counts, {'files_linked': 1, 'bytes_linked': 3})
+        self.assertEqual(os.stat(self.path('src.png')).st_ino,
+                         os.stat(self.path('dist', 'a.png')).st_ino)
+
+    def testFilesCanBeReflinked(self):
+        self.write('png', 'src.png')
+        mock('fcntl.ioctl')
+        writer = DirectoryWriter(self.path('dist'), link_mode='reflink')
+        counts = self.counts(writer.copy, self.path('src.png'), ('a.png',))
+        self.assertEqual(counts, {'files_linked': 1, 'bytes_linked': 3})
+        self.assertAlmostEqual(os.path.getmtime(self.path('dist', 'a.png')),
+                               os.path.getmtime(self.path('src.png')),
+                               delta=0.001)
+
+    def testFilesAreCopiedIfLinkingIsUnsupported(self):
+        self.write('png', 'src.png')
+        mock('fcntl.ioctl', raises=IOError(errno.EOPNOTSUPP, 'nope'))
+        writer = DirectoryWriter(self.path('dist'), link_mode='reflink')
+        counts = self.counts(writer.copy, self.path('src.png'), ('a.png',))
+        self.assertEqual(counts, {'files_copied': 1, 'bytes_copied': 3})
+        self.assertEqual(open(self.path('dist', 'a.png')).read(), 'png')
+
+    def testUnknownLinkModesAreRejected(self):
+        self.assertRaises(ValueError, DirectoryWriter, self.dir,
+                          link_mode='teleport')
+
+    def testDirectoriesAreForgottenWhenPickled(self):
+        writer = DirectoryWriter(self.path('dist'), compact=True)
+        writer.write('1', ('a', '1.html'))
+        copy = pickle.loads(pickle.dumps(writer))
+        self.assertEqual(copy.dirs, set())
+        self.assertEqual(copy.dest_dir, writer.dest_dir)
+        self.assertTrue(copy.compact)
+        writer.close()
+        writer.abort()
+
+class PrecompressTests(BaseWriterTest):
+    def counts(self, func, *args):
+        before = stats.snapshot()
+        func(*args)
+        return stats.since(before)
+
+    def gunzip(self, *path):
+        return gzip.GzipFile(self.path(*path)).read()
+
+    def testGzipIsDeterministic(self):
+        data = gzip_compress('hello' * 100)
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(data)).read(),
+                         'hello' * 100)
+        self.assertEqual(gzip_compress('hello' * 100), data)
+        self.assertTrue(len(data) < 100)
+
+    def testBrotliIsUsedIfInstalled(self):
+        mock('badgepad.writers.brotli', mock_obj=Mock('brotli'))
+        self.assertEqual([suffix for suffix, compress in compressors()],
+                         ['.gz', '.br'])
+        restore()
+        if badgepad.writers.brotli is None:
+            self.assertEqual([suffix for suffix, compress in compressors()],
+                             ['.gz'])
+
+    def testJsonAndHtmlAreCompressed(self):
+        writer = DirectoryWriter(self.path('dist'), precompress=True)
+        counts = self.counts(writer.write, {'a': 1}, ('a', 'b.json'))
+        self.assertEqual(counts['files_compressed'], 1)
+        writer.write('hi', ('c.html',))
+        writer.write('hi', ('d.txt',))
+        self.assertEqual(json.loads(self.gunzip('dist', 'a', 'b.json.gz')),
+                         {'a': 1})
+        self.assertEqual(self.gunzip('dist', 'c.html.gz'), 'hi')
+        self.assertFalse(os.path.exists(self.path('dist', 'd.txt.gz')))
+
+    def testUnchangedFilesAreNotRecompressed(self):
+        writer = DirectoryWriter(self.path('dist'), precompress=True)
+        writer.write('same', ('a.html',))
+        writer.write('same', ('b.html',))
+        os.utime(self.path('dist', 'a.html.gz'), (1, 1))
+        os.remove(self.path('dist', 'b.html.gz'))
+        counts = self.counts(writer.write, 'same', ('a.html',))
+        self.assertEqual(counts, {'files_unchanged': 1,
+                                  'files_compressed_unchanged': 1})
+        self.assertEqual(os.path.getmtime(self.path('dist', 'a.html.gz')), 1)
+        counts = self.counts(writer.write, 'same', ('b.html',))
+        self.assertEqual(counts['files_compressed'], 1)
+        self.assertEqual(self.gunzip('dist', 'b.html.gz'), 'same')
+        writer.write('diff', ('a.html',))
+        self.assertEqual(self.gunzip('dist', 'a.html.gz'), 'diff')
+
+    def testUnchangedVariantsAreLinkedFromPreviousDir(self):
+        DirectoryWriter(self.path('old'), precompress=True).write(
+            'same', ('a.html',)
+        )
+        writer = DirectoryWriter(self.path('new'), self.path('old'),
+                                 precompress=True)
+        counts = self.counts(writer.write, 'same', ('a.html',))
+        self.assertFalse('files_compressed' in counts)
+        self.assertEqual(os.stat(self.path('old', 'a.html.gz')).st_ino,
+                         os.stat(self.path('new', 'a.html.gz')).st_ino)
+
+    def testStaleVariantsAreRemoved(self):
+        DirectoryWriter(self.path('dist'), precompress=True).write(
+            'old', ('a.html',)
+        )
+        writer = DirectoryWriter(self.path('dist'))
+        writer.write('old', ('a.html',))
+        self.assertTrue(os.path.exists(self.path('dist', 'a.html.gz')))
+        writer.write('new', ('a.html',))
+        self.assertEqual(os.listdir(self.path('dist')), ['a.html'])
+
+    def testArchivesGetVariants(self):
+        writer = open_archive(self.path('site.zip'), precompress=True)
+        writer.write('hi', ('a', 'b.html'))
+        writer.close()
+        archive = zipfile.ZipFile(self.path('site.zip'))
+        self.assertEqual(archive.namelist(), ['a/b.html', 'a/b.html.gz'])
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(
+            archive.read('a/b.html.gz')
+        )).read(), 'hi')
+        archive.close()
+
+class SameFileTests(BaseWriterTest):
+    def setUp(self):
+        BaseWriterTest.setUp(self)
+        self.write('abc', 'a')
+        os.utime(self.path('a'), (1, 1))
+
+    def copy(self, content, mtime):
+        self.write(content, 'b')
+        os.utime(self.path('b'), (mtime, mtime))
+        return same_file(self.path('b'), self.path('a'))
+
+    def testMissingFilesDiffer(self):
+        self.assertFalse(same_file(self.path('b'), self.path('a')))
+
+    def testLinkedFilesAreSame(self):
+        os.link(self.path('a'), self.path('b'))
+        self.assertTrue(same_file(self.path('b'), self.path('a')))
+
+    def testFilesOfDifferentSizesDiffer(self):
+        self.assertFalse(self.copy('abcd', 1))
+
+    def testFilesWithSameSizeAndMtimeAreSame(self):
+        self.assertTrue(self.copy('xyz', 1))
+
+    def testOtherwiseContentsAreCompared(self):
+        self.assertTrue(self.copy('abc', 2))
+        self.assertFalse(self.copy('xyz', 2))
+
+class ArchiveWriterTests(BaseWriterTest):
+    def fill(self, filename, **kwargs):
+        self.write('png', 'src.png')
+        writer = open_archive(self.path(filename), **kwargs)
+        writer.write({'a': 1}, ('a', 'b.json'))
+        writer.write(u'\u2026', ('c.html',))
+        writer.copy(self.path('src.png'), ('d', 'e.png'))
+        self.assertFalse(os.path.exists(self.path(filename)))
+        writer.close()
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         sorted([filename, 'src.png']))
+        return writer
+
+    def testTarArchivesAreWritten(self):
+        for suffix in ('.tar', '.tar.gz', '.tar.bz2'):
+            self.assertTrue(isinstance(self.fill('site' + suffix),
+                                       TarWriter))
+            tar = tarfile.open(self.path('site' + suffix))
+            self.assertEqual(tar.getnames(),
+                             ['a/b.json', 'c.html', 'd/e.png'])
+            self.assertEqual(tar.extractfile('c.html').read(),
+                             '\xe2\x80\xa6')
+            self.assertEqual(tar.extractfile('d/e.png').read(), 'png')
+            tar.close()
+            os.remove(self.path('site' + suffix))
+
+    def testZipArchivesAreWritten(self):
+        self.assertTrue(isinstance(self.fill('site.zip', compact=True),
+                                   ZipWriter))
+        archive = zipfile.ZipFile(self.path('site.zip'))
+        self.assertEqual(archive.namelist(),
+                         ['a/b.json', 'c.html', 'd/e.png'])
+        self.assertEqual(archive.read('a/b.json'), '{"a":1}')
+        archive.close()
+
+    def testAbortedArchivesAreRemoved(self):
+        writer = open_archive(self.path('site.zip'))
+        writer.write('hi', ('a.html',))
+        writer.abort()
+        self.assertEqual(os.listdir(self.dir), [])
+
+class OutputCollectorTests(BaseWriterTest):
+    def testOutputsAreReplayed(self):
+        self.write('png', 'src.png')
+        collector = OutputCollector()
+        collector.write('hi', ('a.html',))
+        collector.copy(self.path('src.png'), ('b.png',))
+        writer = DirectoryWriter(self.path('dist'))
+        collector.replay(writer)
+        self.assertEqual(sorted(os.listdir(self.path('dist'))),
+                         ['a.html', 'b.png'])